@@ -0,0 +1,158 @@
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+import json
+import threading
+
+import metrics
+import result_store
+import scan_engine
+import scheduler
+
+# Headless JSON API over the result store.  Jobs, hosts and ports are listed a
+# page at a time with opaque cursors; each page is streamed straight from a
+# database cursor, so a job with millions of ports costs no more memory to page
+# through than one with ten.
+#
+#   GET  /api/jobs                    ?status=running&kind=sweep
+#   GET  /api/jobs/<id>
+#   GET  /api/jobs/<id>/hosts         ?os=Linux&fields=ip_address,os
+#   GET  /api/jobs/<id>/ports         ?port=22,8000-8100&state=open&cursor=...
+#   POST /api/jobs                    {"targets": [...], "ports": "1-1024"}
+#
+# Every list takes limit, cursor and fields; any other query parameter filters.
+
+# Items per page, unless the request asks for fewer (or up to MAX_PAGE_SIZE more)
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+def page_request(args):
+    """The limit, cursor, fields and filters of a list request; ValueError if invalid"""
+    try:
+        limit = int(args.get('limit', PAGE_SIZE))
+    except ValueError:
+        raise ValueError(f"limit must be a number, got {args.get('limit')!r}")
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    fields = [field.strip() for field in args.get('fields', '').split(',') if field.strip()]
+    filters = {key: value for key, value in args.items() if key not in ('limit', 'cursor', 'fields')}
+    return limit, args.get('cursor'), fields, filters
+
+def stream_page(page):
+    """Yield a page as JSON, one item at a time, ending with the next cursor"""
+    yield '{"items": ['
+    for count, item in enumerate(page):
+        yield (',\n' if count else '\n') + json.dumps(item)
+    yield '\n], "next_cursor": ' + json.dumps(page.next_cursor) + '}\n'
+
+def list_resource(resource, job_id=None):
+    store = result_store.get_store()
+    try:
+        # Checked before the response starts, so mistakes get a 400 and not half a page
+        limit, cursor, fields, filters = page_request(request.args)
+        page = store.page(resource, cursor, limit, fields, filters, job_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(stream_with_context(stream_page(page)), content_type='application/json')
+
+def known_job(job_id):
+    """The job, or a 404 response to return instead"""
+    job = result_store.get_store().get_job(job_id)
+    if job is None:
+        return None, (jsonify({'error': f"No such job: {job_id}"}), 404)
+    return job, None
+
+@api.route('/jobs')
+def list_jobs():
+    return list_resource('jobs')
+
+@api.route('/jobs/<int:job_id>')
+def get_job(job_id):
+    job, missing = known_job(job_id)
+    return missing or jsonify(job)
+
+@api.route('/jobs/<int:job_id>/hosts')
+def list_hosts(job_id):
+    _, missing = known_job(job_id)
+    return missing or list_resource('hosts', job_id)
+
+@api.route('/jobs/<int:job_id>/ports')
+def list_ports(job_id):
+    _, missing = known_job(job_id)
+    return missing or list_resource('ports', job_id)
+
+@api.route('/jobs', methods=['POST'])
+def create_job():
+    """Start a multi-target scan in the background and return its job id"""
+    # Only API scans need the command-line scanner's host stages
+    import domain_scanner
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        metrics.SCAN_REQUESTS.inc(status='invalid')
+        return jsonify({'error': 'Expected a JSON object like {"targets": [...]}'}), 400
+    targets = data.get('targets')
+    if isinstance(targets, str):
+        targets = [targets]
+    if not targets or not all(isinstance(target, str) and target.strip() for target in targets):
+        metrics.SCAN_REQUESTS.inc(status='invalid')
+        return jsonify({'error': 'Please provide a list of targets'}), 400
+    targets = [target.strip() for target in targets]
+    port_spec = data.get('ports', '1-1024')
+    # Nobody waits on a background job, so it yields to scans from the page
+    priority = data.get('priority', scheduler.BULK)
+    if priority not in scheduler.PRIORITIES:
+        metrics.SCAN_REQUESTS.inc(status='invalid')
+        return jsonify({'error': f"Unknown priority: {priority} (choose from {', '.join(scheduler.PRIORITIES)})"}), 400
+    try:
+        options = domain_scanner.scan_options(port_spec, host_budget=data.get('host_budget'),
+                                              banners=bool(data.get('banners')))
+    except (TypeError, ValueError) as e:
+        metrics.SCAN_REQUESTS.inc(status='invalid')
+        return jsonify({'error': f"Invalid scan options: {e}"}), 400
+
+    try:
+        job = scheduler.admit(request.remote_addr or 'unknown', priority=priority)
+    except scheduler.AdmissionError as e:
+        metrics.SCAN_REQUESTS.inc(status='rejected')
+        return jsonify({'error': str(e)}), 429 if e.reason == 'client_quota' else 503
+
+    job_id = None
+    try:
+        store = result_store.get_store()
+        job_id = store.create_job('sweep', ','.join(targets), port_spec)
+        # The job's probes go through the scheduler like those of any other scan
+        options['executor'] = job
+        threading.Thread(target=run_job, args=(store, job_id, job, targets, options),
+                         name=f"api-job-{job_id}", daemon=True).start()
+    except (result_store.StoreError, RuntimeError) as e:
+        # Nothing will run the job, so give back its scheduler slot and the client's quota
+        job.close()
+        if job_id is not None:
+            try:
+                store.finish_job(job_id, 'failed', str(e))
+            except result_store.StoreError:
+                pass
+        metrics.SCAN_REQUESTS.inc(status='error')
+        return jsonify({'error': f"Could not start the scan: {e}"}), 503
+    metrics.SCAN_REQUESTS.inc(status='accepted')
+    return jsonify({'job_id': job_id, 'status': 'running'}), 202
+
+def run_job(store, job_id, job, targets, options):
+    """Scan every target of an API job into the result store"""
+    import domain_scanner
+
+    writer = store.writer(job_id)
+    status, error = 'done', None
+    try:
+        with job:
+            for target in targets:
+                domain_scanner.scan_target(target, writer, options)
+    except scan_engine.ResourceExhausted as e:
+        status, error = 'failed', f"Scanner is out of sockets ({e})"
+    except Exception as e:
+        status, error = 'failed', str(e)
+    finally:
+        # Everything found is committed before the job says it is finished
+        writer.close()
+    store.finish_job(job_id, status, error)
@@ -2,10 +2,19 @@ from flask import Flask, render_template, request, jsonify
 import socket
 import platform
 import subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 
-app = Flask(__name__, instance_path='E:/reconinsance/instance')
+import deadlines
+import metrics
+import passive_os
+import scan_engine
+import tracing
+import web_scans
+from api import api
+
+app = Flask(__name__)
+app.register_blueprint(api)
+app.register_blueprint(web_scans.blueprint)
 
 def get_ip_address(domain):
     """Get IP address for a given domain name"""
@@ -17,38 +26,16 @@ def get_ip_address(domain):
 
 def scan_port(ip, port):
     """Scan a single port on the given IP address"""
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(1)
-        result = sock.connect_ex((ip, port))
-        sock.close()
-        return port if result == 0 else None
-    except Exception:
-        return None
+    return scan_engine.scan_port(ip, port, timeout=1)
 
-def scan_ports(ip, start_port=1, end_port=1024):
-    """Scan ports on the given IP address"""
-    open_ports = []
-    
-    # Use ThreadPoolExecutor for concurrent port scanning
-    with ThreadPoolExecutor(max_workers=100) as executor:
-        # Submit all port scanning tasks
-        future_to_port = {
-            executor.submit(scan_port, ip, port): port 
-            for port in range(start_port, end_port + 1)
-        }
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_port):
-            port = future_to_port[future]
-            try:
-                result = future.result()
-                if result is not None:
-                    open_ports.append(result)
-            except Exception:
-                pass
-    
-    return sorted(open_ports)
+def scan_ports(ip, start_port=1, end_port=1024, executor=None, deadline=None):
+    """Scan ports on the given IP address, returning the open ones and a summary of every state"""
+    # Same engine as the command-line scanner
+    timing = scan_engine.get_timing('normal')
+    # Probes run on the process-wide pool (through the request's scan job when
+    # there is one), so concurrent requests don't each start threads
+    return scan_engine.scan_port_states(ip, scan_engine.ordered_port_range(start_port, end_port),
+                                        executor=executor, deadline=deadline, **timing)
 
 @app.route('/')
 def index():
@@ -95,27 +82,56 @@ def scan():
     domain = data.get('domain', '').strip()
     
     if not domain:
+        metrics.SCAN_REQUESTS.inc(status='invalid')
         return jsonify({'error': 'Please provide a domain name'}), 400
     
+    return web_scans.handle_scan(data, (domain.lower(),), perform_scan, domain)
+
+def perform_scan(domain, budget=None, job=None):
+    """Run every scan stage for one domain and return the response body and status
+
+    The stages share one wall-clock budget; the response is marked partial when
+    a stage ran out of its share.
+    """
+    deadline = deadlines.Deadline(budget)
+    executor = scan_engine.get_shared_executor()
+    
     # Get IP address
-    ip_address = get_ip_address(domain)
+    with tracing.stage('dns', target=domain):
+        ip_address = deadline.stage('dns').call(
+            executor, "Error resolving domain: timed out", get_ip_address, domain)
     
     # If IP resolution failed, return error
     if "Error" in str(ip_address):
-        return jsonify({'error': ip_address}), 400
+        metrics.SCAN_REQUESTS.inc(status='dns_error')
+        return {'error': ip_address}, 504 if deadline.partial else 400
     
     # Detect OS
-    os_details = detect_os(ip_address)
+    with tracing.stage('os_detection', target=ip_address):
+        os_details = deadline.stage('os_detection').call(
+            executor, "OS detection timeout", detect_os, ip_address)
     
-    # Scan ports
-    open_ports = scan_ports(ip_address)
+    # Scan ports (the engine records the port sweep stage itself) with what is left,
+    # fingerprinting the OS from the SYN-ACKs the sweep triggers
+    with passive_os.observe(ip_address) as observer:
+        open_ports, port_states = scan_ports(ip_address, executor=job, deadline=deadline.stage('port_sweep'))
+    with tracing.stage('passive_os', target=ip_address):
+        os_fingerprint = observer.fingerprint(open_ports, deadline=deadline.stage('passive_os'))
     
-    return jsonify({
+    metrics.SCAN_REQUESTS.inc(status='partial' if deadline.partial else 'ok')
+    result = {
         'domain': domain,
         'ip_address': ip_address,
         'os_details': os_details,
-        'open_ports': open_ports
-    })
+        'os_fingerprint': os_fingerprint,
+        'open_ports': open_ports,
+        'port_states': port_states.to_dict(),
+        'partial': deadline.partial,
+        'deadline': deadline.to_dict()
+    }
+    # Kept in the result store, so large results can be paged through /api/jobs/<job_id>/ports
+    result['job_id'] = web_scans.store_scan(domain, result)
+    return result, 200
 
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,410 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import scan_engine
+from scan_engine import iter_open_ports, configure_shared_executor
+from domain_scanner import detect_os_details, grab_open_banners
+from probe_plans import get_plan
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Scenarios measured by default and the concurrency levels each one is run at
+SCENARIOS = ["scan_ports", "banners", "detect_os"]
+DEFAULT_CONCURRENCY = "50,200,1000"
+
+# Work done at every concurrency level, so the levels are comparable: banners
+# grabbed (spread over the open ports) and hosts run through OS detection
+BANNER_GRABS = 2000
+DETECT_OS_HOSTS = 200
+
+# Cold-start budget: how much longer than a bare interpreter the CLI may take
+# to start, and modules only optional stages may load (never plain start-up)
+COLD_START_BUDGET_MS = 100
+COLD_START_FORBIDDEN = ["flask", "asyncio", "ssl", "http.client", "urllib.request", "xml.sax",
+                        "concurrent.futures", "logging", "subprocess", "platform", "sqlite3", "yaml"]
+
+# Set when the benchmark has re-executed itself inside a private network namespace
+NETNS_ENV = "RECON_BENCH_IN_NETNS"
+
+class FakeTarget:
+    """Local listeners that stand in for a scanned host"""
+
+    def __init__(self, open_ports=20, banner=b"SSH-2.0-OpenSSH_9.6 FakeTarget\r\n",
+                 latency=0.0, loss=0.0, host="127.0.0.1"):
+        self.host = host
+        self.banner = banner
+        self.latency = latency
+        self.loss = loss
+        self.listeners = []
+        self.running = True
+
+        for _ in range(open_ports):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, 0))
+            sock.listen(128)
+            sock.settimeout(0.2)
+            self.listeners.append(sock)
+            threading.Thread(target=self.serve, args=(sock,), daemon=True).start()
+
+    @property
+    def ports(self):
+        return sorted(sock.getsockname()[1] for sock in self.listeners)
+
+    def serve(self, listener):
+        """Accept connections and answer with a banner after the injected latency"""
+        while self.running:
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self.answer, args=(conn,), daemon=True).start()
+
+    def answer(self, conn):
+        try:
+            # Injected loss: the peer accepts and then goes silent
+            if random.random() < self.loss:
+                time.sleep(5)
+                return
+            if self.latency:
+                time.sleep(self.latency)
+            conn.sendall(self.banner)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def port_range(self, extra_closed=2000):
+        """A port range covering every open port plus a block of closed ones"""
+        ports = self.ports
+        start = max(1, ports[0] - extra_closed // 2)
+        end = min(65535, ports[-1] + extra_closed // 2)
+        return range(start, end + 1)
+
+    def close(self):
+        self.running = False
+        for sock in self.listeners:
+            sock.close()
+
+def enter_netem_namespace(argv, delay_ms, loss_pct):
+    """Re-run the benchmark in a private network namespace with netem on its loopback"""
+    if os.environ.get(NETNS_ENV):
+        # Already inside: bring loopback up and shape it
+        netem = ["tc", "qdisc", "add", "dev", "lo", "root", "netem"]
+        if delay_ms:
+            netem += ["delay", f"{delay_ms}ms"]
+        if loss_pct:
+            netem += ["loss", f"{loss_pct}%"]
+        try:
+            subprocess.run(["ip", "link", "set", "lo", "up"], check=True)
+            subprocess.run(netem, check=True)
+        except subprocess.CalledProcessError as e:
+            sys.exit(f"Could not set up netem ({' '.join(e.cmd)}): is the sch_netem kernel module available?")
+        return False
+
+    for tool in ["unshare", "ip", "tc"]:
+        if not shutil.which(tool):
+            sys.exit(f"--netem needs '{tool}' (Linux with iproute2, run as root)")
+
+    env = dict(os.environ, **{NETNS_ENV: "1"})
+    result = subprocess.run(["unshare", "--net", "--", sys.executable, os.path.abspath(__file__)] + argv,
+                            env=env)
+    sys.exit(result.returncode)
+
+def current_rss_kb():
+    """Resident set size of this process in KB, or None when unknown"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource:
+        # Peak rather than current, but better than nothing (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == "darwin" else peak
+    return None
+
+def measure(run):
+    """Run a scenario and record wall time, CPU time, RSS and time to first result"""
+    first_result = []
+    start_rss = current_rss_kb()
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+
+    def on_result():
+        if not first_result:
+            first_result.append(time.perf_counter() - start)
+
+    items = run(on_result)
+
+    elapsed = time.perf_counter() - start
+    end_rss = current_rss_kb()
+    return {
+        "items": items,
+        "seconds": round(elapsed, 4),
+        "items_per_sec": round(items / elapsed, 1) if elapsed else None,
+        "time_to_first_result": round(first_result[0], 4) if first_result else None,
+        "cpu_seconds": round(time.process_time() - start_cpu, 4),
+        "rss_kb": end_rss,
+        "rss_growth_kb": end_rss - start_rss if end_rss is not None and start_rss is not None else None
+    }
+
+def bench_scan_ports(target, concurrency, timeout):
+    """Sweep the fake target's port range"""
+    ports = target.port_range()
+
+    def run(on_result):
+        for _ in iter_open_ports(target.host, ports, timeout, concurrency):
+            on_result()
+        return len(ports)
+
+    return measure(run)
+
+class CountingWriter:
+    """Stands in for the scanner's output writer and reports every finding"""
+
+    def __init__(self, on_result):
+        self.on_result = on_result
+
+    def stage(self, message):
+        pass
+
+    def write(self, record):
+        self.on_result()
+
+def bench_banners(target, concurrency, timeout):
+    """Grab BANNER_GRABS banners from the fake target's open ports, as --banners does
+
+    The grabs run on a pool of `concurrency` threads, the way they run on the
+    shared scan pool in the scanner.
+    """
+    ports = [target.ports[i % len(target.ports)] for i in range(BANNER_GRABS)]
+
+    def run(on_result):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            grab_open_banners(target.host, target.host, ports, CountingWriter(on_result),
+                              executor=executor, timeout=timeout)
+        return len(ports)
+
+    return measure(run)
+
+def retarget_plan(plan, ports):
+    """A copy of an os_ports or banners plan whose well-known ports map onto `ports`
+
+    Without it the plans would probe whatever happens to listen on this
+    machine's ports 22, 80, 443, ... instead of the fake target.
+    """
+    known = sorted({probe.port for probe in plan.probes}
+                   | {port for rule in plan.rules for port in rule.all_ports | rule.any_ports | rule.no_ports})
+    mapping = {port: ports[index % len(ports)] for index, port in enumerate(known)}
+    probes = tuple(probe._replace(port=mapping[probe.port]) for probe in plan.probes)
+    rules = tuple(rule._replace(all_ports=frozenset(mapping[p] for p in rule.all_ports),
+                                any_ports=frozenset(mapping[p] for p in rule.any_ports),
+                                no_ports=frozenset(mapping[p] for p in rule.no_ports)) for rule in plan.rules)
+    return plan._replace(probes=probes, rules=rules)
+
+def bench_detect_os(target, concurrency, timeout):
+    """Run OS detection DETECT_OS_HOSTS times against the fake target, `concurrency` hosts at once
+
+    Levels above DETECT_OS_HOSTS would measure the same run, so they are skipped (None).
+    """
+    if concurrency > DETECT_OS_HOSTS:
+        return None
+    port_plan = retarget_plan(get_plan('os_ports'), target.ports)._replace(timeout=timeout)
+    service_plan = retarget_plan(get_plan('services'), target.ports)._replace(timeout=timeout)
+
+    def run(on_result):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(detect_os_details, target.host, None, port_plan, service_plan)
+                       for _ in range(DETECT_OS_HOSTS)]
+            for future in futures:
+                future.result()
+                on_result()
+        return len(futures)
+
+    return measure(run)
+
+BENCHMARKS = {
+    "scan_ports": bench_scan_ports,
+    "banners": bench_banners,
+    "detect_os": bench_detect_os
+}
+
+def run_benchmarks(scenarios, concurrency_levels, open_ports=20, latency=0.0, loss=0.0,
+                   timeout=0.5, repeat=1):
+    """Run every scenario at every concurrency level against a fresh fake target"""
+    # The scanner sizes its shared pool for the concurrency it needs before it
+    # starts scanning; do the same for the highest level measured
+    try:
+        configure_shared_executor(max(scan_engine.SHARED_PROBE_THREADS, max(concurrency_levels)))
+    except RuntimeError:
+        # Already running (benchmarks run twice in one process)
+        pass
+    target = FakeTarget(open_ports=open_ports, latency=latency, loss=loss)
+    results = []
+    try:
+        for scenario in scenarios:
+            for concurrency in concurrency_levels:
+                # Keep the best of several runs to cut noise
+                runs = [BENCHMARKS[scenario](target, concurrency, timeout) for _ in range(repeat)]
+                if None in runs:
+                    # Not measurable at this level
+                    continue
+                best = min(runs, key=lambda r: r["seconds"])
+                results.append(dict(best, scenario=scenario, concurrency=concurrency))
+    finally:
+        target.close()
+    return results
+
+def startup_modules(module="domain_scanner"):
+    """Names of every module loaded by importing the given module in a fresh interpreter"""
+    output = subprocess.run([sys.executable, "-c", f"import sys, {module}; print(' '.join(sys.modules))"],
+                            capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return set(output.split())
+
+def forbidden_modules(loaded):
+    """The modules (or their submodules) from COLD_START_FORBIDDEN that were loaded"""
+    return sorted(name for name in COLD_START_FORBIDDEN
+                  if any(m == name or m.startswith(name + ".") for m in loaded))
+
+def measure_cold_start(runs=10):
+    """Median start-up time of the CLI and of a bare interpreter, in milliseconds"""
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def median_ms(cmd):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True, cwd=here)
+            times.append(time.perf_counter() - start)
+        return round(sorted(times)[len(times) // 2] * 1000, 1)
+
+    bare = median_ms([sys.executable, "-c", "pass"])
+    cli = median_ms([sys.executable, os.path.join(here, "domain_scanner.py"), "--help"])
+    loaded = startup_modules()
+    forbidden = forbidden_modules(loaded)
+    return {"interpreter_ms": bare, "cli_ms": cli, "overhead_ms": round(cli - bare, 1),
+            "budget_ms": COLD_START_BUDGET_MS, "module_count": len(loaded), "forbidden_modules": forbidden}
+
+def check_cold_start(runs=10):
+    """Print the CLI's cold-start cost and return whether it is within budget"""
+    result = measure_cold_start(runs)
+    print(f"interpreter {result['interpreter_ms']} ms, CLI {result['cli_ms']} ms, "
+          f"overhead {result['overhead_ms']} ms (budget {result['budget_ms']} ms), "
+          f"{result['module_count']} modules loaded")
+    ok = result["overhead_ms"] <= result["budget_ms"] and not result["forbidden_modules"]
+    if result["forbidden_modules"]:
+        print(f"Loaded at start-up but only needed by optional stages: {', '.join(result['forbidden_modules'])}")
+    return ok
+
+def print_results(results):
+    """Print benchmark results as a table"""
+    header = f"{'scenario':<12}{'conc':>6}{'items':>8}{'seconds':>10}{'items/s':>11}{'first':>9}{'cpu s':>9}{'rss KB':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        first = f"{r['time_to_first_result']:.4f}" if r["time_to_first_result"] is not None else "-"
+        rss = r["rss_kb"] if r["rss_kb"] is not None else "-"
+        print(f"{r['scenario']:<12}{r['concurrency']:>6}{r['items']:>8}{r['seconds']:>10.4f}"
+              f"{r['items_per_sec'] or 0:>11.1f}{first:>9}{r['cpu_seconds']:>9.4f}{rss:>10}")
+
+def compare_results(results, baseline_path, tolerance):
+    """Compare throughput against a saved baseline and list the regressions"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for r in results:
+        old = baseline.get((r["scenario"], r["concurrency"]))
+        if not old or not old.get("items_per_sec") or not r["items_per_sec"]:
+            continue
+        change = r["items_per_sec"] / old["items_per_sec"] - 1
+        if change < -tolerance:
+            regressions.append(f"{r['scenario']} @ {r['concurrency']}: "
+                               f"{old['items_per_sec']} -> {r['items_per_sec']} items/s ({change:+.0%})")
+    return regressions
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Benchmark the scanner against local fake targets")
+    parser.add_argument("-s", "--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma separated scenarios (default: {','.join(SCENARIOS)})")
+    parser.add_argument("-c", "--concurrency", default=DEFAULT_CONCURRENCY,
+                        help=f"comma separated concurrency levels (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--open-ports", type=int, default=20,
+                        help="number of open ports on the fake target (default: 20)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the fake target waits before sending its banner")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="fraction of connections the fake target never answers (0-1)")
+    parser.add_argument("--timeout", type=float, default=0.5,
+                        help="connect timeout used by the scanner (default: 0.5)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="runs per measurement, the fastest is kept (default: 1)")
+    parser.add_argument("--netem", action="store_true",
+                        help="run inside a private network namespace and apply --netem-delay/--netem-loss "
+                             "to its loopback with tc (Linux, root)")
+    parser.add_argument("--netem-delay", type=float, default=0.0, metavar="MS",
+                        help="packet delay in milliseconds for --netem")
+    parser.add_argument("--netem-loss", type=float, default=0.0, metavar="PCT",
+                        help="packet loss in percent for --netem")
+    parser.add_argument("-o", "--output", default=None,
+                        help="save results as JSON for later comparison")
+    parser.add_argument("--compare", default=None, metavar="BASELINE",
+                        help="compare against a saved JSON baseline and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed throughput drop before --compare fails (default: 0.2)")
+    parser.add_argument("--cold-start", action="store_true",
+                        help=f"only check the CLI's start-up time against the {COLD_START_BUDGET_MS} ms budget")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    if args.cold_start:
+        return 0 if check_cold_start() else 1
+    if args.netem:
+        enter_netem_namespace(argv, args.netem_delay, args.netem_loss)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"Unknown scenario: {', '.join(unknown)} (choose from {', '.join(BENCHMARKS)})")
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+
+    results = run_benchmarks(scenarios, concurrency_levels, args.open_ports, args.latency,
+                             args.loss, args.timeout, args.repeat)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "python": sys.version.split()[0],
+                       "platform": sys.platform, "results": results}, f, indent=2)
+
+    if args.compare:
+        regressions = compare_results(results, args.compare, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+
+import metrics
+import tracing
+
+# A scan gets one wall-clock budget that its stages share.  Each stage may use
+# its share of whatever is left when it starts; when a stage runs out, its
+# in-flight probes are dropped and the scan carries on (or returns) with what
+# it has, marked as partial, so a slow target can't hold a request for minutes.
+
+# Budget for one scan started by the web apps, and the most a request may ask for
+SCAN_BUDGET = float(os.environ.get('RECON_SCAN_BUDGET', '60'))
+MAX_SCAN_BUDGET = float(os.environ.get('RECON_MAX_SCAN_BUDGET', '300'))
+
+# Share of the remaining budget a stage may use.  The port sweep and the UDP
+# sweep get everything that is left; the stages after the port sweep (passive
+# OS fingerprinting, banners, UDP) only get what the sweep didn't use.
+STAGE_SHARES = {
+    'dns': 0.1,
+    'reverse_dns': 0.1,
+    'banner': 0.2,
+    'os_detection': 0.25,
+    'port_sweep': 1.0,
+    'passive_os': 0.25,
+    'udp_sweep': 1.0,
+}
+
+class Deadline:
+    """The wall-clock budget of one scan, split across its stages"""
+
+    def __init__(self, seconds=None, shares=None):
+        self.seconds = SCAN_BUDGET if seconds is None else seconds
+        self.shares = shares or STAGE_SHARES
+        self.started = time.monotonic()
+        self.expires = self.started + self.seconds
+        # stage -> what it didn't get to (e.g. ports not scanned), for the result
+        self.timed_out = {}
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    @property
+    def partial(self):
+        return bool(self.timed_out)
+
+    def stage(self, name):
+        """A deadline for one stage: its share of what is left, never past the scan's"""
+        share = self.shares.get(name, 1.0)
+        return StageDeadline(self, name, time.monotonic() + self.remaining() * share)
+
+    def expire(self, stage, unfinished=None):
+        """Record that a stage was cut short, with what it didn't finish"""
+        with self.lock:
+            self.timed_out[stage] = unfinished
+        metrics.STAGE_DEADLINES_EXCEEDED.inc(stage=stage)
+
+    def to_dict(self):
+        return {'budget_seconds': self.seconds,
+                'elapsed_seconds': round(time.monotonic() - self.started, 3),
+                'timed_out_stages': dict(self.timed_out)}
+
+class StageDeadline:
+    """The part of a scan's budget one stage may use"""
+
+    def __init__(self, deadline, name, expires):
+        self.deadline = deadline
+        self.name = name
+        self.expires = expires
+        self.cut_short = False
+        self.unfinished = None
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def expire(self, unfinished=None):
+        self.cut_short = True
+        self.unfinished = unfinished
+        self.deadline.expire(self.name, unfinished)
+
+    def wait(self, future, default, unfinished=None):
+        """The future's result, or `default` (cancelling it) once the stage is out of time
+
+        `unfinished` is recorded as what the stage didn't get to when it runs out.
+        """
+        # concurrent.futures pulls in logging; only pay for it once something scans
+        from concurrent.futures import TimeoutError as FutureTimeout
+        try:
+            return future.result(timeout=self.remaining())
+        except FutureTimeout:
+            # Only drops the work if it hasn't started: a probe that is already
+            # running holds its pool thread until its own socket timeout ends it,
+            # which is why stages also clamp their probe timeouts to remaining()
+            future.cancel()
+            self.expire(unfinished)
+            return default
+
+    def call(self, executor, default, fn, *args):
+        """Run fn on the executor, giving up on it with `default` when the stage is out of time"""
+        return self.wait(executor.submit(tracing.follow(fn), *args), default)
+
+def scan_budget(seconds=None):
+    """The budget for one scan: a requested number of seconds capped at MAX_SCAN_BUDGET"""
+    if seconds is None:
+        return SCAN_BUDGET
+    seconds = float(seconds)
+    if not seconds > 0:
+        raise ValueError("The scan budget must be a positive number of seconds")
+    return min(seconds, MAX_SCAN_BUDGET)
@@ -0,0 +1,185 @@
+import json
+import os
+import random
+import sys
+import time
+
+from scan_engine import scan_port_list, grab_banner, ordered_port_range
+
+# Where the previous result for every host is kept between runs
+HISTORY_DIR = "scan_history"
+
+# How many historically closed ports are spot-checked on an incremental run
+CLOSED_SAMPLE_SIZE = 256
+
+# Force a full sweep at least this often, even when nothing looks different
+FULL_SCAN_INTERVAL = 7 * 24 * 60 * 60
+
+def history_path(ip_address, history_dir=HISTORY_DIR):
+    """Get the history file used for a given IP address"""
+    safe_name = ip_address.replace(":", "_").replace("/", "_")
+    return os.path.join(history_dir, f"{safe_name}.json")
+
+def load_previous_result(ip_address, history_dir=HISTORY_DIR):
+    """Load the stored result of the last scan of a host, or None"""
+    try:
+        with open(history_path(ip_address, history_dir), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_scan_result(result, history_dir=HISTORY_DIR):
+    """Store a scan result so the next run can diff against it"""
+    os.makedirs(history_dir, exist_ok=True)
+    path = history_path(result["ip_address"], history_dir)
+
+    # Write to a temp file first so an interrupted run never leaves half a file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def sample_closed_ports(known_open, start_port, end_port, sample_size=CLOSED_SAMPLE_SIZE):
+    """Pick a random sample of ports that were closed last time"""
+    total = end_port - start_port + 1
+    if total - len(known_open) <= sample_size:
+        return [p for p in range(start_port, end_port + 1) if p not in known_open]
+
+    # Rejection sampling keeps this cheap even for the full 65535 range
+    sample = set()
+    while len(sample) < sample_size:
+        port = random.randint(start_port, end_port)
+        if port not in known_open:
+            sample.add(port)
+    return sorted(sample)
+
+def grab_banners(ip_address, ports):
+    """Grab banners for every given open port"""
+    banners = {}
+    for port in ports:
+        banner = grab_banner(ip_address, port)
+        if banner:
+            banners[str(port)] = banner
+    return banners
+
+def port_spec(start_port, end_port):
+    """The port range a result covers, as stored with it"""
+    return f"{start_port}-{end_port}"
+
+def parse_port_range(spec):
+    """(start, end) of a stored port spec like '1-1024'"""
+    start, _, end = spec.partition("-")
+    return int(start), int(end or start)
+
+def compute_delta(previous, current):
+    """Compare two stored results and describe what changed
+
+    Only ports both runs scanned are compared: a port outside the previous
+    range isn't newly opened, and one outside the current range isn't closed.
+    """
+    old_ports = set(previous.get("open_ports", [])) if previous else set()
+    new_ports = set(current["open_ports"])
+    # Results stored before the range was recorded are taken to cover the same range
+    if previous and previous.get("port_spec", current["port_spec"]) != current["port_spec"]:
+        old_start, old_end = parse_port_range(previous["port_spec"])
+        new_start, new_end = parse_port_range(current["port_spec"])
+        both = range(max(old_start, new_start), min(old_end, new_end) + 1)
+        old_ports = {port for port in old_ports if port in both}
+        compared = {port for port in new_ports if port in both}
+    else:
+        compared = new_ports
+    old_banners = previous.get("banners", {}) if previous else {}
+    new_banners = current.get("banners", {})
+
+    # Only ports open in both runs can have a changed banner
+    banner_changes = {}
+    for port in sorted(old_ports & compared):
+        old_banner = old_banners.get(str(port))
+        new_banner = new_banners.get(str(port))
+        if old_banner != new_banner:
+            banner_changes[str(port)] = {"old": old_banner, "new": new_banner}
+
+    return {
+        "ip_address": current["ip_address"],
+        "mode": current["mode"],
+        "previous_scan": previous.get("scanned_at") if previous else None,
+        "port_spec": current["port_spec"],
+        "opened": sorted(compared - old_ports),
+        "closed": sorted(old_ports - compared),
+        "banner_changes": banner_changes,
+        "open_ports": sorted(new_ports)
+    }
+
+def diff_scan(ip_address, start_port=1, end_port=65535, history_dir=HISTORY_DIR,
+              sample_size=CLOSED_SAMPLE_SIZE, full_scan_interval=FULL_SCAN_INTERVAL,
+              force_full=False):
+    """Rescan a host probing only what is likely to have changed, and return the delta"""
+    now = time.time()
+    previous = load_previous_result(ip_address, history_dir)
+    spec = port_spec(start_port, end_port)
+
+    full_sweep = force_full or previous is None
+    # The previous result says nothing about ports it didn't cover
+    if previous and previous.get("port_spec") != spec:
+        full_sweep = True
+    if previous and now - previous.get("last_full_scan", 0) >= full_scan_interval:
+        full_sweep = True
+
+    if not full_sweep:
+        known_open = set(previous.get("open_ports", []))
+
+        # Known open ports first - they are the most likely to have changed
+        still_open = set(scan_port_list(ip_address, sorted(known_open)))
+
+        # Then a cheap spot-check of ports that were closed last time
+        sampled = sample_closed_ports(known_open, start_port, end_port, sample_size)
+        newly_open = set(scan_port_list(ip_address, sampled))
+
+        # Anything unexpected means the sample can't be trusted, so sweep everything
+        if still_open != known_open or newly_open:
+            full_sweep = True
+        else:
+            open_ports = sorted(still_open)
+
+    if full_sweep:
+        open_ports = scan_port_list(ip_address, ordered_port_range(start_port, end_port), concurrency=500)
+
+    current = {
+        "ip_address": ip_address,
+        "port_spec": spec,
+        "mode": "full" if full_sweep else "incremental",
+        "scanned_at": now,
+        "last_full_scan": now if full_sweep else previous.get("last_full_scan", now),
+        "open_ports": open_ports,
+        "banners": grab_banners(ip_address, open_ports)
+    }
+
+    delta = compute_delta(previous, current)
+    save_scan_result(current, history_dir)
+    return delta
+
+def print_delta(delta):
+    """Print a scan delta in a human readable form"""
+    print(f"\nDiff scan of {delta['ip_address']}, ports {delta['port_spec']} ({delta['mode']} sweep)")
+    if delta["previous_scan"] is None:
+        print("No previous result stored - this run is the new baseline")
+
+    print(f"Newly opened ports: {', '.join(map(str, delta['opened'])) or 'none'}")
+    print(f"Newly closed ports: {', '.join(map(str, delta['closed'])) or 'none'}")
+
+    if delta["banner_changes"]:
+        print("Changed banners:")
+        for port, change in delta["banner_changes"].items():
+            print(f"  {port}: {change['old']!r} -> {change['new']!r}")
+    else:
+        print("Changed banners: none")
+
+    print(f"Open ports now: {', '.join(map(str, delta['open_ports'])) or 'none'}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python diff_scan.py <ip address> [<ip address> ...]")
+        sys.exit(1)
+
+    for target in sys.argv[1:]:
+        print_delta(diff_scan(target))
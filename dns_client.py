@@ -0,0 +1,429 @@
+import asyncio
+import collections
+import contextvars
+import ipaddress
+import os
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+
+# A small DNS client that speaks the wire protocol itself.  socket.gethostbyname
+# only returns one A record per blocking call; this sends many queries at once
+# over a single UDP socket, matches the answers by transaction id and caches
+# them for as long as their TTL allows.
+
+# Record types
+A = 1
+NS = 2
+CNAME = 5
+SOA = 6
+PTR = 12
+MX = 15
+TXT = 16
+AAAA = 28
+SRV = 33
+
+TYPE_NAMES = {A: "A", NS: "NS", CNAME: "CNAME", SOA: "SOA", PTR: "PTR", MX: "MX", TXT: "TXT",
+              AAAA: "AAAA", SRV: "SRV"}
+TYPES = {name: value for value, name in TYPE_NAMES.items()}
+
+# Response codes
+NOERROR = 0
+SERVFAIL = 2
+NXDOMAIN = 3
+
+# How long answers without a usable TTL (and NXDOMAIN without an SOA) are cached
+NEGATIVE_TTL = 60
+MAX_TTL = 3600
+
+class DnsError(Exception):
+    """A DNS query failed"""
+
+class DnsTimeout(DnsError):
+    """The name server never answered"""
+
+def system_nameserver():
+    """The name server to query: $RECON_DNS_SERVER, then resolv.conf, then a public resolver"""
+    configured = os.environ.get("RECON_DNS_SERVER")
+    if configured:
+        return configured
+    try:
+        with open("/etc/resolv.conf", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    return parts[1]
+    except OSError:
+        pass
+    return "8.8.8.8"
+
+def split_nameserver(nameserver, default_port=53):
+    """Split "host", "host:port" or "[v6]:port" into a host and a port"""
+    if nameserver.startswith("["):
+        host, _, port = nameserver[1:].partition("]")
+        return host, int(port.lstrip(":") or default_port)
+    if nameserver.count(":") == 1:
+        host, port = nameserver.split(":")
+        return host, int(port)
+    return nameserver, default_port
+
+def encode_name(name):
+    """Encode a domain name as DNS labels"""
+    encoded = b""
+    for label in name.rstrip(".").split("."):
+        if not label:
+            continue
+        raw = label.encode("idna")
+        if len(raw) > 63:
+            raise ValueError(f"DNS label too long: {label}")
+        encoded += bytes([len(raw)]) + raw
+    return encoded + b"\x00"
+
+def build_query(transaction_id, name, qtype=A):
+    """Build a recursive query for one name and record type"""
+    header = struct.pack(">HHHHHH", transaction_id, 0x0100, 1, 0, 0, 0)
+    return header + encode_name(name) + struct.pack(">HH", qtype, 1)
+
+def decode_name(message, offset):
+    """Read a (possibly compressed) name, returning it and the offset after it"""
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(message):
+            raise DnsError("Truncated name in DNS message")
+        length = message[offset]
+        if length & 0xc0 == 0xc0:
+            # Compression pointer to an earlier name
+            if offset + 1 >= len(message):
+                raise DnsError("Truncated name in DNS message")
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 64:
+                raise DnsError("Compression loop in DNS message")
+            offset = ((length & 0x3f) << 8) | message[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(message[offset:offset + length].decode("ascii", errors="replace"))
+        offset += length
+    return ".".join(labels), end if end is not None else offset
+
+def parse_rdata(message, rtype, offset, length):
+    """Decode the data of one resource record into something readable"""
+    rdata = message[offset:offset + length]
+    if len(rdata) < length or (rtype == MX and length < 2) or (rtype == SRV and length < 6):
+        raise DnsError("Truncated record in DNS message")
+    if rtype == A and length == 4:
+        return socket.inet_ntoa(rdata)
+    if rtype == AAAA and length == 16:
+        return str(ipaddress.IPv6Address(rdata))
+    if rtype in (NS, CNAME, PTR):
+        return decode_name(message, offset)[0]
+    if rtype == MX:
+        return {"preference": struct.unpack(">H", rdata[:2])[0],
+                "exchange": decode_name(message, offset + 2)[0]}
+    if rtype == SRV:
+        priority, weight, port = struct.unpack(">HHH", rdata[:6])
+        return {"priority": priority, "weight": weight, "port": port,
+                "target": decode_name(message, offset + 6)[0]}
+    if rtype == TXT:
+        # One or more length-prefixed strings
+        parts = []
+        i = 0
+        while i < len(rdata):
+            parts.append(rdata[i + 1:i + 1 + rdata[i]].decode("utf-8", errors="replace"))
+            i += 1 + rdata[i]
+        return "".join(parts)
+    if rtype == SOA:
+        mname, next_offset = decode_name(message, offset)
+        rname, next_offset = decode_name(message, next_offset)
+        if next_offset + 20 > len(message):
+            raise DnsError("Truncated record in DNS message")
+        serial, refresh, retry, expire, minimum = struct.unpack(">IIIII", message[next_offset:next_offset + 20])
+        return {"mname": mname, "rname": rname, "serial": serial, "minimum": minimum}
+    return rdata.hex()
+
+def parse_response(message):
+    """Parse a DNS response into its header fields and record sections"""
+    if len(message) < 12:
+        raise DnsError("DNS message too short")
+    transaction_id, flags, qdcount, ancount, nscount, arcount = struct.unpack(">HHHHHH", message[:12])
+    offset = 12
+    questions = []
+    for _ in range(qdcount):
+        name, offset = decode_name(message, offset)
+        if offset + 4 > len(message):
+            raise DnsError("Truncated question in DNS message")
+        qtype, _ = struct.unpack(">HH", message[offset:offset + 4])
+        offset += 4
+        questions.append((name, qtype))
+
+    sections = []
+    for count in (ancount, nscount, arcount):
+        records = []
+        for _ in range(count):
+            name, offset = decode_name(message, offset)
+            if offset + 10 > len(message):
+                raise DnsError("Truncated record in DNS message")
+            rtype, _, ttl, length = struct.unpack(">HHIH", message[offset:offset + 10])
+            offset += 10
+            records.append({"name": name, "type": TYPE_NAMES.get(rtype, str(rtype)), "ttl": ttl,
+                            "data": parse_rdata(message, rtype, offset, length)})
+            offset += length
+        sections.append(records)
+
+    return {
+        "id": transaction_id,
+        "rcode": flags & 0x000f,
+        "truncated": bool(flags & 0x0200),
+        "questions": questions,
+        "answers": sections[0],
+        "authority": sections[1],
+        "additional": sections[2]
+    }
+
+class DnsCache:
+    """Answers keyed by (name, type), kept until their TTL runs out"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, result, ttl):
+        self.entries[key] = (time.monotonic() + ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+def cache_ttl(response):
+    """How long a response may be cached"""
+    if response["answers"]:
+        return min(MAX_TTL, min(record["ttl"] for record in response["answers"]))
+    # Negative answers are cached for the zone's SOA minimum
+    for record in response["authority"]:
+        if record["type"] == "SOA":
+            return min(MAX_TTL, record["ttl"], record["data"]["minimum"])
+    return NEGATIVE_TTL
+
+class ResolverProtocol(asyncio.DatagramProtocol):
+    """Hands every datagram from the name server to the resolver"""
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+
+    def datagram_received(self, data, addr):
+        self.resolver.response_received(data)
+
+    def error_received(self, exc):
+        # ICMP errors are answered by the per-query timeout and retry
+        pass
+
+class AsyncResolver:
+    """Pipelined DNS queries over one UDP socket, with caching"""
+
+    def __init__(self, nameserver=None, timeout=2.0, retries=2, concurrency=200, cache=None):
+        self.nameserver, self.port = split_nameserver(nameserver or system_nameserver())
+        self.timeout = timeout
+        self.retries = retries
+        self.concurrency = concurrency
+        self.cache = cache if cache is not None else DnsCache()
+        self.transport = None
+        self.semaphore = None
+        self.waiting = {}
+        self.inflight = {}
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        family = socket.AF_INET6 if ":" in self.nameserver else socket.AF_INET
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: ResolverProtocol(self), family=family)
+        return self
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+        for waiter, _ in self.waiting.values():
+            if not waiter.done():
+                waiter.cancel()
+        self.waiting.clear()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def response_received(self, data):
+        if len(data) < 12:
+            return
+        transaction_id = struct.unpack(">H", data[:2])[0]
+        entry = self.waiting.get(transaction_id)
+        if entry is None:
+            return
+        waiter, question = entry
+        try:
+            response = parse_response(data)
+        except DnsError:
+            return
+        # Only accept the answer to the question we asked
+        if not response["questions"] or (response["questions"][0][0].lower(), response["questions"][0][1]) != question:
+            return
+        if not waiter.done():
+            waiter.set_result(response)
+
+    def new_transaction_id(self):
+        while True:
+            transaction_id = random.getrandbits(16)
+            if transaction_id not in self.waiting:
+                return transaction_id
+
+    async def query(self, name, qtype=A):
+        """Look up one record type for a name (cached, identical queries share a request)"""
+        name = name.rstrip(".").lower()
+        key = (name, qtype)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self.inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody else may be waiting; don't warn about an unretrieved exception
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.inflight[key] = future
+        try:
+            response = await self.exchange(name, qtype)
+            result = {"name": name, "type": TYPE_NAMES.get(qtype, str(qtype)), "rcode": response["rcode"],
+                      "answers": response["answers"], "authority": response["authority"]}
+            if response["rcode"] in (NOERROR, NXDOMAIN):
+                self.cache.put(key, result, cache_ttl(response))
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self.inflight[key]
+
+    async def exchange(self, name, qtype):
+        """Send a query and wait for its answer, retrying on timeout"""
+        if self.transport is None:
+            raise DnsError("Resolver is not started")
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                transaction_id = self.new_transaction_id()
+                waiter = loop.create_future()
+                self.waiting[transaction_id] = (waiter, (name, qtype))
+                try:
+                    self.transport.sendto(build_query(transaction_id, name, qtype), (self.nameserver, self.port))
+                    response = await asyncio.wait_for(waiter, self.timeout * (attempt + 1))
+                except asyncio.TimeoutError:
+                    continue
+                finally:
+                    self.waiting.pop(transaction_id, None)
+
+                if response["truncated"]:
+                    # Too big for a datagram: ask again over TCP
+                    return await self.exchange_tcp(name, qtype)
+                return response
+        raise DnsTimeout(f"No answer from {self.nameserver} for {name} {TYPE_NAMES.get(qtype, qtype)}")
+
+    async def exchange_tcp(self, name, qtype):
+        query = build_query(self.new_transaction_id(), name, qtype)
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.nameserver, self.port),
+                                                    self.timeout)
+        except asyncio.TimeoutError:
+            raise DnsTimeout(f"No TCP answer from {self.nameserver} for {name}")
+        except OSError as e:
+            # Refused, unreachable, ...: plenty of name servers only answer over UDP
+            raise DnsError(f"Can't reach {self.nameserver} over TCP for {name}: {e}")
+        try:
+            writer.write(struct.pack(">H", len(query)) + query)
+            length = struct.unpack(">H", await asyncio.wait_for(reader.readexactly(2), self.timeout))[0]
+            return parse_response(await asyncio.wait_for(reader.readexactly(length), self.timeout))
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            raise DnsTimeout(f"No TCP answer from {self.nameserver} for {name}")
+        except OSError as e:
+            raise DnsError(f"TCP query to {self.nameserver} for {name} failed: {e}")
+        finally:
+            writer.close()
+
+    async def resolve(self, name):
+        """IPv4 addresses of a name (following CNAMEs), or an empty list"""
+        try:
+            result = await self.query(name, A)
+        except DnsError:
+            return []
+        return addresses(result)
+
+def addresses(result):
+    """The A record addresses in a query result"""
+    return [record["data"] for record in result["answers"] if record["type"] == "A"]
+
+def cname_chain(result):
+    """The CNAME targets a query result went through, in order"""
+    return [record["data"] for record in result["answers"] if record["type"] == "CNAME"]
+
+def iter_async(make_stream):
+    """Run an async generator on an event loop thread of its own and yield its items here
+
+    Lets the synchronous scanner consume a DNS stage while it is still
+    resolving: the loop starts straight away and items arrive as they are found.
+    """
+    items = queue.Queue()
+    stop = threading.Event()
+
+    async def pump():
+        async for item in make_stream():
+            items.put(("item", item))
+            if stop.is_set():
+                break
+
+    def run():
+        try:
+            asyncio.run(pump())
+        except BaseException as e:
+            items.put(("error", e))
+        finally:
+            items.put(("done", None))
+
+    # Copy the context so the stage's spans join the active trace
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), name="dns-stage", daemon=True).start()
+
+    def consume():
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            stop.set()
+
+    return consume()
@@ -0,0 +1,124 @@
+import asyncio
+
+import dns_client
+import tracing
+from dns_client import A, CNAME, MX, NS, SOA, SRV, TXT, AsyncResolver, DnsError
+
+# DNS record harvesting: everything a domain publishes about its own
+# infrastructure (name servers, mail exchangers, SRV services, CNAME chains,
+# TXT records), asked for all at once over the async resolver.
+
+# Record types asked for at the domain itself
+DOMAIN_TYPES = (A, CNAME, NS, MX, TXT, SOA)
+
+# Well known SRV services, tried under the domain
+SRV_SERVICES = (
+    "_sip._tcp", "_sip._udp", "_sips._tcp", "_sipfederationtls._tcp", "_xmpp-client._tcp",
+    "_xmpp-server._tcp", "_ldap._tcp", "_ldap._tcp.dc._msdcs", "_kerberos._tcp", "_kerberos._udp",
+    "_kpasswd._tcp", "_gc._tcp", "_autodiscover._tcp", "_submission._tcp", "_imap._tcp", "_imaps._tcp",
+    "_pop3s._tcp", "_caldav._tcp", "_caldavs._tcp", "_carddavs._tcp", "_h323cs._tcp", "_vlmcs._tcp",
+    "_jabber._tcp", "_matrix._tcp", "_mta-sts._tcp", "_http._tcp", "_https._tcp",
+)
+
+# Other well known names holding TXT records
+TXT_NAMES = ("_dmarc", "_mta-sts", "_smtp._tls")
+
+# Records whose value names another host
+HOST_FIELDS = {"NS": None, "CNAME": None, "MX": "exchange", "SRV": "target"}
+
+def record_value(record):
+    """A record's data as a single string"""
+    data = record["data"]
+    if record["type"] == "MX":
+        return f"{data['preference']} {data['exchange']}"
+    if record["type"] == "SRV":
+        return f"{data['priority']} {data['weight']} {data['port']} {data['target']}"
+    if record["type"] == "SOA":
+        return f"{data['mname']} {data['rname']} {data['serial']}"
+    return str(data)
+
+def record_host(record):
+    """The host name a record points at, if it points at one"""
+    if record["type"] not in HOST_FIELDS:
+        return None
+    field = HOST_FIELDS[record["type"]]
+    host = record["data"][field] if field else record["data"]
+    # "." as an SRV target means the service isn't offered
+    return host.rstrip(".").lower() or None
+
+def in_scope(name, domain):
+    """Whether a host belongs to the domain (mail or DNS hosted elsewhere isn't ours to scan)"""
+    return name == domain or name.endswith("." + domain)
+
+def harvest_queries(domain):
+    """Every (name, type) question asked about a domain"""
+    queries = [(domain, qtype) for qtype in DOMAIN_TYPES]
+    queries += [(f"{service}.{domain}", SRV) for service in SRV_SERVICES]
+    queries += [(f"{name}.{domain}", TXT) for name in TXT_NAMES]
+    return queries
+
+async def iter_harvest(domain, resolver):
+    """Yield a domain's DNS records as their answers arrive, then the hosts they name
+
+    Records are {"name", "record_type", "value"} dicts; hosts are
+    {"name", "addresses", "source", "cnames"} dicts for every host a record
+    pointed at.
+    """
+    domain = domain.rstrip(".").lower()
+    seen = set()
+    hosts = {}
+
+    async def ask(name, qtype):
+        try:
+            return await resolver.query(name, qtype)
+        except DnsError:
+            return None
+
+    # All questions go out at once over the one socket
+    for answer in asyncio.as_completed([ask(name, qtype) for name, qtype in harvest_queries(domain)]):
+        result = await answer
+        if result is None:
+            continue
+        for record in result["answers"]:
+            value = record_value(record)
+            key = (record["name"].lower(), record["type"], value)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield {"name": record["name"].lower(), "record_type": record["type"], "value": value}
+            host = record_host(record)
+            if host and host != domain:
+                hosts.setdefault(host, record["type"])
+
+    # Resolve every host the records named (CNAME chains come back with the answers)
+    names = list(hosts)
+    results = await asyncio.gather(*(ask(name, A) for name in names))
+    for name, result in zip(names, results):
+        if result is None:
+            continue
+        addresses = dns_client.addresses(result)
+        if addresses:
+            yield {"name": name, "addresses": addresses, "source": hosts[name],
+                   "cnames": dns_client.cname_chain(result)}
+
+def harvest_record(domain, item):
+    """Turn a harvested record or host into a flat output record"""
+    if "addresses" in item:
+        return {"type": "dns_host", "target": domain, "name": item["name"], "ip_address": item["addresses"][0],
+                "addresses": ",".join(item["addresses"]), "source": item["source"],
+                "cnames": ",".join(item["cnames"]), "in_scope": in_scope(item["name"], domain)}
+    return dict({"type": "dns_record", "target": domain}, **item)
+
+def stream_dns_records(domain, nameserver=None):
+    """Harvest a domain's records in the background, yielding output records as they arrive"""
+    async def records():
+        with tracing.stage("dns_harvest", target=domain):
+            async with AsyncResolver(nameserver) as resolver:
+                async for item in iter_harvest(domain, resolver):
+                    yield harvest_record(domain, item)
+
+    return dns_client.iter_async(records)
+
+def harvest_dns(domain, nameserver=None):
+    """Harvest a domain's records and return every output record (for scripts and tests)"""
+    return list(stream_dns_records(domain, nameserver))
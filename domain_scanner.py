@@ -1,8 +1,25 @@
 import socket
-import platform
-import subprocess
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import contextvars
+import json
+import threading
+
+from output_formats import FORMATS, TextWriter, format_os_details, open_writer
+from scan_engine import (TIMING_PROFILES, DEFAULT_TIMING, SHARED_PROBE_THREADS, get_timing, parse_port_spec,
+                         ordered_port_range, scan_port, iter_port_results, scan_port_list, grab_banner,
+                         PortStateSummary, OPEN, MIN_PROBE_TIMEOUT, BANNER_TIMEOUT,
+                         get_shared_executor, configure_shared_executor, shutdown_shared_executor,
+                         ResourceExhausted)
+from port_profiles import order_by_likelihood
+from probe_plans import get_plan, run_plan
+from deadlines import Deadline
+import passive_os
+import tracing
+
+# UDP ports scanned by --udp (kept in sync with udp_scan.UDP_COMMON_PORTS, which
+# isn't imported here so asyncio is only loaded when a UDP scan actually runs)
+UDP_DEFAULT_SPEC = "53,161,123,137,67,69,111,500,514,520,1434,1900,4500,5353,11211"
 
 def get_ip_address(domain):
     """Get IP address for a given domain name"""
@@ -20,65 +37,44 @@ def get_domain_name(ip_address):
     except socket.herror as e:
         return f"Error resolving IP to domain: {e}"
 
-def scan_port(ip, port):
-    """Scan a single port on the given IP address"""
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(1)
-        result = sock.connect_ex((ip, port))
-        sock.close()
-        return port if result == 0 else None
-    except Exception:
-        return None
-
 def scan_ports(ip, start_port=1, end_port=1024):
     """Scan ports on the given IP address"""
-    open_ports = []
-    
-    # Use ThreadPoolExecutor for concurrent port scanning
-    with ThreadPoolExecutor(max_workers=100) as executor:
-        # Submit all port scanning tasks
-        future_to_port = {
-            executor.submit(scan_port, ip, port): port 
-            for port in range(start_port, end_port + 1)
-        }
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_port):
-            port = future_to_port[future]
-            try:
-                result = future.result()
-                if result is not None:
-                    open_ports.append(result)
-            except Exception:
-                pass
-    
-    return sorted(open_ports)
+    return scan_port_list(ip, ordered_port_range(start_port, end_port))
 
 def detect_os(ip_address):
     """Detect OS using multiple methods for better accuracy"""
     try:
+        details = detect_os_details(ip_address)
+        return format_os_details(details)
+    except Exception as e:
+        return f"Error detecting OS: {e}"
+
+def detect_os_details(ip_address, deadline=None, port_plan=None, service_plan=None):
+    """Run every OS detection method and return the results as a dict
+
+    With a stage deadline, methods still running when it passes are dropped.
+    port_plan and service_plan replace the os_ports and services templates.
+    """
+    # The methods are independent, so they run side by side on the shared scan pool
+    executor = get_shared_executor()
+    futures = {
         # Method 1: TTL-based detection
-        os_by_ttl = detect_os_by_ttl(ip_address)
-        
+        'ttl': executor.submit(tracing.follow(detect_os_by_ttl), ip_address),
         # Method 2: Port-based detection
-        os_by_ports = detect_os_by_ports(ip_address)
-        
+        'ports': executor.submit(tracing.follow(detect_os_by_ports), ip_address, port_plan),
         # Method 3: Service banner grabbing (if common service ports are open)
-        service_info = get_service_info(ip_address)
-        
-        # Combine all information
-        result = f"OS Detection Results:\n"
-        result += f"  TTL-based: {os_by_ttl}\n"
-        result += f"  Port-based: {os_by_ports}\n"
-        result += f"  Service Info: {service_info}"
-        
-        return result
-    except Exception as e:
-        return f"Error detecting OS: {e}"
+        'services': executor.submit(tracing.follow(get_service_info), ip_address, service_plan)
+    }
+    if deadline is not None:
+        return {method: deadline.wait(future, "Timed out") for method, future in futures.items()}
+    return {method: future.result() for method, future in futures.items()}
 
 def detect_os_by_ttl(ip_address):
     """Detect OS using TTL value from ping response"""
+    # Only needed here, and slow to import for a CLI that should start instantly
+    import platform
+    import subprocess
+    
     try:
         # Send a ping request and capture the output
         if platform.system().lower() == "windows":
@@ -124,194 +120,219 @@ def detect_os_by_ttl(ip_address):
     except Exception as e:
         return f"Ping error: {e}"
 
-def detect_os_by_ports(ip_address):
+def detect_os_by_ports(ip_address, plan=None):
     """Detect OS based on open ports with enhanced heuristics"""
-    try:
-        # Scan of common ports with more detailed analysis
-        port_info = {
-            21: "FTP",
-            22: "SSH",
-            23: "Telnet",
-            25: "SMTP",
-            53: "DNS",
-            80: "HTTP",
-            110: "POP3",
-            143: "IMAP",
-            443: "HTTPS",
-            993: "IMAPS",
-            995: "POP3S",
-            3389: "RDP (Windows)",
-            5900: "VNC",
-            3306: "MySQL",
-            5432: "PostgreSQL",
-            1433: "MSSQL (Windows)",
-            1521: "Oracle DB",
-            8080: "HTTP-Alt"
-        }
-        
-        open_ports = {}
-        
-        # Check which ports are open
-        for port, service in port_info.items():
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(0.5)  # Short timeout
-            result = sock.connect_ex((ip_address, port))
-            sock.close()
-            if result == 0:
-                open_ports[port] = service
-        
-        if not open_ports:
-            return "No common ports open or host is filtering"
-        
-        # Enhanced heuristics based on port combinations
-        os_hints = []
-        
-        # Windows indicators
-        if 3389 in open_ports:  # RDP
-            os_hints.append("Windows (RDP detected)")
-        if 1433 in open_ports:  # MSSQL
-            os_hints.append("Windows (MSSQL detected)")
-            
-        # Linux/Unix indicators
-        if 22 in open_ports and 3389 not in open_ports:  # SSH but no RDP
-            os_hints.append("Linux/Unix (SSH detected)")
-        if 5432 in open_ports:  # PostgreSQL
-            os_hints.append("Linux/Unix (PostgreSQL detected)")
-            
-        # Network device indicators
-        if 23 in open_ports and 22 not in open_ports and 3389 not in open_ports:
-            os_hints.append("Network Device (Telnet detected)")
-        if 53 in open_ports and len(open_ports) <= 3:  # Primarily DNS
-            os_hints.append("Network Device (DNS server)")
-            
-        # Web server indicators
-        web_ports = [80, 443, 8080]
-        web_open = [port for port in web_ports if port in open_ports]
-        if web_open and len(open_ports) <= 3:
-            os_hints.append("Web Server (Limited services)")
-        elif web_open:
-            os_hints.append("Web Server (Multiple services)")
-            
-        # Database server indicators
-        db_ports = [3306, 5432, 1433, 1521]
-        db_open = [port for port in db_ports if port in open_ports]
-        if db_open:
-            os_hints.append("Database Server")
-            
-        if os_hints:
-            return f"{', '.join(os_hints)} - Open ports: {', '.join([f'{p}({s})' for p, s in open_ports.items()])}"
-        else:
-            return f"Open ports: {', '.join([f'{p}({s})' for p, s in open_ports.items()])} - OS detection inconclusive"
-            
-    except Exception as e:
-        return f"Port detection error: {e}"
+    # Ports and heuristics live in scan_templates/os_ports.json
+    return run_plan(plan or get_plan('os_ports'), ip_address)
 
-def get_service_info(ip_address):
+def get_service_info(ip_address, plan=None):
     """Grab banners from common services to get more OS details"""
-    try:
-        service_details = []
-        
-        # Try to get banner from common services
-        services_to_check = [
-            (22, "SSH"),
-            (80, "HTTP"),
-            (443, "HTTPS"),
-            (23, "Telnet"),
-            (21, "FTP")
-        ]
-        
-        for port, service_name in services_to_check:
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(2)  # Longer timeout for banner grabbing
-                result = sock.connect_ex((ip_address, port))
-                
-                if result == 0:
-                    # Try to grab banner
-                    if port in [80, 443]:
-                        # For web servers, send HTTP request
-                        sock.send(b"HEAD / HTTP/1.0\r\n\r\n")
-                    else:
-                        # For other services, try to read banner
-                        sock.send(b"\n")
-                    
-                    # Read response
-                    try:
-                        banner = sock.recv(1024).decode('utf-8', errors='ignore').strip()
-                        if banner:
-                            # Clean up banner for display
-                            banner_lines = banner.split('\n')
-                            first_line = banner_lines[0][:50] + ("..." if len(banner_lines[0]) > 50 else "")
-                            service_details.append(f"{service_name}({port}): {first_line}")
-                        else:
-                            service_details.append(f"{service_name}({port}): No banner")
-                    except:
-                        service_details.append(f"{service_name}({port}): Banner read failed")
-                
-                sock.close()
-            except Exception:
-                # Skip this service if we can't get a banner
-                pass
-        
-        if service_details:
-            return "; ".join(service_details)
-        else:
-            return "No service banners captured"
-            
-    except Exception as e:
-        return f"Banner grabbing error: {e}"
+    # Services and probes live in scan_templates/services.json
+    return run_plan(plan or get_plan('services'), ip_address)
 
-def scan_domain(domain):
-    """Scan a domain for IP address, OS details, and open ports"""
-    print(f"\nScanning domain: {domain}")
+def scan_options(port_spec="1-1024", timing=DEFAULT_TIMING, timeout=None, concurrency=None,
+                 os_detection=True, udp_port_spec=None, skip_filtered_hosts=True, banners=False,
+                 host_budget=None):
+    """Build the options used by scan_domain and scan_ip_address"""
+    options = get_timing(timing, timeout, concurrency)
+    options['port_spec'] = port_spec
+    # Probe the likeliest open ports first so findings arrive early
+    options['ports'] = order_by_likelihood(parse_port_spec(port_spec))
+    options['os_detection'] = os_detection
+    options['udp_port_spec'] = udp_port_spec
+    options['udp_ports'] = parse_port_spec(udp_port_spec) if udp_port_spec else None
+    options['skip_filtered_hosts'] = skip_filtered_hosts
+    options['banners'] = banners
+    # Wall-clock seconds each host's OS detection and port sweep may take together
+    if host_budget is not None and not host_budget > 0:
+        raise ValueError("The host time budget must be a positive number of seconds")
+    options['host_budget'] = host_budget
+    return options
+
+def scan_domain(domain, writer=None, options=None, ip_address=None):
+    """Scan a domain for IP address, OS details, and open ports
+    
+    Pass `ip_address` when the domain was already resolved (e.g. by subdomain enumeration).
+    """
+    writer = writer or TextWriter()
+    writer.stage(f"\nScanning domain: {domain}")
     
     # Get IP address
-    print("Resolving IP address...")
-    ip_address = get_ip_address(domain)
-    print(f"IP Address: {ip_address}")
+    if ip_address is None:
+        writer.stage("Resolving IP address...")
+        with tracing.stage('dns', target=domain):
+            ip_address = get_ip_address(domain)
     
     # If IP resolution failed, exit
     if "Error" in str(ip_address):
+        writer.write({'type': 'error', 'target': domain, 'stage': 'dns', 'message': ip_address})
         return
+    writer.write({'type': 'ip_address', 'target': domain, 'ip_address': ip_address})
     
-    # Detect OS
-    print("Detecting OS...")
-    os_details = detect_os(ip_address)
-    print(f"OS Details:\n{os_details}")
-    
-    # Scan ports
-    print("Scanning ports (1-1024)...\n")
-    open_ports = scan_ports(ip_address)
-    
-    if open_ports:
-        print(f"Open ports: {', '.join(map(str, open_ports))}")
-    else:
-        print("No open ports found in range 1-1024")
+    scan_host(domain, ip_address, writer, options)
 
-def scan_ip_address(ip_address):
+def scan_ip_address(ip_address, writer=None, options=None):
     """Scan an IP address for domain name, OS details, and open ports"""
-    print(f"\nScanning IP address: {ip_address}")
+    writer = writer or TextWriter()
+    writer.stage(f"\nScanning IP address: {ip_address}")
     
     # Get domain name (reverse DNS lookup)
-    print("Resolving domain name...")
-    domain_name = get_domain_name(ip_address)
-    print(f"Domain Name: {domain_name}")
+    sweep = (options or {}).get('reverse_dns')
+    if sweep is not None:
+        # Looked up by the bulk sweep while earlier hosts were being scanned
+        domain_name = sweep.lookup(ip_address) or "Error resolving IP to domain: no PTR record"
+    else:
+        writer.stage("Resolving domain name...")
+        with tracing.stage('reverse_dns', target=ip_address):
+            domain_name = get_domain_name(ip_address)
     
     # If domain resolution failed, continue with other scans
+    if "Error" in str(domain_name):
+        writer.write({'type': 'error', 'target': ip_address, 'stage': 'reverse_dns', 'message': domain_name})
+    else:
+        writer.write({'type': 'domain_name', 'target': ip_address, 'ip_address': ip_address,
+                      'domain_name': domain_name})
+    
+    scan_host(ip_address, ip_address, writer, options)
+
+def scan_target(target, writer=None, options=None):
+    """Scan a target, which may be either a domain name or an IP address
+    
+    A (domain, ip_address) pair scans a domain that is already resolved.
+    """
+    if isinstance(target, tuple):
+        scan_domain(target[0], writer, options, ip_address=target[1])
+    elif is_valid_ip(target):
+        scan_ip_address(target, writer, options)
+    else:
+        scan_domain(target, writer, options)
+
+def scan_host(target, ip_address, writer, options=None):
+    """Run OS detection and the port sweep, streaming findings to the writer"""
+    options = options or scan_options()
+    deadline = Deadline(options['host_budget']) if options.get('host_budget') else None
     
     # Detect OS
-    print("Detecting OS...")
-    os_details = detect_os(ip_address)
-    print(f"OS Details:\n{os_details}")
+    if options['os_detection']:
+        writer.stage("Detecting OS...")
+        try:
+            with tracing.stage('os_detection', target=ip_address):
+                details = detect_os_details(ip_address, deadline and deadline.stage('os_detection'))
+            writer.write(dict({'type': 'os_details', 'target': target, 'ip_address': ip_address}, **details))
+        except Exception as e:
+            writer.write({'type': 'error', 'target': target, 'stage': 'os_detection',
+                          'message': f"Error detecting OS: {e}"})
+    
+    # Scan ports, reporting each open port the moment it is found
+    port_range = options['port_spec']
+    writer.stage(f"Scanning ports ({port_range})...\n")
+    summary = PortStateSummary()
+    open_ports = []
+    sweep_deadline = deadline and deadline.stage('port_sweep')
+    # Watch the SYN-ACKs the sweep triggers, to fingerprint the OS without extra probes
+    observer = passive_os.observe(ip_address) if options['os_detection'] else None
+    try:
+        # Probes go through the caller's scan job when there is one (see api.py)
+        for result in iter_port_results(ip_address, options['ports'], options['timeout'],
+                                        options['concurrency'], executor=options.get('executor'),
+                                        deadline=sweep_deadline):
+            summary.add(result)
+            if result['state'] == OPEN:
+                open_ports.append(result['port'])
+                writer.write({'type': 'open_port', 'target': target, 'ip_address': ip_address,
+                              'port': result['port']})
+    except ResourceExhausted as e:
+        # This machine ran out of sockets; the ports not probed yet are unknown, not closed
+        writer.write({'type': 'error', 'target': target, 'stage': 'port_scan',
+                      'message': f"Port scan stopped early: {e}"})
+    finally:
+        if observer is not None:
+            observer.close()
     
-    # Scan ports
-    print("Scanning ports (1-1024)...\n")
-    open_ports = scan_ports(ip_address)
+    if sweep_deadline is not None and sweep_deadline.cut_short:
+        # The host's time budget ran out; the ports not probed yet are unknown, not closed
+        summary.not_scanned = sweep_deadline.unfinished or 0
     
-    if open_ports:
-        print(f"Open ports: {', '.join(map(str, open_ports))}")
-    else:
-        print("No open ports found in range 1-1024")
+    states = summary.states
+    writer.write({'type': 'port_scan_complete', 'target': target, 'ip_address': ip_address,
+                  'port_range': port_range, 'open_port_count': states['open'],
+                  'closed_port_count': states['closed'], 'filtered_port_count': states['filtered'],
+                  'host_filtered': summary.host_filtered, 'not_scanned_count': summary.not_scanned})
+    
+    if observer is not None:
+        with tracing.stage('passive_os', target=ip_address):
+            found = observer.fingerprint(open_ports, options['timeout'], deadline and deadline.stage('passive_os'))
+        if found:
+            writer.write(dict({'type': 'os_fingerprint', 'target': target, 'ip_address': ip_address}, **found))
+    
+    if options.get('banners') and open_ports:
+        grab_open_banners(target, ip_address, open_ports, writer, deadline and deadline.stage('banner'))
+    
+    if options.get('udp_ports'):
+        if summary.host_filtered and options.get('skip_filtered_hosts', True):
+            # Nothing answered on TCP, so the host is down or firewalled wholesale
+            writer.stage("Every TCP port was filtered, skipping the UDP scan")
+        else:
+            scan_udp(target, ip_address, writer, options, deadline and deadline.stage('udp_sweep'))
+
+def grab_open_banners(target, ip_address, ports, writer, deadline=None, executor=None, timeout=BANNER_TIMEOUT):
+    """Grab the banner of every open port at once, writing each one that answered
+
+    With a stage deadline, banners still outstanding when it passes are dropped.
+    The grabs run on the shared scan pool unless given an executor.
+    """
+    writer.stage("Grabbing banners...")
+    executor = executor or get_shared_executor()
+    if deadline is not None:
+        timeout = min(timeout, max(deadline.remaining(), MIN_PROBE_TIMEOUT))
+    with tracing.stage('banner', target=ip_address, ports=len(ports)):
+        grab = tracing.follow(grab_banner)
+        futures = [(port, executor.submit(grab, ip_address, port, timeout)) for port in ports]
+        for index, (port, future) in enumerate(futures):
+            if deadline is None:
+                banner = future.result()
+            else:
+                # Counted as unfinished: this port and every one after it
+                banner = deadline.wait(future, None, len(futures) - index)
+                if deadline.cut_short:
+                    for _, rest in futures[index + 1:]:
+                        rest.cancel()
+                    break
+            if banner:
+                writer.write({'type': 'banner', 'target': target, 'ip_address': ip_address,
+                              'port': port, 'banner': banner})
+
+def scan_udp(target, ip_address, writer, options, deadline=None):
+    """Run the UDP sweep, streaming every port that isn't closed to the writer
+
+    With a stage deadline, the sweep stops when it passes.
+    """
+    import asyncio
+    from udp_scan import iter_udp_scan, CLOSED
+    
+    writer.stage(f"Scanning UDP ports ({options['udp_port_spec']})...\n")
+    probed = 0
+    
+    async def stream():
+        nonlocal probed
+        async for result in iter_udp_scan(ip_address, options['udp_ports'],
+                                          concurrency=min(options['concurrency'], 256)):
+            probed += 1
+            if result['state'] != CLOSED:
+                writer.write({'type': 'udp_port', 'target': target, 'ip_address': ip_address,
+                              'port': result['port'], 'state': result['state']})
+    
+    async def bounded():
+        if deadline is None:
+            return await stream()
+        try:
+            # Cancelling the sweep closes the sockets of the probes still waiting
+            await asyncio.wait_for(stream(), deadline.remaining())
+        except asyncio.TimeoutError:
+            deadline.expire(len(options['udp_ports']) - probed)
+    
+    with tracing.stage('udp_sweep', target=ip_address, ports=len(options['udp_ports'])):
+        asyncio.run(bounded())
 
 def is_valid_ip(ip):
     """Check if the input is a valid IP address"""
@@ -321,27 +342,288 @@ def is_valid_ip(ip):
     except socket.error:
         return False
 
-def main():
-    print("Domain Scanner - Enter 'quit' to exit")
-    print("Enter a domain name to get IP address and scan ports")
-    print("Or enter an IP address to get domain name and scan ports")
-    print("Note: OS detection uses TTL values and may not always be accurate")
+class LockedWriter:
+    """Serialise writes from several host scans running at once"""
+    
+    def __init__(self, writer):
+        self.writer = writer
+        self.lock = threading.Lock()
+    
+    def stage(self, message):
+        with self.lock:
+            self.writer.stage(message)
+    
+    def write(self, record):
+        with self.lock:
+            self.writer.write(record)
+
+def read_targets(args):
+    """Collect targets from the command line, target files and stdin
+    
+    CIDR ranges (e.g. 192.168.0.0/24) are expanded into their host addresses.
+    """
+    for target in iter_targets(args):
+        if "/" in target:
+            from reverse_dns import expand_range
+            yield from expand_range(target)
+        else:
+            yield target
+
+def iter_targets(args):
+    """Targets as written on the command line and in target files"""
+    for target in args.targets:
+        yield target
+    
+    for path in args.targets_file or []:
+        stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+        try:
+            for line in stream:
+                # Allow comments and blank lines in target files
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    yield line
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+def expand_domains(targets, writer, stages):
+    """Yield every target, followed by the hosts the DNS stages find for each domain
+    
+    `stages` are (description, function) pairs whose function streams output
+    records for a domain. Hosts to scan ("subdomain" and in-scope "dns_host"
+    records) come out as (name, ip_address) pairs so they aren't resolved twice.
+    """
+    # Many names usually point at the same few servers; sweep each address once
+    swept = set()
+    for target in targets:
+        if not isinstance(target, str) or is_valid_ip(target):
+            yield target
+            continue
+        # The stages start resolving in the background before the domain itself is scanned
+        streams = [(description, start_stage(target)) for description, start_stage in stages]
+        yield target
+        for description, stream in streams:
+            writer.stage(f"\n{description} {target}...")
+            for record in stream:
+                writer.write(record)
+                scan_it = record['type'] == 'subdomain' or (record['type'] == 'dns_host' and record['in_scope'])
+                if scan_it and record['ip_address'] not in swept:
+                    swept.add(record['ip_address'])
+                    yield record['name'], record['ip_address']
+
+def dns_stages(args):
+    """The DNS expansion stages the command line asked for"""
+    stages = []
+    if args.subdomains:
+        from subdomains import stream_subdomains, read_wordlist
+        
+        def enumerate_stage(domain):
+            words = read_wordlist(args.wordlist) if args.wordlist else None
+            return stream_subdomains(domain, words, args.dns_server)
+        stages.append(("Enumerating subdomains of", enumerate_stage))
+    if args.harvest_dns:
+        from dns_harvest import stream_dns_records
+        stages.append(("Harvesting DNS records of", lambda domain: stream_dns_records(domain, args.dns_server)))
+    return stages
+
+def run_batch(targets, writer, options, parallel_hosts=1):
+    """Scan every target non-interactively"""
+    if parallel_hosts <= 1:
+        for target in targets:
+            scan_target(target, writer, options)
+        return
+    
+    from concurrent.futures import ThreadPoolExecutor
+    
+    locked = LockedWriter(writer)
+    # Host scans mostly wait on their own probes, so they get a small pool of
+    # their own: run on the shared scan pool they could fill it and deadlock
+    with ThreadPoolExecutor(max_workers=parallel_hosts) as executor:
+        # Submit lazily so a huge target file isn't read into memory up front
+        pending = []
+        for target in targets:
+            # Run in a copy of this context so the hosts' stages join the active trace
+            context = contextvars.copy_context()
+            pending.append(executor.submit(context.run, tracing.follow(scan_target), target, locked, options))
+            if len(pending) >= parallel_hosts * 2:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
+
+def interactive(writer, options, console):
+    """Prompt for targets one at a time until the user types 'quit'"""
+    print("Domain Scanner - Enter 'quit' to exit", file=console)
+    print("Enter a domain name to get IP address and scan ports", file=console)
+    print("Or enter an IP address to get domain name and scan ports", file=console)
+    print("Note: OS detection uses TTL values and may not always be accurate", file=console)
     
     while True:
-        user_input = input("\nEnter domain name or IP address: ").strip()
+        print("\nEnter domain name or IP address: ", end="", file=console, flush=True)
+        try:
+            user_input = input().strip()
+        except EOFError:
+            break
         
         if user_input.lower() == 'quit':
-            print("Goodbye!")
+            print("Goodbye!", file=console)
             break
         
         if not user_input:
-            print("Please enter a valid domain name or IP address.")
+            print("Please enter a valid domain name or IP address.", file=console)
             continue
         
-        if is_valid_ip(user_input):
-            scan_ip_address(user_input)
-        else:
-            scan_domain(user_input)
+        scan_target(user_input, writer, options)
+
+def apply_template(options, plan, args):
+    """Take the ports and timing the command line didn't set from a port_sweep plan"""
+    if plan.kind != 'port_sweep':
+        raise ValueError(f"Template {plan.name} is not a port_sweep template (it is {plan.kind})")
+    if args.ports is None:
+        # The plan's ports are already parsed and ordered; no per-run work left
+        options['port_spec'] = plan.port_spec
+        options['ports'] = plan.ports
+    if args.timeout is None:
+        options['timeout'] = plan.timeout
+    if args.concurrency is None:
+        options['concurrency'] = plan.concurrency
+
+def positive_int(text):
+    """argparse type for counts that must be at least 1"""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number: {text!r}")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+def positive_float(text):
+    """argparse type for durations in seconds, which must be above zero"""
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number of seconds: {text!r}")
+    # A zero timeout makes sockets non-blocking, so every probe would look filtered
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"must be more than 0 seconds, got {text}")
+    return value
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description="Resolve targets, detect their OS and scan their ports. "
+                    "Without any targets the scanner runs interactively.")
+    parser.add_argument("targets", nargs="*",
+                        help="domain names, IP addresses or CIDR ranges to scan")
+    parser.add_argument("-i", "--targets-file", action="append", metavar="FILE",
+                        help="read targets from a file, one per line ('-' for stdin); may be repeated")
+    parser.add_argument("-p", "--ports", default=None, metavar="SPEC",
+                        help="ports to scan, e.g. 22,80,1000-2000,top100 or one of the "
+                             "top100, top1000 and full profiles (default: 1-1024)")
+    parser.add_argument("--template", default=None, metavar="NAME",
+                        help="take ports and timing from a port_sweep scan template (a file, or a name "
+                             "from scan_templates/ such as quick or web); other options override it")
+    parser.add_argument("-T", "--timing", choices=list(TIMING_PROFILES), default=DEFAULT_TIMING,
+                        help=f"timing profile (default: {DEFAULT_TIMING})")
+    parser.add_argument("-c", "--concurrency", type=positive_int, default=None,
+                        help="concurrent probes per host (overrides the timing profile)")
+    parser.add_argument("--timeout", type=positive_float, default=None,
+                        help="connect timeout in seconds (overrides the timing profile)")
+    parser.add_argument("--parallel-hosts", type=positive_int, default=1, metavar="N",
+                        help="number of hosts to scan at the same time (default: 1)")
+    parser.add_argument("-U", "--udp", action="store_true",
+                        help="also scan the most common UDP ports")
+    parser.add_argument("--udp-ports", default=None, metavar="SPEC",
+                        help="UDP ports to scan, e.g. 53,123,161 (implies --udp)")
+    parser.add_argument("--scan-filtered-hosts", action="store_true",
+                        help="run the UDP scan even when every TCP port of a host was filtered")
+    parser.add_argument("--subdomains", action="store_true",
+                        help="enumerate the subdomains of every domain target and scan the live ones too")
+    parser.add_argument("--wordlist", default=None, metavar="FILE",
+                        help="subdomain names to try, one per line (implies --subdomains)")
+    parser.add_argument("--harvest-dns", action="store_true",
+                        help="collect the NS, MX, TXT, SRV and CNAME records of every domain target "
+                             "and scan the hosts they name inside that domain")
+    parser.add_argument("--dns-server", default=None, metavar="HOST[:PORT]",
+                        help="name server for the DNS stages (default: the system resolver)")
+    parser.add_argument("--bulk-rdns", action="store_true",
+                        help="look up the PTR records of all IP targets concurrently, ahead of the scan")
+    parser.add_argument("--banners", action="store_true",
+                        help="grab the banner of every open port (for inventory.py)")
+    parser.add_argument("--max-host-time", type=positive_float, default=None, metavar="SECONDS",
+                        help="wall-clock budget for each host's OS detection and port sweep; "
+                             "the rest of the sweep is skipped and reported as not scanned")
+    parser.add_argument("--no-os", action="store_true",
+                        help="skip OS detection and only scan ports")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="text",
+                        help="output format (default: text)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="write findings to this file instead of stdout")
+    parser.add_argument("--trace", default=None, metavar="FILE",
+                        help="record how long every scan stage takes and save the trace to FILE")
+    parser.add_argument("--trace-format", choices=["json", "otlp"], default="json",
+                        help="trace file format: plain JSON or OpenTelemetry OTLP/JSON (default: json)")
+    parser.add_argument("--profile", action="store_true",
+                        help="add a sampling profile (folded stacks) to the --trace file")
+    args = parser.parse_args(argv)
+    
+    try:
+        udp_port_spec = args.udp_ports or (UDP_DEFAULT_SPEC if args.udp else None)
+        args.options = scan_options(args.ports or "1-1024", args.timing, args.timeout, args.concurrency,
+                                    os_detection=not args.no_os, udp_port_spec=udp_port_spec,
+                                    skip_filtered_hosts=not args.scan_filtered_hosts, banners=args.banners,
+                                    host_budget=args.max_host_time)
+        if args.template:
+            apply_template(args.options, get_plan(args.template), args)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.profile and not args.trace:
+        parser.error("--profile needs --trace FILE")
+    args.subdomains = args.subdomains or bool(args.wordlist)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    # One pool runs the probes of every stage; size it so all hosts scanned at
+    # once get their full concurrency
+    configure_shared_executor(max(SHARED_PROBE_THREADS, args.options['concurrency'] * args.parallel_hosts))
+    writer = open_writer(args.format, args.output)
+    
+    trace = None
+    
+    try:
+        with tracing.trace_scan('scan', enabled=bool(args.trace), profile=args.profile) as trace:
+            if args.targets or args.targets_file:
+                targets = read_targets(args)
+                batch_writer = writer
+                if args.subdomains or args.harvest_dns:
+                    # The DNS stages write from this thread while hosts are scanned on others
+                    batch_writer = LockedWriter(writer)
+                    targets = expand_domains(targets, batch_writer, dns_stages(args))
+                if args.bulk_rdns:
+                    from reverse_dns import ReverseSweep
+                    sweep = ReverseSweep(args.dns_server)
+                    args.options['reverse_dns'] = sweep
+                    targets = sweep.feed(targets)
+                run_batch(targets, batch_writer, args.options, args.parallel_hosts)
+            else:
+                # Prompts go to stderr when stdout carries machine readable output
+                console = sys.stdout if args.format == "text" and not args.output else sys.stderr
+                interactive(writer, args.options, console)
+    except KeyboardInterrupt:
+        print("\nScan interrupted", file=sys.stderr)
+        return 130
+    finally:
+        shutdown_shared_executor(wait=False)
+        writer.close()
+        if trace:
+            save_trace(trace, args.trace, args.trace_format)
+    return 0
+
+def save_trace(trace, path, trace_format="json"):
+    """Write a finished trace to a file"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(trace.export(trace_format), f, indent=2)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
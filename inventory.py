@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import re
+import sys
+
+# A service inventory built from scan results.  Across an estate the same few
+# banners (one nginx or OpenSSH build) show up on thousands of hosts, so each
+# distinct banner and fingerprint is stored once and hosts only point at it.
+# Inverted indexes (port -> hosts, service -> hosts, banner -> hosts) answer
+# inventory questions without going back to the raw results or rescanning.
+
+# "SSH-2.0-OpenSSH_9.6p1 Ubuntu-3" -> "OpenSSH_9.6p1"
+SSH_BANNER = re.compile(r"^SSH-[\d.]+-(\S+)")
+# "nginx/1.24.0", "ProFTPD 1.3.5", "Exim 4.96", "vsFTPd 3.0.5" (after an optional status code)
+PRODUCT_VERSION = re.compile(r"([A-Za-z][\w.+-]*?)[/ _]v?(\d+(?:\.\w+)+)")
+STATUS_CODE = re.compile(r"^\d{3}[- ]")
+# The Server header kept in HTTP banners: "HTTP/1.1 200 OK Server: nginx/1.24.0"
+SERVER_HEADER = re.compile(r"\bServer:\s*(.+)$", re.IGNORECASE)
+# Protocol versions ("HTTP/1.1 200 OK") that look like product/version pairs
+PROTOCOLS = {"http", "https", "rtsp", "sip", "smtp", "icap"}
+# One "SERVICE(port): banner" entry of get_service_info()'s summary
+SERVICE_ENTRY = re.compile(r"^[^()]+\((\d+)\): (.*)$")
+# Entries that carry no banner
+NO_BANNER = {"No banner", "Banner read failed"}
+
+def fingerprint(banner):
+    """Reduce a banner to the software (and version) it names, e.g. 'openssh 9.6p1'
+
+    Banners that don't name their software are fingerprinted by their text.
+    """
+    match = SSH_BANNER.match(banner)
+    if match:
+        software = match.group(1)
+        product, _, version = software.partition("_")
+        return f"{product.lower()} {version}".strip()
+    server = SERVER_HEADER.search(banner)
+    if server:
+        # A web server names itself there; its status line only says how the request went
+        text = server.group(1)
+    else:
+        text = STATUS_CODE.sub("", banner, count=1)
+    for match in PRODUCT_VERSION.finditer(text):
+        product = match.group(1).lower()
+        if product not in PROTOCOLS:
+            return f"{product} {match.group(2)}"
+    return text.strip()[:60].lower()
+
+def parse_service_info(text):
+    """(port, banner) pairs from a get_service_info() summary like 'SSH(22): SSH-2.0-...; HTTP(80): ...'"""
+    pairs = []
+    for entry in text.split("; "):
+        match = SERVICE_ENTRY.match(entry)
+        if match:
+            banner = match.group(2)
+            pairs.append((int(match.group(1)), None if banner in NO_BANNER else banner))
+    return pairs
+
+def product_of(fingerprint_text):
+    """The product part of a fingerprint ('openssh 9.6p1' -> 'openssh')"""
+    return fingerprint_text.split(" ", 1)[0]
+
+class Inventory:
+    """Open ports and banners of many hosts, with interned strings and inverted indexes"""
+
+    def __init__(self):
+        # One shared object per distinct string (hosts, banners, fingerprints)
+        self.strings = {}
+        # host -> {port: banner or None}
+        self.hosts = {}
+        # Inverted indexes
+        self.by_port = {}
+        self.by_banner = {}
+        self.by_fingerprint = {}
+        self.by_product = {}
+        # banner -> fingerprint, so each distinct banner is only parsed once
+        self.fingerprints = {}
+
+    def intern(self, text):
+        return self.strings.setdefault(text, text)
+
+    def add(self, host, port, banner=None):
+        """Record an open port, and its banner when there is one"""
+        host = self.intern(host)
+        ports = self.hosts.setdefault(host, {})
+        self.by_port.setdefault(port, set()).add(host)
+        if banner is None:
+            ports.setdefault(port, None)
+            return
+        banner = self.intern(banner)
+        old = ports.get(port)
+        if old is not None and old is not banner:
+            self.forget_banner(host, port, old)
+        ports[port] = banner
+        self.by_banner.setdefault(banner, set()).add((host, port))
+
+        found = self.fingerprints.get(banner)
+        if found is None:
+            found = self.fingerprints[banner] = self.intern(fingerprint(banner))
+        self.by_fingerprint.setdefault(found, set()).add(host)
+        self.by_product.setdefault(self.intern(product_of(found)), set()).add(host)
+
+    def forget_banner(self, host, port, banner):
+        """Drop a replaced banner of one port from the indexes"""
+        entries = self.by_banner.get(banner)
+        if entries is not None:
+            entries.discard((host, port))
+            if not entries:
+                del self.by_banner[banner]
+        # The host may still run the same software on another port
+        found = self.fingerprints[banner]
+        others = [self.fingerprints[other] for other_port, other in self.hosts[host].items()
+                  if other is not None and other_port != port]
+        if found not in others:
+            self.by_fingerprint[found].discard(host)
+        product = product_of(found)
+        if product not in map(product_of, others):
+            self.by_product[product].discard(host)
+
+    def add_record(self, record):
+        """Add one scan finding (open_port, banner and os_details records; others are ignored)"""
+        kind = record.get("type")
+        host = record.get("ip_address") or record.get("target")
+        if kind == "open_port":
+            self.add(host, int(record["port"]))
+        elif kind == "banner":
+            self.add(host, int(record["port"]), record["banner"])
+        elif kind == "os_details":
+            for port, banner in parse_service_info(record.get("services") or ""):
+                self.add(host, port, banner)
+
+    def add_snapshot(self, snapshot):
+        """Add a host result stored by diff_scan.py"""
+        banners = snapshot.get("banners", {})
+        for port in snapshot.get("open_ports", []):
+            self.add(snapshot["ip_address"], int(port), banners.get(str(port)))
+
+    # Inventory questions
+
+    def hosts_with_port(self, port):
+        """Hosts with the given port open"""
+        return sorted(self.by_port.get(port, ()))
+
+    def hosts_running(self, service):
+        """Hosts running a product ('nginx') or an exact fingerprint ('nginx 1.24.0')"""
+        service = service.lower()
+        hosts = self.by_fingerprint.get(service) or self.by_product.get(service) or ()
+        return sorted(hosts)
+
+    def hosts_with_banner(self, banner):
+        """(host, port) pairs that sent exactly this banner"""
+        return sorted(self.by_banner.get(banner, ()))
+
+    def ports(self):
+        """(port, host count) for every open port seen, most common first"""
+        return sorted(((port, len(hosts)) for port, hosts in self.by_port.items() if hosts),
+                      key=lambda item: (-item[1], item[0]))
+
+    def services(self):
+        """(fingerprint, host count) for every fingerprint seen, most common first"""
+        return sorted(((name, len(hosts)) for name, hosts in self.by_fingerprint.items() if hosts),
+                      key=lambda item: (-item[1], item[0]))
+
+    def summary(self, top=10):
+        return {
+            "hosts": len(self.hosts),
+            "open_ports": sum(len(ports) for ports in self.hosts.values()),
+            "distinct_banners": len(self.by_banner),
+            "distinct_services": sum(1 for hosts in self.by_fingerprint.values() if hosts),
+            "top_ports": self.ports()[:top],
+            "top_services": self.services()[:top]
+        }
+
+def iter_records(path):
+    """Read the findings of a scan output file (NDJSON or a JSON report)"""
+    with open(path, "r", encoding="utf-8") as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "{" and not path.endswith(".ndjson"):
+            try:
+                report = json.load(f)
+            except ValueError:
+                f.seek(0)
+            else:
+                if "findings" in report:
+                    yield from report["findings"]
+                    return
+                # A single diff_scan snapshot
+                yield report
+                return
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def load(paths, inventory=None):
+    """Build an inventory from scan output files and diff_scan history directories"""
+    inventory = inventory or Inventory()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".json")]
+        for file_path in files:
+            for record in iter_records(file_path):
+                if "type" in record:
+                    inventory.add_record(record)
+                elif "open_ports" in record:
+                    inventory.add_snapshot(record)
+    return inventory
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer service inventory questions from stored scan results")
+    parser.add_argument("paths", nargs="+",
+                        help="scan output (ndjson or json report, e.g. from --banners) or diff_scan history dirs")
+    parser.add_argument("--port", type=int, help="list the hosts with this port open")
+    parser.add_argument("--service", help="list the hosts running this product or fingerprint (e.g. nginx)")
+    parser.add_argument("--top", type=int, default=10, help="entries in the summary tables (default: 10)")
+    args = parser.parse_args(argv)
+
+    inventory = load(args.paths)
+    if args.port is not None:
+        print("\n".join(inventory.hosts_with_port(args.port)))
+    elif args.service:
+        print("\n".join(inventory.hosts_running(args.service)))
+    else:
+        summary = inventory.summary(args.top)
+        print(f"{summary['hosts']} hosts, {summary['open_ports']} open ports, "
+              f"{summary['distinct_banners']} distinct banners, {summary['distinct_services']} services")
+        print("\nTop ports:")
+        for port, count in summary["top_ports"]:
+            print(f"  {port:>5}  {count} hosts")
+        print("\nTop services:")
+        for name, count in summary["top_services"]:
+            print(f"  {name}  ({count} hosts)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
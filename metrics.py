@@ -0,0 +1,147 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# A tiny Prometheus-compatible metrics registry.  Hot paths should not call
+# these per probe: the port sweep counts locally and flushes in batches.
+
+REGISTRY = []
+
+def format_labels(labelnames, values, extra=None):
+    """Render a label set as {name="value",...}"""
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Metric:
+    """Base class for metrics with an optional fixed set of label names"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        if not self.labelnames and self.kind != "histogram":
+            # Unlabelled series exist from the start, so scrapes always see them
+            self.values[()] = 0
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """A value that goes up and down"""
+
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets"""
+
+    kind = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the body of a with-block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self.values.items())
+        for key, (counts, total, value_sum) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = format_labels(self.labelnames, key, [("le", repr(float(bound)))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = format_labels(self.labelnames, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{le} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {value_sum}")
+        return lines
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Scanner metrics
+PROBES = Counter("recon_probes_total", "TCP connect probes by outcome", ["result"])
+PROBES_IN_FLIGHT = Gauge("recon_probes_in_flight", "TCP connect probes currently running")
+PROBE_QUEUE_DEPTH = Gauge("recon_probe_queue_depth", "TCP connect probes submitted but not yet running")
+PORT_SWEEPS = Counter("recon_port_sweeps_total", "Port sweeps started")
+STAGE_SECONDS = Histogram("recon_stage_seconds", "Time spent in each scan stage", ["stage"])
+SCAN_REQUESTS = Counter("recon_scan_requests_total", "Scan requests handled by the web app", ["status"])
+SCAN_JOBS_ACTIVE = Gauge("recon_scan_jobs_active", "Scans admitted by the scheduler and running")
+SCAN_JOBS_WAITING = Gauge("recon_scan_jobs_waiting", "Scans waiting for admission")
+SCAN_JOBS_REJECTED = Counter("recon_scan_jobs_rejected_total", "Scans turned away by admission control", ["reason"])
+SCANS_COALESCED = Counter("recon_scans_coalesced_total", "Scan requests served by an identical scan already running")
+SOCKET_BUDGET = Gauge("recon_socket_budget", "Sockets the port sweeps may hold open at once (open-file and local port limits)")
+SOCKETS_RESERVED = Gauge("recon_sockets_reserved", "Sockets currently reserved by running port sweeps")
+STAGE_DEADLINES_EXCEEDED = Counter("recon_stage_deadlines_exceeded_total", "Scan stages cut short by the scan's time budget", ["stage"])
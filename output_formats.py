@@ -0,0 +1,228 @@
+import csv
+import json
+import re
+import sys
+import time
+
+# Every finding is a flat dict with at least a "type" and a "target" key:
+#   ip_address          - target resolved to "ip_address"
+#   domain_name         - "ip_address" resolved back to "domain_name"
+#   os_details          - "ttl", "ports" and "services" OS detection results
+#   open_port           - "port" found open on "ip_address"
+#   port_scan_complete  - sweep of "port_range" finished with "open_port_count" open,
+#                         "closed_port_count" closed and "filtered_port_count" filtered
+#                         ports ("host_filtered" when nothing answered at all,
+#                         "not_scanned_count" ports left when the host ran out of time)
+#   banner              - first line ("banner") the service on open "port" sent
+#   os_fingerprint      - "os" matched from the SYN-ACK "signature" ("match" is exact,
+#                         fuzzy or partial; "source" is syn_ack or tcp_info)
+#   udp_port            - UDP "port" on "ip_address" is in "state" (open, filtered, ...)
+#   subdomain           - "name" under the target domain resolves to "addresses"
+#                         (first one in "ip_address"), through "cnames" if any
+#   dns_wildcard        - the target domain has a wildcard record for "addresses"
+#   dns_record          - "name" has a "record_type" (MX, NS, TXT, ...) record holding "value"
+#   dns_host            - a "source" record named host "name", which resolves to
+#                         "addresses"; only scanned when "in_scope" (inside the target)
+#   error               - "stage" failed with "message"
+# Writers get each finding the moment it is known and never hold on to it,
+# so memory use does not grow with the size of the scan.
+
+FORMATS = ["text", "ndjson", "csv", "json", "xml"]
+
+# Characters XML 1.0 doesn't allow anywhere in a document, not even escaped
+XML_ILLEGAL = re.compile("[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]")
+
+def xml_safe(value):
+    """A value with the characters XML can't hold written as \\xNN escapes"""
+    return XML_ILLEGAL.sub(lambda match: f"\\x{ord(match.group()):02x}", value)
+
+# How the text output labels an error of each stage; other stages use their name
+ERROR_LABELS = {
+    "dns": "DNS lookup",
+    "reverse_dns": "Reverse DNS lookup",
+    "os_detection": "OS detection",
+    "port_scan": "Port scan",
+}
+
+def format_os_details(details):
+    """Format OS detection results as human readable text"""
+    result = f"OS Detection Results:\n"
+    result += f"  TTL-based: {details['ttl']}\n"
+    result += f"  Port-based: {details['ports']}\n"
+    result += f"  Service Info: {details['services']}"
+    return result
+
+class OutputWriter:
+    """Base class for scan output writers"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.owns_stream = False
+
+    def stage(self, message):
+        """Report progress of a scan stage (only shown in human output)"""
+
+    def write(self, record):
+        """Write one finding"""
+        if "time" not in record:
+            record = dict(record, time=round(time.time(), 3))
+        self.write_record(record)
+
+    def write_record(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        """Finish the output and release the stream"""
+        self.stream.flush()
+        if self.owns_stream:
+            self.stream.close()
+
+class TextWriter(OutputWriter):
+    """Human readable output, as printed by the interactive scanner"""
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.open_ports = {}
+
+    def stage(self, message):
+        print(message, file=self.stream)
+
+    def write(self, record):
+        # Timestamps are noise for humans
+        self.write_record(record)
+
+    def write_record(self, record):
+        kind = record["type"]
+        if kind == "ip_address":
+            print(f"IP Address: {record['ip_address']}", file=self.stream)
+        elif kind == "domain_name":
+            print(f"Domain Name: {record['domain_name']}", file=self.stream)
+        elif kind == "error":
+            stage = record.get("stage", "")
+            label = ERROR_LABELS.get(stage) or stage.replace("_", " ").capitalize() or "Error"
+            print(f"{label}: {record['message']}", file=self.stream)
+        elif kind == "os_details":
+            print(f"OS Details:\n{format_os_details(record)}", file=self.stream)
+        elif kind == "open_port":
+            # People want one sorted line, not ports in completion order
+            self.open_ports.setdefault(record["target"], []).append(record["port"])
+        elif kind == "os_fingerprint":
+            print(f"Passive OS: {record['os']} ({record['match'] or 'no'} match on {record['signature']})",
+                  file=self.stream)
+        elif kind == "banner":
+            print(f"Banner on port {record['port']}: {record['banner']}", file=self.stream)
+        elif kind == "udp_port":
+            print(f"UDP port {record['port']}: {record['state']}", file=self.stream)
+        elif kind == "subdomain":
+            print(f"Subdomain: {record['name']} ({record['addresses']})", file=self.stream)
+        elif kind == "dns_record":
+            print(f"DNS {record['record_type']}: {record['name']} -> {record['value']}", file=self.stream)
+        elif kind == "dns_host":
+            scope = "" if record["in_scope"] else ", outside the target, not scanned"
+            print(f"Host from {record['source']}: {record['name']} ({record['addresses']}{scope})",
+                  file=self.stream)
+        elif kind == "dns_wildcard":
+            print(f"Wildcard DNS: every name under {record['target']} resolves to {record['addresses']}",
+                  file=self.stream)
+        elif kind == "port_scan_complete":
+            open_ports = self.open_ports.pop(record["target"], [])
+            if open_ports:
+                print(f"Open ports: {', '.join(map(str, sorted(open_ports)))}", file=self.stream)
+            elif record.get("host_filtered"):
+                print(f"All ports in range {record['port_range']} are filtered "
+                      f"(host down or firewalled)", file=self.stream)
+            else:
+                print(f"No open ports found in range {record['port_range']}", file=self.stream)
+            if record.get("closed_port_count") or record.get("filtered_port_count"):
+                print(f"Not shown: {record['closed_port_count']} closed, "
+                      f"{record['filtered_port_count']} filtered", file=self.stream)
+            if record.get("not_scanned_count"):
+                print(f"Partial result: {record['not_scanned_count']} ports not scanned "
+                      f"(out of time)", file=self.stream)
+
+class NdjsonWriter(OutputWriter):
+    """One JSON object per line, flushed as soon as it is written"""
+
+    def write_record(self, record):
+        self.stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.stream.flush()
+
+class CsvWriter(OutputWriter):
+    """One CSV row per finding with a fixed set of columns"""
+
+    columns = ["time", "type", "target", "ip_address", "port", "detail"]
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.csv = csv.writer(self.stream, lineterminator="\n")
+        self.csv.writerow(self.columns)
+
+    def write_record(self, record):
+        # Anything that doesn't have its own column goes into "detail"
+        extra = {k: v for k, v in record.items() if k not in self.columns}
+        detail = "; ".join(f"{k}={v}" for k, v in extra.items())
+        self.csv.writerow([record.get("time", ""), record["type"], record.get("target", ""),
+                           record.get("ip_address", ""), record.get("port", ""), detail])
+        self.stream.flush()
+
+class JsonReportWriter(OutputWriter):
+    """A single JSON report, streamed out finding by finding"""
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.count = 0
+        self.stream.write('{"started_at":%s,"findings":[' % json.dumps(round(time.time(), 3)))
+
+    def write_record(self, record):
+        if self.count:
+            self.stream.write(",")
+        self.stream.write("\n" + json.dumps(record, separators=(",", ":")))
+        self.count += 1
+
+    def close(self):
+        self.stream.write('\n],"finished_at":%s,"finding_count":%d}\n'
+                          % (json.dumps(round(time.time(), 3)), self.count))
+        super().close()
+
+class XmlReportWriter(OutputWriter):
+    """A single XML report, streamed out finding by finding"""
+
+    def __init__(self, stream=None):
+        # xml.sax drags in urllib, http and ssl, so only load it for XML output
+        from xml.sax.saxutils import quoteattr
+        super().__init__(stream)
+        self.quoteattr = quoteattr
+        self.count = 0
+        self.stream.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.stream.write(f'<scan started_at="{round(time.time(), 3)}">\n')
+
+    def write_record(self, record):
+        attrs = " ".join(f"{key}={self.quoteattr(xml_safe(str(value)))}" for key, value in record.items()
+                         if key != "type")
+        self.stream.write(f"  <{record['type']} {attrs}/>\n")
+        self.count += 1
+
+    def close(self):
+        self.stream.write(f'  <summary finished_at="{round(time.time(), 3)}" finding_count="{self.count}"/>\n')
+        self.stream.write("</scan>\n")
+        super().close()
+
+WRITERS = {
+    "text": TextWriter,
+    "ndjson": NdjsonWriter,
+    "csv": CsvWriter,
+    "json": JsonReportWriter,
+    "xml": XmlReportWriter
+}
+
+def open_writer(output_format="text", path=None):
+    """Create a writer for the given format, writing to a file or stdout"""
+    if output_format not in WRITERS:
+        raise ValueError(f"Unknown output format: {output_format} (choose from {', '.join(FORMATS)})")
+
+    if path and path != "-":
+        stream = open(path, "w", encoding="utf-8", newline="")
+        writer = WRITERS[output_format](stream)
+        writer.owns_stream = True
+        return writer
+    return WRITERS[output_format]()
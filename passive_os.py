@@ -0,0 +1,328 @@
+import select
+import socket
+import struct
+import threading
+from collections import Counter, namedtuple
+
+import scan_engine
+
+# Passive OS fingerprinting.  Every open port the sweep finds answers its SYN
+# with a SYN-ACK, and the TCP/IP stack that built it leaves its habits in the
+# headers: initial TTL, window size, MSS, window scale, TCP option order and
+# the DF bit.  A raw socket listening while the sweep runs sees those SYN-ACKs,
+# so fingerprinting sends nothing of its own.  Without the privileges for a raw
+# socket (root / CAP_NET_RAW on Linux), one connect to an open port and the
+# kernel's TCP_INFO give the MSS, window scale and option set instead.
+
+# p0f-style SYN-ACK signatures, most specific first:
+#   ver:ittl:olen:mss:wsize,scale:olayout:quirks:pclass
+# wsize is a number, mss*N or *; quirks are df (don't fragment), id+ (DF set
+# with a non-zero IP ID) and id- (no DF and a zero IP ID).
+SIGNATURES = (
+    ("Linux 2.6.x", "*:64:0:*:5792,*:mss,sok,ts,nop,ws:df:0"),
+    ("Linux 3.x", "*:64:0:*:14480,*:mss,sok,ts,nop,ws:df:0"),
+    ("Linux 3.x-4.x", "*:64:0:*:28960,*:mss,sok,ts,nop,ws:df:0"),
+    ("Linux 4.x-6.x", "*:64:0:*:65160,*:mss,sok,ts,nop,ws:df:0"),
+    ("Linux 4.x-6.x", "*:64:0:*:43440,*:mss,sok,ts,nop,ws:df:0"),
+    ("Linux", "*:64:0:*:*,*:mss,sok,ts,nop,ws:df:0"),
+    ("Linux (no timestamps)", "*:64:0:*:*,*:mss,nop,nop,sok,nop,ws:df:0"),
+    ("Windows 7-11", "*:128:0:*:8192,*:mss,nop,ws,sok,ts:df,id+:0"),
+    ("Windows 10/11", "*:128:0:*:65535,*:mss,nop,ws,nop,nop,sok:df,id+:0"),
+    ("Windows 7-11", "*:128:0:*:*,*:mss,nop,ws,sok,ts:df,id+:0"),
+    ("Windows 7-11", "*:128:0:*:*,*:mss,nop,ws,nop,nop,sok:df,id+:0"),
+    ("Windows XP/2003", "*:128:0:*:65535,0:mss,nop,nop,sok:df,id+:0"),
+    ("Windows XP/2003", "*:128:0:*:*,0:mss,nop,nop,sok:df,id+:0"),
+    ("FreeBSD", "*:64:0:*:65535,*:mss,nop,ws,sok,ts:df,id+:0"),
+    ("OpenBSD", "*:64:0:*:16384,*:mss,nop,nop,sok,nop,ws,nop,nop,ts:df,id+:0"),
+    ("macOS/iOS", "*:64:0:*:65535,*:mss,nop,ws,nop,nop,ts,sok,eol+1:df,id+:0"),
+    ("Cisco IOS", "*:255:0:*:*,*:mss::0"),
+)
+
+# Initial TTLs in use; a packet's TTL is rounded up to the next one
+INITIAL_TTLS = (32, 64, 128, 255)
+
+# TCP option kinds and their names in signatures
+EOL, NOP, MSS, WS, SOK, SACK, TS = 0, 1, 2, 3, 4, 5, 8
+OPTION_NAMES = {NOP: "nop", MSS: "mss", WS: "ws", SOK: "sok", SACK: "sack", TS: "ts"}
+
+# SYN-ACKs kept per target; the most common fingerprint among them wins
+MAX_SYN_ACKS = 16
+
+# How long stopping waits for the capture thread to exit
+STOP_TIMEOUT = 1
+
+# tcpi_options bits in Linux's struct tcp_info
+TCPI_OPT_TIMESTAMPS, TCPI_OPT_SACK, TCPI_OPT_WSCALE = 1, 2, 4
+TCP_INFO = getattr(socket, "TCP_INFO", None)
+
+Signature = namedtuple("Signature", "label ittl olen mss wsize scale layout quirks")
+# What the target's stack sent; None for fields the source couldn't see
+SynAck = namedtuple("SynAck", "ttl olen df ip_id window mss scale layout source")
+
+def parse_signature(label, text):
+    _, ittl, olen, mss, window, layout, quirks, _ = text.split(":")
+    wsize, scale = window.split(",")
+    return Signature(label, int(ittl), int(olen), mss, wsize, scale,
+                     tuple(layout.split(",")) if layout else (), frozenset(filter(None, quirks.split(","))))
+
+COMPILED_SIGNATURES = tuple(parse_signature(label, text) for label, text in SIGNATURES)
+
+def initial_ttl(ttl):
+    """The TTL the packet most likely started with"""
+    for start in INITIAL_TTLS:
+        if ttl <= start:
+            return start
+    return 255
+
+def parse_tcp_options(data):
+    """The option layout, MSS and window scale of a TCP option block"""
+    layout = []
+    mss = scale = None
+    offset = 0
+    while offset < len(data):
+        kind = data[offset]
+        if kind == EOL:
+            # Padding after the end of the list is part of the fingerprint
+            layout.append(f"eol+{len(data) - offset - 1}")
+            break
+        if kind == NOP:
+            layout.append("nop")
+            offset += 1
+            continue
+        if offset + 1 >= len(data) or data[offset + 1] < 2:
+            layout.append("bad")
+            break
+        length = data[offset + 1]
+        value = data[offset + 2:offset + length]
+        if kind == MSS and len(value) == 2:
+            mss = struct.unpack(">H", value)[0]
+        elif kind == WS and len(value) == 1:
+            scale = value[0]
+        layout.append(OPTION_NAMES.get(kind, f"?{kind}"))
+        offset += length
+    return tuple(layout), mss, scale
+
+def parse_syn_ack(packet, source=None):
+    """Read a SYN-ACK out of a raw IPv4 packet, or None for anything else"""
+    if len(packet) < 40 or packet[0] >> 4 != 4:
+        return None
+    ihl = (packet[0] & 0x0f) * 4
+    if struct.unpack(">H", packet[6:8])[0] & 0x1fff:
+        return None  # a later fragment
+    if packet[9] != socket.IPPROTO_TCP or len(packet) < ihl + 20:
+        return None
+    if source is not None and packet[12:16] != source:
+        return None
+    tcp = packet[ihl:]
+    flags = tcp[13]
+    if flags & 0x12 != 0x12:
+        return None
+    data_offset = (tcp[12] >> 4) * 4
+    layout, mss, scale = parse_tcp_options(tcp[20:data_offset])
+    ip_id = struct.unpack(">H", packet[4:6])[0]
+    df = bool(packet[6] & 0x40)
+    window = struct.unpack(">H", tcp[14:16])[0]
+    return SynAck(packet[8], ihl - 20, df, ip_id, window, mss, scale, layout, "syn_ack")
+
+def quirks_of(syn_ack):
+    quirks = set()
+    if syn_ack.df:
+        quirks.add("df")
+        if syn_ack.ip_id:
+            quirks.add("id+")
+    elif syn_ack.ip_id == 0:
+        quirks.add("id-")
+    return quirks
+
+def window_matches(wsize, syn_ack):
+    if wsize == "*":
+        return True
+    if wsize.startswith("mss*"):
+        return syn_ack.mss is not None and syn_ack.window == syn_ack.mss * int(wsize[4:])
+    return syn_ack.window == int(wsize)
+
+def signature_matches(signature, syn_ack, fuzzy=False):
+    """Whether a SYN-ACK fits a signature; fuzzy ignores the window and quirks"""
+    if syn_ack.source == "tcp_info":
+        # Only the option set and window scale are known
+        options = {name for name in syn_ack.layout if name not in ("nop", "eol")}
+        wanted = {name for name in signature.layout if name not in ("nop",) and not name.startswith("eol")}
+        return options == wanted and (signature.scale == "*" or int(signature.scale) == (syn_ack.scale or 0))
+    if initial_ttl(syn_ack.ttl) != signature.ittl or syn_ack.olen != signature.olen:
+        return False
+    if syn_ack.layout != signature.layout:
+        return False
+    if signature.scale != "*" and int(signature.scale) != (syn_ack.scale or 0):
+        return False
+    if fuzzy:
+        return True
+    return window_matches(signature.wsize, syn_ack) and signature.quirks == quirks_of(syn_ack)
+
+def describe(syn_ack):
+    """The SYN-ACK written as a p0f-style signature"""
+    mss = "*" if syn_ack.mss is None else syn_ack.mss
+    scale = "*" if syn_ack.scale is None else syn_ack.scale
+    if syn_ack.source == "tcp_info":
+        return f"4:*:0:{mss}:*,{scale}:{','.join(syn_ack.layout)}:*:0"
+    distance = initial_ttl(syn_ack.ttl) - syn_ack.ttl
+    return (f"4:{syn_ack.ttl}+{distance}:{syn_ack.olen}:{mss}:{syn_ack.window},{scale}:"
+            f"{','.join(syn_ack.layout)}:{','.join(sorted(quirks_of(syn_ack)))}:0")
+
+def match(syn_ack):
+    """Find the OS behind a SYN-ACK: its label and how good the match is"""
+    if syn_ack.source == "tcp_info":
+        # Without the TTL, window and option order several stacks look alike,
+        # so only name the families that fit
+        families = []
+        for signature in COMPILED_SIGNATURES:
+            family = signature.label.split()[0]
+            if family not in families and signature_matches(signature, syn_ack):
+                families.append(family)
+        return (" or ".join(families), "partial") if families else (None, None)
+    for quality, fuzzy in (("exact", False), ("fuzzy", True)):
+        for signature in COMPILED_SIGNATURES:
+            if signature_matches(signature, syn_ack, fuzzy):
+                return signature.label, quality
+    return None, None
+
+def fingerprint(syn_ack):
+    """Describe a SYN-ACK as the result of the passive OS stage"""
+    label, quality = match(syn_ack)
+    result = {"os": label or "Unknown", "match": quality, "source": syn_ack.source,
+              "signature": describe(syn_ack)}
+    if syn_ack.ttl is not None:
+        result["distance"] = initial_ttl(syn_ack.ttl) - syn_ack.ttl
+    return result
+
+def tcp_info_syn_ack(ip_address, port, timeout=1):
+    """What TCP_INFO says about the target's SYN-ACK, after one connect (Linux only)"""
+    if TCP_INFO is None:
+        return None
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        if sock.connect_ex((ip_address, port)) != 0:
+            return None
+        info = sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO, 104)
+    except OSError:
+        return None
+    finally:
+        scan_engine.close_with_reset(sock)
+    # u8 state, ca_state, retransmits, probes, backoff, options, wscales; u32 rto, ato, snd_mss
+    options, wscales = info[5], info[6]
+    snd_mss = struct.unpack("I", info[16:20])[0]
+    layout = ["mss"]
+    if options & TCPI_OPT_SACK:
+        layout.append("sok")
+    if options & TCPI_OPT_TIMESTAMPS:
+        layout.append("ts")
+        # snd_mss has the timestamp option taken off already
+        snd_mss += 12
+    scale = None
+    if options & TCPI_OPT_WSCALE:
+        layout.append("ws")
+        scale = wscales & 0x0f
+    return SynAck(None, None, None, None, None, snd_mss, scale, tuple(layout), "tcp_info")
+
+class SynAckCapture:
+    """Collect the SYN-ACKs one target sends while a port sweep runs"""
+
+    def __init__(self, ip_address):
+        self.ip_address = ip_address
+        self.source = socket.inet_aton(ip_address)
+        self.syn_acks = []
+        self.sock = None
+        # stop() writes to this pair to wake the listener: neither close() nor
+        # shutdown() interrupts a recv on a raw socket
+        self.waker = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start listening; raises OSError (usually PermissionError) without raw socket rights"""
+        # Linux hands a copy of every incoming TCP packet, IP header included, to this socket
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
+        self.waker = socket.socketpair()
+        self.thread = threading.Thread(target=self.listen, name="syn-ack-capture", daemon=True)
+        self.thread.start()
+        return self
+
+    def listen(self):
+        while not self.stopped.is_set() and len(self.syn_acks) < MAX_SYN_ACKS:
+            try:
+                readable, _, _ = select.select([self.sock, self.waker[0]], [], [])
+                if self.waker[0] in readable:
+                    return
+                packet = self.sock.recv(65535)
+            except OSError:
+                return
+            syn_ack = parse_syn_ack(packet, self.source)
+            if syn_ack is not None:
+                self.syn_acks.append(syn_ack)
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.waker is not None:
+            self.waker[1].send(b"\0")
+        if self.thread is not None:
+            self.thread.join(timeout=STOP_TIMEOUT)
+        for sock in (self.sock, *(self.waker or ())):
+            if sock is not None:
+                sock.close()
+
+class PassiveObserver:
+    """Watches a target's SYN-ACKs during a sweep and fingerprints its OS afterwards"""
+
+    def __init__(self, ip_address):
+        self.ip_address = ip_address
+        self.capture = None
+        try:
+            self.capture = SynAckCapture(ip_address).start()
+        except (OSError, ValueError):
+            # No raw socket (not root, not Linux or not IPv4): fall back to TCP_INFO
+            self.capture = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.stop()
+
+    def fingerprint(self, open_ports, timeout=1, deadline=None):
+        """Fingerprint the target from what was captured, or None when nothing is known
+
+        Needs at least one open port: closed ones answer with a reset, not a SYN-ACK.
+        With a stage deadline, the TCP_INFO fallback only connects in the time left.
+        """
+        self.close()
+        if deadline is not None:
+            if deadline.expired:
+                # No time to connect for TCP_INFO; use only what was captured
+                if open_ports and not (self.capture and self.capture.syn_acks):
+                    deadline.expire()
+                open_ports = []
+            else:
+                timeout = min(timeout, deadline.remaining())
+        syn_acks = self.capture.syn_acks if self.capture is not None else []
+        if syn_acks:
+            # Load balancers can put several stacks behind one address; go with the majority
+            signatures = Counter(describe(syn_ack) for syn_ack in syn_acks)
+            common = signatures.most_common(1)[0][0]
+            result = fingerprint(next(s for s in syn_acks if describe(s) == common))
+            result["syn_acks"] = len(syn_acks)
+            return result
+        if open_ports:
+            syn_ack = tcp_info_syn_ack(self.ip_address, open_ports[0], timeout)
+            if syn_ack is not None:
+                return fingerprint(syn_ack)
+        return None
+
+def observe(ip_address):
+    """Start watching a target's SYN-ACKs; use as a context manager around the port sweep"""
+    return PassiveObserver(ip_address)
@@ -0,0 +1,198 @@
+import json
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+
+import scan_engine
+
+# Scan templates describe a check declaratively (ports, what to send, timeouts,
+# how to read the result) in a JSON or YAML file under scan_templates/.  Each
+# template is compiled once into an immutable ProbePlan that any number of
+# targets and threads can run without building anything per target.
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scan_templates")
+TEMPLATE_EXTENSIONS = (".json", ".yaml", ".yml")
+
+# port_sweep: a port spec and timing for the port sweep
+# os_ports:   probe ports and turn the open ones into OS hints with rules
+# banners:    send a payload to each port and keep the first line of the answer
+#             (and the Server header, for HTTP requests)
+KINDS = ("port_sweep", "os_ports", "banners")
+
+Probe = namedtuple("Probe", "port service payload")
+# A rule adds its hint when all of `all_ports`, at least one of `any_ports`
+# (if given) and none of `no_ports` are open, with min_open..max_open ports open
+Rule = namedtuple("Rule", "hint all_ports any_ports no_ports min_open max_open")
+ProbePlan = namedtuple("ProbePlan", "name kind description timeout concurrency port_spec ports probes rules "
+                                    "read_bytes max_chars")
+
+RULE_KEYS = {"hint", "all", "any", "none", "min_open", "max_open"}
+
+def find_template(name):
+    """The path of a template given by file name or by its name in scan_templates/"""
+    if os.path.isfile(name):
+        return name
+    for extension in TEMPLATE_EXTENSIONS:
+        path = os.path.join(TEMPLATE_DIR, name + extension)
+        if os.path.isfile(path):
+            return path
+    raise ValueError(f"Unknown scan template: {name} (choose from {', '.join(template_names())})")
+
+def template_names():
+    """The templates shipped in scan_templates/"""
+    try:
+        files = os.listdir(TEMPLATE_DIR)
+    except OSError:
+        return []
+    return sorted(os.path.splitext(f)[0] for f in files if f.endswith(TEMPLATE_EXTENSIONS))
+
+def load_template(path):
+    """Read a template file (YAML needs PyYAML installed)"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f"PyYAML is needed to read {path}: pip install pyyaml")
+        return yaml.safe_load(f)
+
+def compile_port(value, where):
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{where}: port must be a number, got {value!r}")
+    if not 1 <= port <= 65535:
+        raise ValueError(f"{where}: port {port} is out of range")
+    return port
+
+def compile_probe(entry, where):
+    if not isinstance(entry, dict) or "port" not in entry:
+        raise ValueError(f"{where}: every probe needs a port")
+    port = compile_port(entry["port"], where)
+    payload = entry.get("send", "")
+    return Probe(port, str(entry.get("service", port)), payload.encode("latin-1"))
+
+def compile_rule(entry, where):
+    if not isinstance(entry, dict) or "hint" not in entry:
+        raise ValueError(f"{where}: every rule needs a hint")
+    unknown = set(entry) - RULE_KEYS
+    if unknown:
+        raise ValueError(f"{where}: unknown rule keys {', '.join(sorted(unknown))}")
+    ports = {key: frozenset(compile_port(p, where) for p in entry.get(key, [])) for key in ("all", "any", "none")}
+    return Rule(entry["hint"], ports["all"], ports["any"], ports["none"],
+                int(entry.get("min_open", 0)), entry.get("max_open"))
+
+def compile_template(template, name="template"):
+    """Validate a template and compile it into a ProbePlan"""
+    if not isinstance(template, dict):
+        raise ValueError(f"{name}: a template must be a mapping")
+    kind = template.get("kind")
+    if kind not in KINDS:
+        raise ValueError(f"{name}: kind must be one of {', '.join(KINDS)}, got {kind!r}")
+
+    timing = scan_engine.get_timing(template.get("timing", scan_engine.DEFAULT_TIMING),
+                                    template.get("timeout"), template.get("concurrency"))
+    port_spec = str(template.get("ports", "")) if kind == "port_sweep" else ""
+    ports = ()
+    probes = ()
+    rules = ()
+    if kind == "port_sweep":
+        # Parsed and ordered once, not per target
+        ports = tuple(scan_engine.parse_port_spec(port_spec or "1-1024"))
+    else:
+        probes = tuple(compile_probe(entry, name) for entry in template.get("probes", []))
+        if not probes:
+            raise ValueError(f"{name}: {kind} templates need probes")
+        rules = tuple(compile_rule(entry, name) for entry in template.get("rules", []))
+
+    return ProbePlan(name, kind, template.get("description", ""), float(timing["timeout"]),
+                     int(timing["concurrency"]), port_spec or "1-1024", ports, probes, rules,
+                     int(template.get("read_bytes", 1024)), int(template.get("max_chars", 50)))
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+def get_plan(name):
+    """Get the compiled plan for a template, compiling it on first use"""
+    with _plans_lock:
+        plan = _plans.get(name)
+        if plan is None:
+            path = find_template(name)
+            plan = _plans[name] = compile_template(load_template(path), name)
+        return plan
+
+def rule_matches(rule, open_ports):
+    if not rule.all_ports <= open_ports.keys():
+        return False
+    if rule.any_ports and rule.any_ports.isdisjoint(open_ports):
+        return False
+    if not rule.no_ports.isdisjoint(open_ports):
+        return False
+    count = len(open_ports)
+    return count >= rule.min_open and (rule.max_open is None or count <= rule.max_open)
+
+def run_os_ports(plan, ip_address):
+    """Probe the plan's ports and describe the host from the open ones"""
+    try:
+        open_ports = {probe.port: probe.service for probe in plan.probes
+                      if scan_engine.connect_port(ip_address, probe.port, plan.timeout) == 0}
+        if not open_ports:
+            return "No common ports open or host is filtering"
+
+        os_hints = [rule.hint for rule in plan.rules if rule_matches(rule, open_ports)]
+        listing = ', '.join(f'{p}({s})' for p, s in open_ports.items())
+        if os_hints:
+            return f"{', '.join(os_hints)} - Open ports: {listing}"
+        return f"Open ports: {listing} - OS detection inconclusive"
+    except Exception as e:
+        return f"Port detection error: {e}"
+
+def run_banners(plan, ip_address):
+    """Send each probe's payload and collect the first line of every answer"""
+    try:
+        service_details = []
+        for probe in plan.probes:
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.settimeout(plan.timeout)
+                try:
+                    if sock.connect_ex((ip_address, probe.port)) != 0:
+                        continue
+                    sock.send(probe.payload)
+                    # Web servers name themselves in the Server header of their answer
+                    http = probe.payload.startswith((b"HEAD ", b"GET "))
+                    try:
+                        # Read into the thread's buffer; only the kept line is decoded
+                        banner = scan_engine.read_banner(sock, plan.read_bytes, time.monotonic() + plan.timeout,
+                                                         headers=http)
+                    except OSError:
+                        service_details.append(f"{probe.service}({probe.port}): Banner read failed")
+                        continue
+                    if http:
+                        first_line = scan_engine.http_banner(banner, plan.max_chars)
+                    else:
+                        first_line = scan_engine.banner_line(banner, plan.max_chars)
+                    service_details.append(f"{probe.service}({probe.port}): {first_line or 'No banner'}")
+                finally:
+                    scan_engine.close_with_reset(sock)
+            except OSError:
+                # Skip this service if we can't get a banner
+                pass
+
+        if service_details:
+            return "; ".join(service_details)
+        return "No service banners captured"
+    except Exception as e:
+        return f"Banner grabbing error: {e}"
+
+def run_plan(plan, ip_address, executor=None):
+    """Run a compiled plan against one target"""
+    if plan.kind == "os_ports":
+        return run_os_ports(plan, ip_address)
+    if plan.kind == "banners":
+        return run_banners(plan, ip_address)
+    return scan_engine.scan_port_states(ip_address, plan.ports, timeout=plan.timeout,
+                                        concurrency=plan.concurrency, executor=executor)
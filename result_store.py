@@ -0,0 +1,331 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from output_formats import OutputWriter, format_os_details
+
+# Scan results kept in SQLite, so the JSON API can page through jobs, hosts and
+# ports of any size.  Writers insert findings as they are streamed out of a
+# scan; readers walk the tables by primary key (keyset pagination) and hand
+# rows on one at a time, so neither side ever holds a whole result set.
+
+RESULT_DB = os.environ.get('RECON_RESULT_DB', 'scan_results.db')
+
+# Findings written between commits
+COMMIT_EVERY = 500
+
+# Raised when the database can't be read or written
+StoreError = sqlite3.Error
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    targets TEXT,
+    port_spec TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    id INTEGER PRIMARY KEY,
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    target TEXT NOT NULL,
+    ip_address TEXT NOT NULL DEFAULT '',
+    domain_name TEXT,
+    os TEXT,
+    os_details TEXT,
+    open_port_count INTEGER,
+    closed_port_count INTEGER,
+    filtered_port_count INTEGER,
+    not_scanned_count INTEGER,
+    host_filtered INTEGER,
+    updated_at REAL,
+    UNIQUE (job_id, target, ip_address)
+);
+CREATE TABLE IF NOT EXISTS ports (
+    id INTEGER PRIMARY KEY,
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    target TEXT NOT NULL,
+    ip_address TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    protocol TEXT NOT NULL,
+    state TEXT NOT NULL,
+    banner TEXT,
+    found_at REAL
+);
+CREATE INDEX IF NOT EXISTS ports_by_host ON ports (job_id, ip_address, port);
+CREATE INDEX IF NOT EXISTS ports_by_port ON ports (job_id, port);
+"""
+
+# What the API may select and filter on, per resource
+COLUMNS = {
+    'jobs': ('id', 'kind', 'status', 'targets', 'port_spec', 'created_at', 'finished_at', 'error'),
+    'hosts': ('id', 'job_id', 'target', 'ip_address', 'domain_name', 'os', 'os_details', 'open_port_count',
+              'closed_port_count', 'filtered_port_count', 'not_scanned_count', 'host_filtered', 'updated_at'),
+    'ports': ('id', 'job_id', 'target', 'ip_address', 'port', 'protocol', 'state', 'banner', 'found_at'),
+}
+FILTERS = {
+    'jobs': ('kind', 'status'),
+    'hosts': ('target', 'ip_address', 'domain_name', 'os', 'host_filtered'),
+    'ports': ('target', 'ip_address', 'port', 'protocol', 'state'),
+}
+# Columns whose filters take numbers and ranges ("22,80,8000-8100")
+NUMERIC = {'id', 'job_id', 'port', 'open_port_count', 'closed_port_count', 'filtered_port_count',
+           'not_scanned_count', 'host_filtered'}
+
+def encode_cursor(last_id):
+    """An opaque cursor pointing just past the row with id `last_id`"""
+    return base64.urlsafe_b64encode(json.dumps({'after': last_id}).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """The id a cursor points past (0 for no cursor); ValueError for a bad one"""
+    if not cursor:
+        return 0
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return int(data['after'])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def filter_clause(column, value):
+    """SQL and parameters for one filter; comma separated values match any of them"""
+    parts = []
+    params = []
+    for piece in str(value).split(','):
+        piece = piece.strip()
+        if column in NUMERIC:
+            low, dash, high = piece.partition('-')
+            try:
+                if dash:
+                    parts.append(f"{column} BETWEEN ? AND ?")
+                    params += [int(low), int(high)]
+                else:
+                    parts.append(f"{column} = ?")
+                    params.append(int(piece))
+            except ValueError:
+                raise ValueError(f"{column} filter needs numbers, got {piece!r}")
+        else:
+            parts.append(f"{column} = ?")
+            params.append(piece)
+    return "(" + " OR ".join(parts) + ")", params
+
+class ResultStore:
+    """Scan jobs and their findings in a SQLite database"""
+
+    def __init__(self, path=RESULT_DB):
+        self.path = path
+        # SQLite connections can't be shared between threads
+        self.local = threading.local()
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    def open(self):
+        """A new connection to the database"""
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        # Readers page through results while scans are still writing them
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def connect(self):
+        """This thread's connection"""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self.open()
+        return db
+
+    def create_job(self, kind, targets='', port_spec=None):
+        with self.connect() as db:
+            return db.execute("INSERT INTO jobs (kind, status, targets, port_spec, created_at) "
+                              "VALUES (?, 'running', ?, ?, ?)",
+                              (kind, targets, port_spec, time.time())).lastrowid
+
+    def finish_job(self, job_id, status='done', error=None):
+        with self.connect() as db:
+            db.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                       (status, error, time.time(), job_id))
+
+    def get_job(self, job_id):
+        row = self.connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def writer(self, job_id):
+        """An output writer that records a scan's findings under a job"""
+        return StoreWriter(self, job_id)
+
+    def save_scan(self, target, result):
+        """Record the response of one web app scan as a job of its own and return its id"""
+        job_id = self.create_job('scan', target)
+        writer = self.writer(job_id)
+        try:
+            record = {'target': target, 'ip_address': result['ip_address'], 'time': round(time.time(), 3)}
+            states = result['port_states']
+            domain_name = result.get('domain')
+            with writer.lock:
+                writer.host(writer.db, record, domain_name=None if "Error" in str(domain_name) else domain_name,
+                            os=(result.get('os_fingerprint') or {}).get('os'), os_details=result.get('os_details'),
+                            open_port_count=states['open'], closed_port_count=states['closed'],
+                            filtered_port_count=states['filtered'], not_scanned_count=states['not_scanned'],
+                            host_filtered=int(states['host_filtered']))
+            for port in result['open_ports']:
+                writer.write(dict(record, type='open_port', port=port))
+        finally:
+            writer.close()
+        self.finish_job(job_id, 'partial' if result.get('partial') else 'done')
+        return job_id
+
+    def query(self, resource, after=0, limit=100, fields=None, filters=None, job_id=None):
+        """Build the SQL for up to `limit` rows of a resource with an id above `after`
+
+        `fields` picks columns (id is always fetched, for the next cursor) and
+        `filters` maps filterable columns to values.  Raises ValueError for
+        unknown fields and filters.
+        """
+        columns = COLUMNS[resource]
+        unknown = [field for field in fields or () if field not in columns]
+        if unknown:
+            raise ValueError(f"Unknown {resource} fields: {', '.join(unknown)} (choose from {', '.join(columns)})")
+        where = ["id > ?"]
+        params = [after]
+        if job_id is not None:
+            where.append("job_id = ?")
+            params.append(job_id)
+        for column, value in (filters or {}).items():
+            if column not in FILTERS[resource]:
+                raise ValueError(f"Can't filter {resource} by {column} (choose from {', '.join(FILTERS[resource])})")
+            clause, values = filter_clause(column, value)
+            where.append(clause)
+            params += values
+        selected = ", ".join(dict.fromkeys(['id'] + list(fields or columns)))
+        sql = f"SELECT {selected} FROM {resource} WHERE {' AND '.join(where)} ORDER BY id LIMIT ?"
+        return sql, params + [limit]
+
+    def iter_rows(self, sql, params):
+        """Yield rows straight off a database cursor"""
+        # A cursor of its own, so pages read at the same time don't interfere
+        cursor = self.connect().cursor()
+        try:
+            yield from cursor.execute(sql, params)
+        finally:
+            cursor.close()
+
+    def page(self, resource, cursor=None, limit=100, fields=None, filters=None, job_id=None):
+        """One page of a resource, checked up front and read lazily (see Page)"""
+        fields = list(fields) if fields else list(COLUMNS[resource])
+        # One row past the page says whether there is another page
+        sql, params = self.query(resource, decode_cursor(cursor), limit + 1, fields, filters, job_id)
+        return Page(self.iter_rows(sql, params), fields, limit)
+
+    def close(self):
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            db.close()
+            self.local.db = None
+
+class Page:
+    """The items of one page, read from the database as they are iterated
+
+    next_cursor is set once iteration is done, when there are more rows.
+    """
+
+    def __init__(self, rows, fields, limit):
+        self.rows = rows
+        self.fields = fields
+        self.limit = limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        count = 0
+        last_id = None
+        try:
+            for row in self.rows:
+                if count == self.limit:
+                    self.next_cursor = encode_cursor(last_id)
+                    break
+                count += 1
+                last_id = row['id']
+                yield {field: row[field] for field in self.fields}
+        finally:
+            self.rows.close()
+
+class StoreWriter(OutputWriter):
+    """Records the findings of a scan in the result store as they are written"""
+
+    def __init__(self, store, job_id):
+        super().__init__()
+        self.store = store
+        self.job_id = job_id
+        # One connection, so parallel host scans write into the same transaction
+        self.db = store.open()
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+
+    def write_record(self, record):
+        with self.lock:
+            db = self.db
+            self.insert(db, record)
+            self.uncommitted += 1
+            # Hosts become visible to the API as they finish
+            if self.uncommitted >= COMMIT_EVERY or record['type'] == 'port_scan_complete':
+                db.commit()
+                self.uncommitted = 0
+
+    def host(self, db, record, **values):
+        """Insert or update the row of the record's host"""
+        values['updated_at'] = record['time']
+        columns = ", ".join(values)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in values)
+        db.execute(f"INSERT INTO hosts (job_id, target, ip_address, {columns}) "
+                   f"VALUES (?, ?, ?, {', '.join('?' * len(values))}) "
+                   f"ON CONFLICT (job_id, target, ip_address) DO UPDATE SET {updates}",
+                   [self.job_id, record['target'], record.get('ip_address') or ''] + list(values.values()))
+
+    def insert(self, db, record):
+        kind = record['type']
+        if kind == 'ip_address':
+            self.host(db, record)
+        elif kind == 'domain_name':
+            self.host(db, record, domain_name=record['domain_name'])
+        elif kind == 'os_details':
+            self.host(db, record, os_details=format_os_details(record))
+        elif kind == 'os_fingerprint':
+            self.host(db, record, os=record['os'])
+        elif kind == 'port_scan_complete':
+            self.host(db, record, open_port_count=record['open_port_count'],
+                      closed_port_count=record['closed_port_count'],
+                      filtered_port_count=record['filtered_port_count'],
+                      not_scanned_count=record.get('not_scanned_count', 0),
+                      host_filtered=int(record['host_filtered']))
+        elif kind in ('open_port', 'udp_port'):
+            db.execute("INSERT INTO ports (job_id, target, ip_address, port, protocol, state, found_at) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (self.job_id, record['target'], record['ip_address'], record['port'],
+                        'tcp' if kind == 'open_port' else 'udp', record.get('state', 'open'), record['time']))
+        elif kind == 'banner':
+            db.execute("UPDATE ports SET banner = ? WHERE job_id = ? AND ip_address = ? AND port = ? "
+                       "AND protocol = 'tcp'", (record['banner'], self.job_id, record['ip_address'],
+                                                 record['port']))
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Get this process's result store, opening it on first use"""
+    global _store, _store_pid
+    with _store_lock:
+        # Like the scan pool, each forked server worker opens its own connections
+        if _store is None or _store_pid != os.getpid():
+            _store = ResultStore()
+            _store_pid = os.getpid()
+        return _store
@@ -0,0 +1,169 @@
+import asyncio
+import collections
+import contextvars
+import ipaddress
+import threading
+
+import tracing
+from dns_client import PTR, AsyncResolver, DnsError
+
+# Bulk reverse DNS: PTR lookups for every address in a target stream, resolved
+# concurrently a little ahead of the scan instead of one blocking
+# gethostbyaddr per host.
+
+# PTR queries in flight at once
+DEFAULT_CONCURRENCY = 256
+
+# How many targets are read ahead of the scan so their names are ready in time
+DEFAULT_LOOKAHEAD = 4096
+
+# How long a scan waits for a name that hasn't come back yet
+LOOKUP_TIMEOUT = 30
+
+def ptr_name(ip_address):
+    """The in-addr.arpa (or ip6.arpa) name holding an address's PTR record"""
+    return ipaddress.ip_address(ip_address).reverse_pointer
+
+def is_ip_address(target):
+    try:
+        ipaddress.ip_address(target)
+        return True
+    except ValueError:
+        return False
+
+def expand_range(target):
+    """Yield the host addresses of a CIDR range, or the target itself when it isn't one"""
+    if "/" not in target:
+        yield target
+        return
+    try:
+        network = ipaddress.ip_network(target, strict=False)
+    except ValueError:
+        yield target
+        return
+    if network.num_addresses == 1:
+        yield str(network.network_address)
+        return
+    for address in network.hosts():
+        yield str(address)
+
+async def lookup_ptr(resolver, ip_address):
+    """The first PTR name of an address, or None"""
+    try:
+        result = await resolver.query(ptr_name(ip_address), PTR)
+    except DnsError:
+        return None
+    names = [record["data"] for record in result["answers"] if record["type"] == "PTR"]
+    return names[0] if names else None
+
+class ReverseSweep:
+    """Resolves the PTR records of the addresses in a target stream ahead of the scan
+
+    feed() passes the targets through while queueing every IP address for a
+    lookup on a background event loop; the scan then picks the name up with
+    lookup() when it reaches the host.
+    """
+
+    def __init__(self, nameserver=None, concurrency=DEFAULT_CONCURRENCY, lookahead=DEFAULT_LOOKAHEAD):
+        self.nameserver = nameserver
+        self.concurrency = concurrency
+        self.lookahead = lookahead
+        # Resolved names, and how many scans still have to pick each one up
+        self.names = {}
+        self.expected = {}
+        self.condition = threading.Condition()
+        self.loop = asyncio.new_event_loop()
+        self.incoming = None
+        self.started = threading.Event()
+        self.finished = False
+        context = contextvars.copy_context()
+        self.thread = threading.Thread(target=context.run, args=(self.run_loop,), name="reverse-dns", daemon=True)
+        self.thread.start()
+        self.started.wait()
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.resolve_all())
+        finally:
+            self.loop.close()
+            # Nothing more will be resolved; don't leave scans waiting for it
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+            self.started.set()
+
+    async def resolve_all(self):
+        self.incoming = asyncio.Queue()
+        self.started.set()
+        with tracing.stage("bulk_reverse_dns"):
+            async with AsyncResolver(self.nameserver, concurrency=self.concurrency) as resolver:
+                tasks = set()
+                while True:
+                    ip_address = await self.incoming.get()
+                    if ip_address is None:
+                        break
+                    # The resolver caps the queries in flight; the read-ahead caps the tasks
+                    task = asyncio.get_running_loop().create_task(self.resolve(resolver, ip_address))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if tasks:
+                    await asyncio.gather(*tasks)
+
+    async def resolve(self, resolver, ip_address):
+        name = await lookup_ptr(resolver, ip_address)
+        with self.condition:
+            # Every scan of the address gave up waiting; nobody would pick the name up
+            if ip_address not in self.expected:
+                return
+            self.names[ip_address] = name
+            self.condition.notify_all()
+
+    def submit(self, ip_address):
+        """Queue an address for a PTR lookup"""
+        with self.condition:
+            refs = self.expected.get(ip_address, 0)
+            self.expected[ip_address] = refs + 1
+        if refs == 0:
+            self.send(ip_address)
+
+    def close(self):
+        """Let the background loop finish once the queued lookups are done"""
+        self.send(None)
+
+    def send(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self.incoming.put_nowait, item)
+        except RuntimeError:
+            # The loop already stopped (the resolver couldn't start)
+            pass
+
+    def feed(self, targets):
+        """Pass targets through, queueing the lookups up to `lookahead` targets early"""
+        pending = collections.deque()
+        try:
+            for target in targets:
+                if isinstance(target, str) and is_ip_address(target):
+                    self.submit(target)
+                pending.append(target)
+                if len(pending) >= self.lookahead:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            self.close()
+
+    def lookup(self, ip_address, timeout=LOOKUP_TIMEOUT):
+        """The PTR name of a fed address (None when it has none), waiting for it if needed"""
+        with self.condition:
+            if ip_address not in self.expected:
+                return None
+            self.condition.wait_for(lambda: ip_address in self.names or self.finished, timeout)
+            name = self.names.get(ip_address)
+            # Forget the name once every scan of this address has it, so a big
+            # range doesn't pile up in memory
+            self.expected[ip_address] -= 1
+            if not self.expected[ip_address]:
+                del self.expected[ip_address]
+                self.names.pop(ip_address, None)
+            return name
@@ -0,0 +1,533 @@
+import collections
+import errno
+import functools
+import os
+import socket
+import struct
+import threading
+import time
+
+import metrics
+import tracing
+from socket_budget import RESOURCE_CODES, ResourceExhausted, get_budget
+from port_profiles import SCAN_PROFILES, top_ports, profile_ports, order_by_likelihood
+
+# Connect timeout (seconds) and number of concurrent probes for each timing profile
+TIMING_PROFILES = {
+    'polite': {'timeout': 2.0, 'concurrency': 20},
+    'normal': {'timeout': 1.0, 'concurrency': 100},
+    'aggressive': {'timeout': 0.5, 'concurrency': 1000},
+    'insane': {'timeout': 0.25, 'concurrency': 2000}
+}
+
+DEFAULT_TIMING = 'normal'
+
+def get_timing(name=DEFAULT_TIMING, timeout=None, concurrency=None):
+    """Get the timeout and concurrency of a timing profile, with optional overrides"""
+    if name not in TIMING_PROFILES:
+        raise ValueError(f"Unknown timing profile: {name} (choose from {', '.join(TIMING_PROFILES)})")
+
+    timing = dict(TIMING_PROFILES[name])
+    if timeout is not None:
+        timing['timeout'] = timeout
+    if concurrency is not None:
+        timing['concurrency'] = concurrency
+    return timing
+
+def parse_port_spec(spec):
+    """Turn a port spec like '22,80,1000-2000,top100' or 'full' into an ordered list of ports"""
+    ports = []
+    seen = set()
+
+    for part in spec.split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+
+        if part in SCAN_PROFILES:
+            chunk = profile_ports(part)
+        elif part.startswith("top"):
+            try:
+                chunk = top_ports(int(part[3:]))
+            except ValueError as e:
+                raise ValueError(f"Invalid port spec '{part}': {e}")
+        elif "-" in part:
+            start, _, end = part.partition("-")
+            try:
+                start, end = int(start), int(end)
+            except ValueError:
+                raise ValueError(f"Invalid port range '{part}'")
+            if start > end:
+                raise ValueError(f"Invalid port range '{part}': start is after end")
+            chunk = range(start, end + 1)
+        else:
+            try:
+                chunk = [int(part)]
+            except ValueError:
+                raise ValueError(f"Invalid port '{part}'")
+
+        for port in chunk:
+            if not 1 <= port <= 65535:
+                raise ValueError(f"Port {port} is out of range 1-65535")
+            # Keep the first occurrence so 'top100' ordering survives
+            if port not in seen:
+                seen.add(port)
+                ports.append(port)
+
+    if not ports:
+        raise ValueError("Port spec is empty")
+    return ports
+
+@functools.lru_cache(maxsize=32)
+def ordered_port_range(start_port, end_port):
+    """Get a port range ordered so the likeliest open ports are probed first
+
+    Ordered once per range and shared (hence a tuple): the web apps sweep the
+    same range for every request.
+    """
+    return tuple(order_by_likelihood(range(start_port, end_port + 1)))
+
+# SO_LINGER with a zero timeout: close() sends a reset instead of a FIN, so
+# probes leave no TIME_WAIT entries tying up local ports
+LINGER_RESET = struct.pack('HH' if os.name == 'nt' else 'ii', 1, 0)
+
+def close_with_reset(sock):
+    """Close a connected socket without leaving it in TIME_WAIT"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_RESET)
+    except OSError:
+        pass
+    sock.close()
+
+def connect_port(ip, port, timeout=1):
+    """Try a TCP connect and return the connect_ex result code (0 means open)"""
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    except OSError as e:
+        # Usually EMFILE/ENOBUFS: out of descriptors, not a port state
+        return e.errno or -1
+
+    try:
+        sock.settimeout(timeout)
+        return sock.connect_ex((ip, port))
+    except socket.timeout:
+        return errno.ETIMEDOUT
+    except OSError as e:
+        return e.errno or -1
+    finally:
+        close_with_reset(sock)
+
+def scan_port(ip, port, timeout=1):
+    """Scan a single port on the given IP address
+
+    Raises ResourceExhausted when this machine is out of sockets, rather than
+    reporting the port as closed.
+    """
+    code = connect_port(ip, port, timeout)
+    if code in RESOURCE_CODES:
+        raise ResourceExhausted(code, os.strerror(code))
+    return port if code == 0 else None
+
+# Port states, with the same meaning as nmap's
+OPEN = 'open'          # the connect succeeded
+CLOSED = 'closed'      # the host answered with a reset
+FILTERED = 'filtered'  # no answer, or an ICMP error from a firewall or router
+
+def probe_outcome(code):
+    """Name the outcome of a connect_ex result code (also the probe metric label)"""
+    if code == 0:
+        return 'open'
+    if code == errno.ECONNREFUSED:
+        return 'closed'
+    if code in TIMEOUT_CODES:
+        return 'timeout'
+    if code in UNREACHABLE_CODES:
+        return 'unreachable'
+    if code in RESOURCE_CODES:
+        return 'resource'
+    return 'error'
+
+# connect_ex reports a timed out connect with one of these, depending on the OS
+TIMEOUT_CODES = {errno.ETIMEDOUT, errno.EAGAIN, errno.EWOULDBLOCK, getattr(errno, 'WSAETIMEDOUT', -2)}
+
+# ICMP unreachable / administratively prohibited, as reported by connect
+UNREACHABLE_CODES = {errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EACCES, errno.EPERM,
+                     getattr(errno, 'EHOSTDOWN', -5), getattr(errno, 'ENETDOWN', -6),
+                     getattr(errno, 'WSAEHOSTUNREACH', -7), getattr(errno, 'WSAENETUNREACH', -8)}
+
+# State of the port for each outcome ('resource' says nothing about the port)
+OUTCOME_STATES = {
+    'open': OPEN,
+    'closed': CLOSED,
+    'timeout': FILTERED,
+    'unreachable': FILTERED,
+    'error': FILTERED
+}
+
+def port_result(port, code):
+    """Describe one probe: the port's state, why, and the raw error code"""
+    reason = probe_outcome(code)
+    return {'port': port, 'state': OUTCOME_STATES.get(reason), 'reason': reason, 'errno': code}
+
+def check_port(ip, port, timeout=1):
+    """Probe a single port and return its state, reason and error code"""
+    code = connect_port(ip, port, timeout)
+    if code in RESOURCE_CODES:
+        raise ResourceExhausted(code, os.strerror(code))
+    return port_result(port, code)
+
+def probe(ip, port, timeout):
+    """Worker side of the sweep: connect and hand back the port with its result code"""
+    return port, connect_port(ip, port, timeout)
+
+# Size of the pool shared by every scan stage in a process.  Threads are only
+# started as work arrives, so a large limit costs nothing while idle.
+SHARED_PROBE_THREADS = int(os.environ.get('RECON_PROBE_THREADS', '1000'))
+
+_shared_executor = None
+_shared_executor_pid = None
+_shared_executor_lock = threading.Lock()
+
+def get_shared_executor():
+    """Get this process's scan pool, creating it on first use"""
+    global _shared_executor, _shared_executor_pid
+    # concurrent.futures pulls in logging; only pay for it once something scans
+    from concurrent.futures import ThreadPoolExecutor
+    
+    with _shared_executor_lock:
+        # Pool threads don't survive a fork, so every server worker gets its own
+        if _shared_executor is None or _shared_executor_pid != os.getpid():
+            _shared_executor = ThreadPoolExecutor(max_workers=SHARED_PROBE_THREADS,
+                                                  thread_name_prefix='probe')
+            _shared_executor_pid = os.getpid()
+        return _shared_executor
+
+def configure_shared_executor(max_workers):
+    """Set the size of this process's scan pool (only before it is first used)"""
+    global SHARED_PROBE_THREADS
+    with _shared_executor_lock:
+        if _shared_executor is not None and _shared_executor_pid == os.getpid():
+            raise RuntimeError("The scan pool is already running")
+        SHARED_PROBE_THREADS = max_workers
+
+def shutdown_shared_executor(wait=True):
+    """Stop the scan pool: queued work is dropped, running probes are let finish
+
+    Call it when the process is done scanning; the interpreter would otherwise
+    work through every queued probe before it exits.
+    """
+    with _shared_executor_lock:
+        executor = _shared_executor if _shared_executor_pid == os.getpid() else None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+# How many finished probes the sweep counts locally before updating the metrics
+METRICS_FLUSH_EVERY = 512
+
+# How often a port is retried when the probe itself failed for lack of sockets
+RESOURCE_RETRIES = 5
+
+# Shortest connect timeout a probe gets when the sweep's deadline is close
+MIN_PROBE_TIMEOUT = 0.05
+
+def iter_port_results(ip, ports, timeout=1, concurrency=100, executor=None, states=None, deadline=None):
+    """Yield the result of every probed port (see port_result) as soon as it is known
+
+    Pass a set of states to only get those, e.g. {OPEN}.  Probes run on the
+    process's shared scan pool unless another executor (such as a scheduler
+    job) is given.  Raises ResourceExhausted if the machine keeps running out
+    of sockets even with a single probe in flight.
+
+    With a stage deadline (see deadlines.py) the sweep stops when it runs out:
+    queued probes are dropped, and the number of ports left unscanned is
+    recorded on the deadline.
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    
+    ports = iter(ports)
+    executor = executor or get_shared_executor()
+    # A profiled scan samples the pool threads while they probe for it
+    port_probe = tracing.follow(probe)
+    # Scheduler jobs say how much of the window they may use right now (a bulk
+    # sweep gives most of it up while interactive scans run)
+    window_limit = getattr(executor, 'window_limit', None)
+
+    # Outcomes are counted here and pushed to the shared metrics in batches,
+    # so the connect path itself never touches a lock
+    outcomes = dict.fromkeys(['open', 'closed', 'timeout', 'unreachable', 'resource', 'error'], 0)
+    reported = {'running': 0, 'queued': 0}
+    # Start at the threshold so the gauges are filled as soon as the window is
+    finished = METRICS_FLUSH_EVERY
+    metrics.PORT_SWEEPS.inc()
+
+    # Ports whose probe failed for lack of sockets, and how often that happened
+    retry = collections.deque()
+    resource_failures = {}
+
+    def flush(pending_count):
+        for outcome, count in outcomes.items():
+            if count:
+                metrics.PROBES.inc(count, result=outcome)
+                outcomes[outcome] = 0
+        running = min(pending_count, concurrency)
+        queued = pending_count - running
+        metrics.PROBES_IN_FLIGHT.inc(running - reported['running'])
+        metrics.PROBE_QUEUE_DEPTH.inc(queued - reported['queued'])
+        reported['running'], reported['queued'] = running, queued
+
+    def next_port():
+        if retry:
+            return retry.popleft()
+        return next(ports, None)
+
+    with tracing.stage('port_sweep', target=ip, concurrency=concurrency, timeout=timeout), \
+            get_budget().reserve(concurrency) as granted:
+        # Only keep a bounded window of probes in flight so memory stays flat
+        # no matter how many ports are scanned.  The pool is shared, so the
+        # sweep never queues more than its own concurrency (as far as the socket
+        # budget allows) and other scans still get a turn.
+        limit = window = granted
+        pending = set()
+        try:
+            while True:
+                if window_limit is not None:
+                    # Shrink at once when asked to, grow back one probe at a time
+                    limit = window_limit(granted)
+                    window = min(window, limit)
+                probe_timeout = timeout
+                if deadline is not None:
+                    # No probe may outlive the sweep's deadline
+                    probe_timeout = min(timeout, max(deadline.remaining(), MIN_PROBE_TIMEOUT))
+                while len(pending) < window and not (deadline is not None and deadline.expired):
+                    port = next_port()
+                    if port is None:
+                        break
+                    pending.add(executor.submit(port_probe, ip, port, probe_timeout))
+                if not pending:
+                    if deadline is not None and deadline.expired:
+                        deadline.expire(len(retry) + sum(1 for _ in ports))
+                    break
+
+                done, pending = wait(pending, timeout=None if deadline is None else deadline.remaining(),
+                                     return_when=FIRST_COMPLETED)
+                starved = False
+                for future in done:
+                    port, code = future.result()
+                    outcome = probe_outcome(code)
+                    outcomes[outcome] += 1
+                    finished += 1
+                    if outcome == 'resource':
+                        # Not a port state: probe it again once sockets are free
+                        failures = resource_failures[port] = resource_failures.get(port, 0) + 1
+                        if failures > RESOURCE_RETRIES:
+                            raise ResourceExhausted(code, f"Out of sockets while scanning {ip}: "
+                                                          f"{os.strerror(code)}")
+                        retry.append(port)
+                        starved = True
+                    elif states is None or OUTCOME_STATES[outcome] in states:
+                        yield port_result(port, code)
+
+                if deadline is not None and deadline.expired:
+                    # Out of time: whatever hasn't answered yet is left unscanned
+                    deadline.expire(len(pending) + len(retry) + sum(1 for _ in ports))
+                    break
+
+                # Back off hard when the OS runs out of sockets, recover slowly
+                if starved:
+                    window = max(1, window // 2)
+                    time.sleep(0.01)
+                elif window < limit:
+                    window += 1
+
+                if finished >= METRICS_FLUSH_EVERY:
+                    finished = 0
+                    flush(len(pending))
+        finally:
+            # Drop queued probes when the caller stops early
+            for future in pending:
+                future.cancel()
+            flush(0)
+
+def iter_open_ports(ip, ports, timeout=1, concurrency=100, executor=None):
+    """Yield open ports on the given IP address as soon as they are found"""
+    for result in iter_port_results(ip, ports, timeout, concurrency, executor, states={OPEN}):
+        yield result['port']
+
+def scan_port_list(ip, ports, timeout=1, concurrency=100, executor=None):
+    """Scan an arbitrary list of ports on the given IP address"""
+    return sorted(iter_open_ports(ip, ports, timeout, concurrency, executor))
+
+class PortStateSummary:
+    """Counts of port states (and why ports were filtered) seen in a sweep"""
+
+    def __init__(self):
+        self.states = dict.fromkeys([OPEN, CLOSED, FILTERED], 0)
+        self.reasons = {}
+        # Ports the sweep ran out of time for (their state is unknown)
+        self.not_scanned = 0
+
+    def add(self, result):
+        self.states[result['state']] += 1
+        if result['state'] == FILTERED:
+            self.reasons[result['reason']] = self.reasons.get(result['reason'], 0) + 1
+
+    @property
+    def host_filtered(self):
+        """True when nothing answered at all: the host is down or firewalled wholesale"""
+        return self.states[FILTERED] > 0 and not self.states[OPEN] and not self.states[CLOSED]
+
+    def to_dict(self):
+        return dict(self.states, filtered_reasons=dict(self.reasons), host_filtered=self.host_filtered,
+                    not_scanned=self.not_scanned)
+
+def scan_port_states(ip, ports, timeout=1, concurrency=100, executor=None, deadline=None):
+    """Scan ports and return the sorted open ports with a summary of every state
+
+    With a deadline the result may be partial; summary.not_scanned says how
+    many ports were left.
+    """
+    summary = PortStateSummary()
+    open_ports = []
+    for result in iter_port_results(ip, ports, timeout, concurrency, executor, deadline=deadline):
+        summary.add(result)
+        if result['state'] == OPEN:
+            open_ports.append(result['port'])
+    if deadline is not None and deadline.cut_short:
+        summary.not_scanned = deadline.unfinished or 0
+    return sorted(open_ports), summary
+
+# Most bytes read from a service's greeting (the first line is all that's kept)
+BANNER_BYTES = int(os.environ.get('RECON_BANNER_BYTES', '1024'))
+# Seconds a banner grab may take to connect, and again to read the greeting
+BANNER_TIMEOUT = 2
+# Web servers only talk after a request, and name themselves in a header, not
+# in their first line
+HTTP_PORTS = (80, 443, 8080)
+HTTP_REQUEST = b"HEAD / HTTP/1.0\r\n\r\n"
+
+WHITESPACE = b' \t\r\n\x0b\x0c'
+
+# Banners are read into one preallocated buffer per thread instead of a new
+# bytes object (and its decoded, split and sliced copies) per connection
+_banner_buffers = threading.local()
+
+def banner_buffer(size):
+    """This thread's reusable receive buffer, at least `size` bytes long"""
+    buffer = getattr(_banner_buffers, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _banner_buffers.buffer = bytearray(max(size, BANNER_BYTES))
+    return buffer
+
+def first_line_bounds(data, length):
+    """Where the first non-blank line of data[:length] starts and ends, and whether it is complete"""
+    start = 0
+    while start < length and data[start] in WHITESPACE:
+        start += 1
+    end = data.find(b'\n', start, length)
+    complete = end != -1
+    if not complete:
+        end = length
+    while end > start and data[end - 1] in WHITESPACE:
+        end -= 1
+    return start, end, complete
+
+def end_of_headers(data, length):
+    """Whether data[:length] holds a complete set of HTTP response headers"""
+    return data.find(b'\r\n\r\n', 0, length) != -1 or data.find(b'\n\n', 0, length) != -1
+
+def read_banner(sock, max_bytes=BANNER_BYTES, deadline=None, headers=False):
+    """Read a service's greeting into this thread's buffer and return a memoryview of it
+
+    Reading stops at the end of the first line (of the headers, with
+    headers=True), after max_bytes, at EOF or at the deadline (a
+    time.monotonic() value).  Raises socket.timeout when nothing arrived at
+    all.  The view is only valid until this thread reads the next banner, so
+    decode what you need from it straight away.
+    """
+    buffer = banner_buffer(max_bytes)
+    view = memoryview(buffer)[:max_bytes]
+    received = 0
+    while received < max_bytes:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if received:
+                    break
+                raise socket.timeout('timed out')
+            sock.settimeout(remaining)
+        try:
+            count = sock.recv_into(view[received:])
+        except socket.timeout:
+            if received:
+                break
+            raise
+        if not count:
+            break
+        received += count
+        if end_of_headers(buffer, received) if headers else first_line_bounds(buffer, received)[2]:
+            break
+    return view[:received]
+
+def banner_line(data, max_chars=None):
+    """Decode the first line of a banner, cut to max_chars (with '...' when cut), or None
+
+    Only the bytes of the line that is kept get decoded.
+    """
+    # Views from read_banner start at the beginning of the thread's buffer
+    start, end, _ = first_line_bounds(data.obj if isinstance(data, memoryview) else data, len(data))
+    if start == end:
+        return None
+    if max_chars is not None:
+        # A character is at most 4 bytes, so never decode more than that
+        line = str(data[start:min(end, start + max_chars * 4)], 'utf-8', 'ignore')
+        if len(line) > max_chars or end > start + max_chars * 4:
+            return line[:max_chars] + "..."
+        return line
+    return str(data[start:end], 'utf-8', 'ignore')
+
+def http_banner(data, max_chars=None):
+    """The status line of an HTTP response, followed by its Server header when it has one
+
+    e.g. "HTTP/1.1 200 OK Server: nginx/1.24.0"; None when nothing was sent.
+    """
+    status = banner_line(data)
+    if status is None:
+        return None
+    banner = status
+    # Headers are short and only read from web ports, so decode them whole
+    for line in str(data, 'utf-8', 'ignore').splitlines()[1:]:
+        name, colon, value = line.partition(':')
+        if colon and name.strip().lower() == 'server' and value.strip():
+            banner = f"{status} Server: {value.strip()}"
+            break
+    if max_chars is not None and len(banner) > max_chars:
+        return banner[:max_chars] + "..."
+    return banner
+
+def grab_banner(ip_address, port, timeout=BANNER_TIMEOUT, max_bytes=BANNER_BYTES, http=None):
+    """Grab the banner of a single open port, or None
+
+    That's the first line a service sends, or for web servers (HTTP_PORTS, or
+    http=True) the status line and Server header of the answer to a HEAD
+    request.  Connecting and reading each get `timeout` seconds.
+    """
+    if http is None:
+        http = port in HTTP_PORTS
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            if sock.connect_ex((ip_address, port)) != 0:
+                return None
+
+            # Web servers only talk after a request, others usually greet first
+            if http:
+                sock.send(HTTP_REQUEST)
+                return http_banner(read_banner(sock, max_bytes, time.monotonic() + timeout, headers=True))
+            sock.send(b"\n")
+
+            return banner_line(read_banner(sock, max_bytes, time.monotonic() + timeout))
+        finally:
+            close_with_reset(sock)
+    except Exception:
+        return None
@@ -0,0 +1,303 @@
+import collections
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+import scan_engine
+import tracing
+
+# Process-wide limits for scans started by the web apps.  A scan is admitted as
+# a job; admitted jobs share the probe pool through weighted round-robin, so a
+# 65535-port sweep can't starve a 100-port one that arrives after it.
+MAX_ACTIVE_SCANS = int(os.environ.get('RECON_MAX_SCANS', '8'))
+MAX_QUEUED_SCANS = int(os.environ.get('RECON_MAX_QUEUED_SCANS', '32'))
+SCANS_PER_CLIENT = int(os.environ.get('RECON_SCANS_PER_CLIENT', '2'))
+ADMISSION_TIMEOUT = float(os.environ.get('RECON_ADMISSION_TIMEOUT', '30'))
+
+# Priority classes.  Interactive scans (someone waiting on /scan) always get the
+# pool before bulk ones (scheduled background sweeps), and while any interactive
+# scan runs, bulk sweeps shrink their in-flight window to BULK_YIELD_SHARE of it.
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)
+BULK_YIELD_SHARE = float(os.environ.get('RECON_BULK_YIELD_SHARE', '0.1'))
+# Scan slots bulk scans can never take, so an interactive scan never waits for admission behind them
+INTERACTIVE_RESERVED_SCANS = int(os.environ.get('RECON_INTERACTIVE_RESERVED_SCANS', '1'))
+
+class AdmissionError(Exception):
+    """A scan was turned away by admission control"""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+class ScanJob:
+    """An admitted scan, used as the executor for its probes
+
+    Probes submitted here wait in the job's own queue until the scheduler gives
+    the job a turn on the shared pool.
+    """
+
+    def __init__(self, scheduler, client, weight=1, priority=INTERACTIVE):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown scan priority: {priority} (choose from {', '.join(PRIORITIES)})")
+        self.scheduler = scheduler
+        self.client = client
+        self.weight = max(1, int(weight))
+        self.priority = priority
+        self.queue = collections.deque()
+        self.scheduled = False
+        self.closed = False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.scheduler.enqueue(self, (future, tracing.follow(fn), args, kwargs))
+        return future
+
+    def window_limit(self, limit):
+        """How many probes this job's sweep may keep in flight right now (of `limit`)
+
+        Port sweeps ask before every batch, so a bulk sweep backs off as soon as
+        an interactive scan starts and grows back once it is done.
+        """
+        if self.priority == BULK and self.scheduler.interactive_running:
+            return max(1, int(limit * BULK_YIELD_SHARE))
+        return limit
+
+    def close(self):
+        self.scheduler.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ScanScheduler:
+    """Admission control, per-client quotas and fair sharing of the probe pool"""
+
+    def __init__(self, max_active=MAX_ACTIVE_SCANS, max_queued=MAX_QUEUED_SCANS,
+                 per_client=SCANS_PER_CLIENT, admission_timeout=ADMISSION_TIMEOUT,
+                 executor=None, slots=None, interactive_reserved=INTERACTIVE_RESERVED_SCANS):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.per_client = per_client
+        self.admission_timeout = admission_timeout
+        # Bulk scans may use every slot but these (and always at least one)
+        self.max_bulk = max(1, max_active - interactive_reserved)
+        self.executor = executor or scan_engine.get_shared_executor()
+        # Never hand the pool more probes than it has threads, so the order
+        # chosen here is the order they run in
+        self.slots = threading.BoundedSemaphore(slots or scan_engine.SHARED_PROBE_THREADS)
+
+        self.condition = threading.Condition()
+        self.active = set()
+        self.waiting = collections.deque()
+        self.clients = collections.Counter()
+        # Jobs with queued probes, one round-robin line per priority
+        self.ready = {priority: collections.deque() for priority in PRIORITIES}
+        self.interactive_running = 0
+        self.bulk_running = 0
+        self.dispatcher = None
+
+    def admit(self, client, weight=1, timeout=None, priority=INTERACTIVE):
+        """Admit a scan for a client, waiting in line for a free slot if needed
+
+        Interactive scans wait ahead of bulk ones, and bulk scans never take the
+        slots reserved for interactive work.
+        """
+        timeout = self.admission_timeout if timeout is None else timeout
+        job = ScanJob(self, client, weight, priority)
+
+        with self.condition:
+            if self.clients[client] >= self.per_client:
+                self.reject('client_quota')
+                raise AdmissionError(f"Too many scans running for {client} "
+                                     f"(limit {self.per_client})", 'client_quota')
+
+            if not self.can_start(job) or self.waiting:
+                if len(self.waiting) >= self.max_queued:
+                    self.reject('queue_full')
+                    raise AdmissionError("Scanner is busy, try again later", 'queue_full')
+
+                # First come, first served among the waiting scans of a priority,
+                # with interactive ones ahead of every bulk one
+                self.clients[client] += 1
+                self.enqueue_waiting(job)
+                metrics.SCAN_JOBS_WAITING.inc()
+                deadline = time.monotonic() + timeout
+                try:
+                    while self.next_waiting() is not job or not self.can_start(job):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.clients[client] -= 1
+                            self.reject('timeout')
+                            raise AdmissionError("Timed out waiting for a free scan slot", 'timeout')
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting.remove(job)
+                    metrics.SCAN_JOBS_WAITING.dec()
+                    self.condition.notify_all()
+            else:
+                self.clients[client] += 1
+
+            self.active.add(job)
+            if job.priority == INTERACTIVE:
+                self.interactive_running += 1
+            else:
+                self.bulk_running += 1
+            metrics.SCAN_JOBS_ACTIVE.inc()
+            self.start_dispatcher()
+        return job
+
+    def can_start(self, job):
+        if len(self.active) >= self.max_active:
+            return False
+        return job.priority == INTERACTIVE or self.bulk_running < self.max_bulk
+
+    def enqueue_waiting(self, job):
+        if job.priority == INTERACTIVE:
+            for position, waiting in enumerate(self.waiting):
+                if waiting.priority == BULK:
+                    self.waiting.insert(position, job)
+                    return
+        self.waiting.append(job)
+
+    def next_waiting(self):
+        """The waiting scan that is admitted next: the first one that fits a free slot"""
+        for job in self.waiting:
+            if self.can_start(job):
+                return job
+        return self.waiting[0]
+
+    def reject(self, reason):
+        metrics.SCAN_JOBS_REJECTED.inc(reason=reason)
+
+    def release(self, job):
+        """Finish a job, dropping any probes it still has queued"""
+        with self.condition:
+            if job.closed:
+                return
+            job.closed = True
+            self.active.discard(job)
+            if job.priority == INTERACTIVE:
+                self.interactive_running -= 1
+            else:
+                self.bulk_running -= 1
+            self.clients[job.client] -= 1
+            if not self.clients[job.client]:
+                del self.clients[job.client]
+            if job.scheduled:
+                self.ready[job.priority].remove(job)
+                job.scheduled = False
+            while job.queue:
+                job.queue.popleft()[0].cancel()
+            metrics.SCAN_JOBS_ACTIVE.dec()
+            self.condition.notify_all()
+
+    def enqueue(self, job, item):
+        with self.condition:
+            if job.closed:
+                raise RuntimeError("Cannot submit probes to a finished scan")
+            job.queue.append(item)
+            if not job.scheduled:
+                job.scheduled = True
+                self.ready[job.priority].append(job)
+                self.condition.notify_all()
+
+    def start_dispatcher(self):
+        if self.dispatcher is None:
+            self.dispatcher = threading.Thread(target=self.dispatch, name='scan-dispatcher', daemon=True)
+            self.dispatcher.start()
+
+    def dispatch(self):
+        """Hand queued probes to the pool, taking turns between jobs by weight
+
+        Bulk jobs only get a turn when no interactive job has probes queued.
+        """
+        while True:
+            with self.condition:
+                while not (self.ready[INTERACTIVE] or self.ready[BULK]):
+                    self.condition.wait()
+                ready = self.ready[INTERACTIVE] or self.ready[BULK]
+                job = ready.popleft()
+                batch = [job.queue.popleft() for _ in range(min(job.weight, len(job.queue)))]
+                if job.queue:
+                    ready.append(job)
+                else:
+                    job.scheduled = False
+
+            for item in batch:
+                self.slots.acquire()
+                if not item[0].set_running_or_notify_cancel():
+                    self.slots.release()
+                    continue
+                self.executor.submit(self.run, item)
+
+    def run(self, item):
+        future, fn, args, kwargs = item
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self.slots.release()
+
+class InFlightScans:
+    """Lets concurrent requests for the same scan share a single run of it"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+
+    def run(self, key, fn, *args, **kwargs):
+        """Run fn, or wait for the identical run already in flight
+
+        Returns the result and whether it came from another request's run.
+        """
+        with self.lock:
+            future = self.running.get(key)
+            leader = future is None
+            if leader:
+                future = self.running[key] = Future()
+
+        if not leader:
+            metrics.SCANS_COALESCED.inc()
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.running[key]
+
+IN_FLIGHT = InFlightScans()
+
+def coalesce(key, fn, *args, **kwargs):
+    """Run a scan unless an identical one is already running, then share its result"""
+    return IN_FLIGHT.run(key, fn, *args, **kwargs)
+
+_scheduler = None
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Get this process's scan scheduler, creating it on first use"""
+    global _scheduler, _scheduler_pid
+    with _scheduler_lock:
+        # Like the probe pool, each forked server worker needs its own
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            _scheduler = ScanScheduler()
+            _scheduler_pid = os.getpid()
+        return _scheduler
+
+def admit(client, weight=1, timeout=None, priority=INTERACTIVE):
+    """Admit a scan on this process's scheduler"""
+    return get_scheduler().admit(client, weight, timeout, priority)
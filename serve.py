@@ -0,0 +1,119 @@
+import argparse
+import importlib
+import os
+import sys
+
+import scan_engine
+
+# Production entry point for the web apps.  The Flask development server that
+# `python simple_app.py` starts handles one request at a time and must not be
+# exposed; this runs the same app under a real WSGI server instead.
+#
+# Every setting can come from the environment so the same command works in a
+# service unit or a container:
+#
+#   RECON_APP         simple_app or app                  (default: simple_app)
+#   RECON_SERVER      waitress or gunicorn               (default: waitress)
+#   RECON_HOST        address to listen on               (default: 127.0.0.1)
+#   RECON_PORT        port to listen on                  (default: 5000)
+#   RECON_WORKERS     gunicorn worker processes          (default: 2)
+#   RECON_THREADS     request threads per worker         (default: 64)
+#   RECON_CONNECTIONS open client connections per worker (default: 1000)
+#   RECON_REQUEST_TIMEOUT  seconds before a stuck gunicorn worker is restarted (default: 600)
+
+APPS = ["simple_app", "app"]
+SERVERS = ["waitress", "gunicorn"]
+
+def env_int(name, default):
+    """Read an integer setting from the environment"""
+    value = os.environ.get(name, "")
+    try:
+        return int(value) if value else default
+    except ValueError:
+        sys.exit(f"{name} must be a whole number, got '{value}'")
+
+def load_app(name):
+    """Import one of the web apps and return its Flask application"""
+    return importlib.import_module(name).app
+
+def shutdown_engine():
+    """Stop the worker's scan pool so in-flight scans end instead of draining their queues"""
+    scan_engine.shutdown_shared_executor(wait=False)
+
+def serve_waitress(app_name, host, port, threads, connections):
+    """Serve the app with waitress (pure Python, also runs on Windows)"""
+    try:
+        from waitress import serve
+    except ImportError:
+        sys.exit("waitress is not installed: pip install waitress")
+
+    # A single process: waitress multiplexes the open connections on one
+    # event loop and hands requests to a fixed pool of threads
+    try:
+        serve(load_app(app_name), host=host, port=port, threads=threads,
+              connection_limit=connections, channel_timeout=env_int("RECON_REQUEST_TIMEOUT", 600),
+              ident="recon-scanner")
+    finally:
+        shutdown_engine()
+
+def serve_gunicorn(app_name, host, port, workers, threads, connections):
+    """Serve the app with gunicorn worker processes (Linux/macOS only)"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("gunicorn is not installed: pip install gunicorn (not available on Windows)")
+
+    class Server(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                # Threaded workers, since a scan request mostly waits on sockets
+                "worker_class": "gthread",
+                "threads": threads,
+                "worker_connections": connections,
+                # Port sweeps are slow requests, don't kill the worker mid-scan
+                "timeout": env_int("RECON_REQUEST_TIMEOUT", 600),
+                # Import the app in each worker so every worker builds its own
+                # probe pool instead of inheriting dead threads across the fork
+                "preload_app": False,
+                "worker_exit": lambda server, worker: shutdown_engine()
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app(app_name)
+
+    Server().run()
+
+def parse_args(argv=None):
+    """Parse command line options (the environment provides the defaults)"""
+    parser = argparse.ArgumentParser(description="Serve the domain scanner web app in production mode")
+    parser.add_argument("--app", choices=APPS, default=os.environ.get("RECON_APP", "simple_app"),
+                        help="which web app to serve (default: simple_app)")
+    parser.add_argument("--server", choices=SERVERS, default=os.environ.get("RECON_SERVER", "waitress"),
+                        help="WSGI server (default: waitress)")
+    parser.add_argument("--host", default=os.environ.get("RECON_HOST", "127.0.0.1"),
+                        help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=env_int("RECON_PORT", 5000),
+                        help="port to listen on (default: 5000)")
+    parser.add_argument("--workers", type=int, default=env_int("RECON_WORKERS", 2),
+                        help="worker processes, gunicorn only (default: 2)")
+    parser.add_argument("--threads", type=int, default=env_int("RECON_THREADS", 64),
+                        help="request threads per worker (default: 64)")
+    parser.add_argument("--connections", type=int, default=env_int("RECON_CONNECTIONS", 1000),
+                        help="open client connections per worker (default: 1000)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"Serving {args.app} with {args.server} on http://{args.host}:{args.port}", file=sys.stderr)
+    if args.server == "gunicorn":
+        serve_gunicorn(args.app, args.host, args.port, args.workers, args.threads, args.connections)
+    else:
+        serve_waitress(args.app, args.host, args.port, args.threads, args.connections)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,9 +2,19 @@ from flask import Flask, request, jsonify
 import socket
 import platform
 import subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-app = Flask(__name__, instance_path='E:/reconinsance/instance')
+import deadlines
+import metrics
+import passive_os
+import probe_plans
+import scan_engine
+import tracing
+import web_scans
+from api import api
+
+app = Flask(__name__)
+app.register_blueprint(api)
+app.register_blueprint(web_scans.blueprint)
 
 def get_ip_address(domain):
     """Get IP address for a given domain name"""
@@ -24,75 +34,45 @@ def get_domain_name(ip_address):
 
 def scan_port_fast(ip, port):
     """Scan a single port on the given IP address with faster timeout"""
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(0.5)  # Reduced timeout for speed
-        result = sock.connect_ex((ip, port))
-        sock.close()
-        return port if result == 0 else None
-    except Exception:
-        return None
+    return scan_engine.scan_port(ip, port, timeout=0.5)  # Reduced timeout for speed
 
 def scan_port(ip, port):
     """Scan a single port on the given IP address"""
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(1)
-        result = sock.connect_ex((ip, port))
-        sock.close()
-        return port if result == 0 else None
-    except Exception:
-        return None
+    return scan_engine.scan_port(ip, port, timeout=1)
 
-def scan_ports(ip, start_port=1, end_port=65535):
-    """Scan ports on the given IP address - scanning all 65535 ports as requested"""
-    open_ports = []
-    
-    # Use ThreadPoolExecutor for concurrent port scanning
-    with ThreadPoolExecutor(max_workers=1000) as executor:  # Increased workers for full port scan
-        # Submit all port scanning tasks
-        future_to_port = {
-            executor.submit(scan_port_fast, ip, port): port 
-            for port in range(start_port, end_port + 1)
-        }
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_port):
-            port = future_to_port[future]
-            try:
-                result = future.result()
-                if result is not None:
-                    open_ports.append(result)
-            except Exception:
-                pass
-    
-    return sorted(open_ports)
+def scan_ports(ip, start_port=1, end_port=65535, executor=None, deadline=None):
+    """Scan ports on the given IP address - scanning all 65535 ports as requested
+
+    Returns the open ports and a summary of every port's state (partial when the
+    stage deadline ran out).
+    """
+    # Same engine as the command-line scanner, with the aggressive timing profile
+    timing = scan_engine.get_timing('aggressive')
+    # Probes run on the process-wide pool (through the request's scan job when
+    # there is one), so concurrent requests don't each start threads
+    return scan_engine.scan_port_states(ip, scan_engine.ordered_port_range(start_port, end_port),
+                                        executor=executor, deadline=deadline, **timing)
+
+# How long OS detection may take when it isn't part of a budgeted scan
+OS_DETECTION_TIMEOUT = 2
 
-def detect_os(ip_address):
+def detect_os(ip_address, deadline=None):
     """Detect OS using multiple methods for better accuracy - optimized for speed"""
     try:
-        # Run all detection methods in parallel for speed
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            # Submit all detection tasks using fast versions
-            future_ttl = executor.submit(detect_os_by_ttl, ip_address)
-            future_ports = executor.submit(detect_os_by_ports_fast, ip_address)
-            future_service = executor.submit(get_service_info_fast, ip_address)
-            
-            # Collect results
-            try:
-                os_by_ttl = future_ttl.result(timeout=2)  # Add timeout
-            except:
-                os_by_ttl = "TTL detection timeout"
-                
-            try:
-                os_by_ports = future_ports.result(timeout=2)  # Add timeout
-            except:
-                os_by_ports = "Port detection timeout"
-                
-            try:
-                service_info = future_service.result(timeout=2)  # Add timeout
-            except:
-                service_info = "Service info timeout"
+        # Run all detection methods in parallel for speed, on the shared scan pool
+        executor = scan_engine.get_shared_executor()
+        
+        # Submit all detection tasks using fast versions
+        future_ttl = executor.submit(tracing.follow(detect_os_by_ttl), ip_address)
+        future_ports = executor.submit(tracing.follow(detect_os_by_ports_fast), ip_address)
+        future_service = executor.submit(tracing.follow(get_service_info_fast), ip_address)
+        
+        # Collect results; the three methods share one deadline, and any still
+        # running when it passes are dropped
+        deadline = deadline or deadlines.Deadline(OS_DETECTION_TIMEOUT).stage('os_detection')
+        os_by_ttl = deadline.wait(future_ttl, "TTL detection timeout")
+        os_by_ports = deadline.wait(future_ports, "Port detection timeout")
+        service_info = deadline.wait(future_service, "Service info timeout")
         
         # Combine all information
         result = f"OS Detection Results: "
@@ -153,262 +133,23 @@ def detect_os_by_ttl(ip_address):
 
 def get_service_info_fast(ip_address):
     """Grab banners from common services to get more OS details - optimized for speed"""
-    try:
-        service_details = []
-        
-        # Try to get banner from common services with faster timeout
-        services_to_check = [
-            (80, "HTTP"),
-            (443, "HTTPS"),
-            (22, "SSH"),
-            (23, "Telnet")
-        ]
-        
-        for port, service_name in services_to_check:
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(1)  # Reduced timeout for speed
-                result = sock.connect_ex((ip_address, port))
-                
-                if result == 0:
-                    # Try to grab banner
-                    if port in [80, 443]:
-                        # For web servers, send HTTP request
-                        sock.send(b"HEAD / HTTP/1.0\r\n\r\n")
-                    else:
-                        # For other services, try to read banner
-                        sock.send(b"\n")
-                    
-                    # Read response with timeout
-                    try:
-                        banner = sock.recv(512).decode('utf-8', errors='ignore').strip()
-                        if banner:
-                            # Clean up banner for display
-                            banner_lines = banner.split('\n')
-                            first_line = banner_lines[0][:30] + ("..." if len(banner_lines[0]) > 30 else "")
-                            service_details.append(f"{service_name}({port}): {first_line}")
-                        else:
-                            service_details.append(f"{service_name}({port}): No banner")
-                    except:
-                        service_details.append(f"{service_name}({port}): Banner read failed")
-                
-                sock.close()
-            except Exception:
-                # Skip this service if we can't get a banner
-                pass
-        
-        if service_details:
-            return "; ".join(service_details)
-        else:
-            return "No service banners captured"
-            
-    except Exception as e:
-        return f"Banner grabbing error: {e}"
+    # Compiled once from scan_templates/services_fast.json and shared by every request
+    return probe_plans.run_plan(probe_plans.get_plan('services_fast'), ip_address)
 
 def get_service_info(ip_address):
     """Grab banners from common services to get more OS details"""
-    try:
-        service_details = []
-        
-        # Try to get banner from common services
-        services_to_check = [
-            (22, "SSH"),
-            (80, "HTTP"),
-            (443, "HTTPS"),
-            (23, "Telnet"),
-            (21, "FTP")
-        ]
-        
-        for port, service_name in services_to_check:
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(2)  # Longer timeout for banner grabbing
-                result = sock.connect_ex((ip_address, port))
-                
-                if result == 0:
-                    # Try to grab banner
-                    if port in [80, 443]:
-                        # For web servers, send HTTP request
-                        sock.send(b"HEAD / HTTP/1.0\r\n\r\n")
-                    else:
-                        # For other services, try to read banner
-                        sock.send(b"\n")
-                    
-                    # Read response
-                    try:
-                        banner = sock.recv(1024).decode('utf-8', errors='ignore').strip()
-                        if banner:
-                            # Clean up banner for display
-                            banner_lines = banner.split('\n')
-                            first_line = banner_lines[0][:50] + ("..." if len(banner_lines[0]) > 50 else "")
-                            service_details.append(f"{service_name}({port}): {first_line}")
-                        else:
-                            service_details.append(f"{service_name}({port}): No banner")
-                    except:
-                        service_details.append(f"{service_name}({port}): Banner read failed")
-                
-                sock.close()
-            except Exception:
-                # Skip this service if we can't get a banner
-                pass
-        
-        if service_details:
-            return "; ".join(service_details)
-        else:
-            return "No service banners captured"
-            
-    except Exception as e:
-        return f"Banner grabbing error: {e}"
+    # Compiled once from scan_templates/services.json and shared by every request
+    return probe_plans.run_plan(probe_plans.get_plan('services'), ip_address)
 
 def detect_os_by_ports(ip_address):
     """Detect OS based on open ports with enhanced heuristics"""
-    try:
-        # Scan of common ports with more detailed analysis
-        port_info = {
-            21: "FTP",
-            22: "SSH",
-            23: "Telnet",
-            25: "SMTP",
-            53: "DNS",
-            80: "HTTP",
-            110: "POP3",
-            143: "IMAP",
-            443: "HTTPS",
-            993: "IMAPS",
-            995: "POP3S",
-            3389: "RDP (Windows)",
-            5900: "VNC",
-            3306: "MySQL",
-            5432: "PostgreSQL",
-            1433: "MSSQL (Windows)",
-            1521: "Oracle DB",
-            8080: "HTTP-Alt"
-        }
-        
-        open_ports = {}
-        
-        # Check which ports are open
-        for port, service in port_info.items():
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(0.5)  # Short timeout
-            result = sock.connect_ex((ip_address, port))
-            sock.close()
-            if result == 0:
-                open_ports[port] = service
-        
-        if not open_ports:
-            return "No common ports open or host is filtering"
-        
-        # Enhanced heuristics based on port combinations
-        os_hints = []
-        
-        # Windows indicators
-        if 3389 in open_ports:  # RDP
-            os_hints.append("Windows (RDP detected)")
-        if 1433 in open_ports:  # MSSQL
-            os_hints.append("Windows (MSSQL detected)")
-            
-        # Linux/Unix indicators
-        if 22 in open_ports and 3389 not in open_ports:  # SSH but no RDP
-            os_hints.append("Linux/Unix (SSH detected)")
-        if 5432 in open_ports:  # PostgreSQL
-            os_hints.append("Linux/Unix (PostgreSQL detected)")
-            
-        # Network device indicators
-        if 23 in open_ports and 22 not in open_ports and 3389 not in open_ports:
-            os_hints.append("Network Device (Telnet detected)")
-        if 53 in open_ports and len(open_ports) <= 3:  # Primarily DNS
-            os_hints.append("Network Device (DNS server)")
-            
-        # Web server indicators
-        web_ports = [80, 443, 8080]
-        web_open = [port for port in web_ports if port in open_ports]
-        if web_open and len(open_ports) <= 3:
-            os_hints.append("Web Server (Limited services)")
-        elif web_open:
-            os_hints.append("Web Server (Multiple services)")
-            
-        # Database server indicators
-        db_ports = [3306, 5432, 1433, 1521]
-        db_open = [port for port in db_ports if port in open_ports]
-        if db_open:
-            os_hints.append("Database Server")
-            
-        if os_hints:
-            return f"{', '.join(os_hints)} - Open ports: {', '.join([f'{p}({s})' for p, s in open_ports.items()])}"
-        else:
-            return f"Open ports: {', '.join([f'{p}({s})' for p, s in open_ports.items()])} - OS detection inconclusive"
-            
-    except Exception as e:
-        return f"Port detection error: {e}"
+    # Compiled once from scan_templates/os_ports.json and shared by every request
+    return probe_plans.run_plan(probe_plans.get_plan('os_ports'), ip_address)
 
 def detect_os_by_ports_fast(ip_address):
     """Detect OS based on open ports with enhanced heuristics - optimized for speed"""
-    try:
-        # Scan of common ports with more detailed analysis - reduced set for speed
-        port_info = {
-            22: "SSH",
-            80: "HTTP",
-            443: "HTTPS",
-            23: "Telnet",
-            3389: "RDP (Windows)",
-            3306: "MySQL",
-            5432: "PostgreSQL",
-            1433: "MSSQL (Windows)"
-        }
-        
-        open_ports = {}
-        
-        # Check which ports are open with faster timeout
-        for port, service in port_info.items():
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(0.3)  # Even shorter timeout for speed
-            result = sock.connect_ex((ip_address, port))
-            sock.close()
-            if result == 0:
-                open_ports[port] = service
-        
-        if not open_ports:
-            return "No common ports open or host is filtering"
-        
-        # Enhanced heuristics based on port combinations
-        os_hints = []
-        
-        # Windows indicators
-        if 3389 in open_ports:  # RDP
-            os_hints.append("Windows (RDP detected)")
-        if 1433 in open_ports:  # MSSQL
-            os_hints.append("Windows (MSSQL detected)")
-        
-        # Linux/Unix indicators
-        if 22 in open_ports and 3389 not in open_ports:  # SSH but no RDP
-            os_hints.append("Linux/Unix (SSH detected)")
-        if 5432 in open_ports:  # PostgreSQL
-            os_hints.append("Linux/Unix (PostgreSQL detected)")
-        
-        # Network device indicators
-        if 23 in open_ports and 22 not in open_ports and 3389 not in open_ports:
-            os_hints.append("Network Device (Telnet detected)")
-        
-        # Web server indicators
-        web_ports = [80, 443]
-        web_open = [port for port in web_ports if port in open_ports]
-        if web_open:
-            os_hints.append("Web Server")
-        
-        # Database server indicators
-        db_ports = [3306, 5432, 1433]
-        db_open = [port for port in db_ports if port in open_ports]
-        if db_open:
-            os_hints.append("Database Server")
-        
-        if os_hints:
-            return f"{', '.join(os_hints)} - Open ports: {', '.join([f'{p}({s})' for p, s in open_ports.items()])}"
-        else:
-            return f"Open ports: {', '.join([f'{p}({s})' for p, s in open_ports.items()])} - OS detection inconclusive"
-        
-    except Exception as e:
-        return f"Port detection error: {e}"
+    # Compiled once from scan_templates/os_ports_fast.json and shared by every request
+    return probe_plans.run_plan(probe_plans.get_plan('os_ports_fast'), ip_address)
 
 @app.route('/')
 def index():
@@ -970,6 +711,9 @@ def index():
                 portsHtml += '<span class="port"><i class="fas fa-times"></i> NO OPEN PORTS DETECTED</span>';
             }
             portsHtml += '</div>';
+            if (data.partial && data.port_states && data.port_states.not_scanned) {
+                portsHtml += `<div class="info-value"><i class="fas fa-hourglass-end"></i> PARTIAL RESULT: SCAN TIME BUDGET RAN OUT, ${data.port_states.not_scanned} PORTS NOT SCANNED</div>`;
+            }
             
             // Format OS details
             let osDetails = data.os_details || 'Not detected';
@@ -980,6 +724,12 @@ def index():
             // Format service info
             let serviceInfo = data.service_info || 'No service information available';
             
+            // Format the passive (SYN-ACK) fingerprint
+            let stackInfo = 'Not fingerprinted (no open ports)';
+            if (data.os_fingerprint) {
+                stackInfo = `${data.os_fingerprint.os} (${data.os_fingerprint.match || 'no'} match)`;
+            }
+            
             result.innerHTML = `
                 <div class="result-header">
                     <i class="fas fa-shield-alt"></i>
@@ -1008,6 +758,10 @@ def index():
                             <span class="info-label">Service Details:</span>
                             <span class="info-value">${serviceInfo}</span>
                         </div>
+                        <div class="info-item">
+                            <span class="info-label">TCP Stack:</span>
+                            <span class="info-value">${stackInfo}</span>
+                        </div>
                     </div>
                     
                     <div class="info-card">
@@ -1069,58 +823,73 @@ def scan():
     input_type = data.get('type', 'domain')
     
     if not user_input:
+        metrics.SCAN_REQUESTS.inc(status='invalid')
         return jsonify({'error': 'Please provide a domain name or IP address'}), 400
     
+    return web_scans.handle_scan(data, (input_type, user_input.lower()), perform_scan, user_input, input_type)
+
+def perform_scan(user_input, input_type, budget=None, job=None):
+    """Run every scan stage for one target and return the response body and status
+
+    The stages share one wall-clock budget.  A stage that runs out of its share
+    is cut short and the response says so ('partial' and 'deadline').
+    """
+    deadline = deadlines.Deadline(budget)
+    executor = scan_engine.get_shared_executor()
+    
     if input_type == 'ip':
         # Handle IP address input
         ip_address = user_input
         
         # Get domain name (reverse DNS lookup)
-        domain_name = get_domain_name(ip_address)
-        
-        # Get additional service info
-        service_info = get_service_info(ip_address)
-        
-        # Detect OS
-        os_details = detect_os(ip_address)
-        
-        # Scan ports
-        open_ports = scan_ports(ip_address)
-        
-        return jsonify({
-            'domain': domain_name,
-            'ip_address': ip_address,
-            'os_details': os_details,
-            'service_info': service_info,
-            'open_ports': open_ports
-        })
+        with tracing.stage('reverse_dns', target=ip_address):
+            domain_name = deadline.stage('reverse_dns').call(
+                executor, "Error resolving IP to domain: timed out", get_domain_name, ip_address)
     else:
         # Handle domain name input
-        domain = user_input
+        domain_name = user_input
         
         # Get IP address
-        ip_address = get_ip_address(domain)
+        with tracing.stage('dns', target=domain_name):
+            ip_address = deadline.stage('dns').call(
+                executor, "Error resolving domain: timed out", get_ip_address, domain_name)
         
         # If IP resolution failed, return error
         if "Error" in str(ip_address):
-            return jsonify({'error': ip_address}), 400
-        
-        # Get additional service info
-        service_info = get_service_info(ip_address)
-        
-        # Detect OS
-        os_details = detect_os(ip_address)
-        
-        # Scan ports
-        open_ports = scan_ports(ip_address)
-        
-        return jsonify({
-            'domain': domain,
-            'ip_address': ip_address,
-            'os_details': os_details,
-            'service_info': service_info,
-            'open_ports': open_ports
-        })
+            metrics.SCAN_REQUESTS.inc(status='dns_error')
+            return {'error': ip_address}, 504 if deadline.partial else 400
+    
+    # Get additional service info
+    with tracing.stage('banner', target=ip_address):
+        service_info = deadline.stage('banner').call(
+            executor, "Service info timeout", get_service_info, ip_address)
+    
+    # Detect OS
+    with tracing.stage('os_detection', target=ip_address):
+        os_details = detect_os(ip_address, deadline.stage('os_detection'))
+    
+    # Scan ports (the engine records the port sweep stage itself) with what is left,
+    # fingerprinting the OS from the SYN-ACKs the sweep triggers
+    with passive_os.observe(ip_address) as observer:
+        open_ports, port_states = scan_ports(ip_address, executor=job, deadline=deadline.stage('port_sweep'))
+    with tracing.stage('passive_os', target=ip_address):
+        os_fingerprint = observer.fingerprint(open_ports, deadline=deadline.stage('passive_os'))
+    
+    metrics.SCAN_REQUESTS.inc(status='partial' if deadline.partial else 'ok')
+    result = {
+        'domain': domain_name,
+        'ip_address': ip_address,
+        'os_details': os_details,
+        'os_fingerprint': os_fingerprint,
+        'service_info': service_info,
+        'open_ports': open_ports,
+        'port_states': port_states.to_dict(),
+        'partial': deadline.partial,
+        'deadline': deadline.to_dict()
+    }
+    # Kept in the result store, so large results can be paged through /api/jobs/<job_id>/ports
+    result['job_id'] = web_scans.store_scan(user_input, result)
+    return result, 200
 
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=5000, debug=True)
\ No newline at end of file
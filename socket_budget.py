@@ -0,0 +1,115 @@
+import errno
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Every probe holds one file descriptor and one local (ephemeral) port while it
+# connects.  This keeps the probes of all sweeps in a process within what the
+# OS can actually give us, instead of finding out through EMFILE.
+
+# Descriptors kept free for everything that isn't a probe (client connections,
+# log files, DNS lookups, ...)
+RESERVED_FDS = int(os.environ.get('RECON_RESERVED_FDS', '256'))
+
+# connect() failures that say this machine ran out of something, not that the
+# port is closed
+RESOURCE_CODES = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM, errno.EADDRNOTAVAIL,
+                  getattr(errno, 'WSAEMFILE', -3), getattr(errno, 'WSAENOBUFS', -4)}
+
+class ResourceExhausted(OSError):
+    """The scanner ran out of sockets, descriptors or local ports"""
+
+def fd_limits():
+    """The soft and hard limit on open files, or (None, None) when unknown"""
+    if resource is None:
+        return None, None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    return (None if soft == resource.RLIM_INFINITY else soft,
+            None if hard == resource.RLIM_INFINITY else hard)
+
+def raise_fd_limit(wanted=65536):
+    """Raise the soft open-file limit towards the hard limit, returning the new soft limit"""
+    soft, hard = fd_limits()
+    if soft is None or soft >= wanted:
+        return soft
+    target = wanted if hard is None else min(wanted, hard)
+    if target > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard if hard is not None else resource.RLIM_INFINITY))
+            return target
+        except (ValueError, OSError):
+            pass
+    return soft
+
+def open_fd_count():
+    """Number of descriptors this process has open (0 when the OS doesn't say)"""
+    for path in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            continue
+    return 0
+
+def local_port_range():
+    """The range of local ports the OS hands out to outgoing connections"""
+    try:
+        with open('/proc/sys/net/ipv4/ip_local_port_range', 'r') as f:
+            low, high = (int(value) for value in f.read().split())
+            return low, high
+    except (OSError, ValueError):
+        pass
+    if sys.platform == 'darwin' or sys.platform.startswith('win'):
+        # IANA dynamic range, the default on Windows and macOS
+        return 49152, 65535
+    return 32768, 60999
+
+class SocketBudget:
+    """Hands out socket slots to port sweeps so together they fit the OS limits"""
+
+    def __init__(self, reserved_fds=RESERVED_FDS):
+        soft = raise_fd_limit()
+        low, high = local_port_range()
+        limits = [high - low + 1]
+        if soft is not None:
+            limits.append(soft - open_fd_count() - reserved_fds)
+        self.capacity = max(1, min(limits))
+        self.in_use = 0
+        self.lock = threading.Lock()
+        metrics.SOCKET_BUDGET.set(self.capacity)
+
+    @contextmanager
+    def reserve(self, wanted):
+        """Reserve up to `wanted` sockets for a sweep and yield how many it got
+
+        A sweep always gets at least one, so it can make progress when others
+        are holding the rest.
+        """
+        with self.lock:
+            granted = max(1, min(wanted, self.capacity - self.in_use))
+            self.in_use += granted
+        metrics.SOCKETS_RESERVED.inc(granted)
+        try:
+            yield granted
+        finally:
+            with self.lock:
+                self.in_use -= granted
+            metrics.SOCKETS_RESERVED.dec(granted)
+
+_budget = None
+_budget_lock = threading.Lock()
+
+def get_budget():
+    """Get this process's socket budget, measuring the limits on first use"""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = SocketBudget()
+        return _budget
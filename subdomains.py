@@ -0,0 +1,134 @@
+import asyncio
+import random
+import string
+
+import dns_client
+import tracing
+from dns_client import AsyncResolver, DnsError
+
+# Subdomain enumeration: resolve <word>.<domain> for every word in a wordlist
+# through the async resolver, and report the names that exist.
+
+# Resolving names that can't exist tells us whether the zone has a wildcard record
+WILDCARD_PROBES = 3
+
+# Lookups in flight at once
+DEFAULT_CONCURRENCY = 500
+
+# Used when no --wordlist is given
+DEFAULT_WORDS = (
+    "www", "mail", "ftp", "webmail", "smtp", "pop", "pop3", "imap", "ns", "ns1", "ns2", "ns3",
+    "dns", "dns1", "dns2", "mx", "mx1", "mx2", "vpn", "remote", "gateway", "router", "fw", "proxy",
+    "api", "app", "apps", "dev", "development", "test", "testing", "stage", "staging", "uat", "qa",
+    "prod", "production", "demo", "beta", "alpha", "sandbox", "admin", "administrator", "portal",
+    "intranet", "extranet", "internal", "corp", "office", "owa", "exchange", "autodiscover",
+    "lyncdiscover", "sip", "cpanel", "whm", "webdisk", "blog", "shop", "store", "forum", "wiki",
+    "docs", "help", "support", "status", "m", "mobile", "static", "assets", "img", "images", "cdn",
+    "media", "files", "download", "downloads", "upload", "backup", "db", "mysql", "sql", "git",
+    "gitlab", "jenkins", "ci", "jira", "confluence", "grafana", "kibana", "monitor", "monitoring",
+    "nagios", "zabbix", "ldap", "auth", "sso", "login", "secure", "payment", "pay", "billing",
+    "crm", "erp", "hr", "news", "search", "cloud", "s3", "storage", "web", "web1", "web2", "server",
+    "host", "mail2", "email", "relay", "ntp", "time", "vpn1", "citrix", "rdp", "ssh", "old", "new",
+    "legacy", "v1", "v2", "origin", "edge", "lb", "k8s", "kube", "registry", "vault", "consul",
+)
+
+def read_wordlist(path):
+    """Yield the words of a wordlist file, one per line, without reading it all into memory"""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            word = line.split("#", 1)[0].strip().lower().strip(".")
+            if word:
+                yield word
+
+def random_label():
+    return "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(20))
+
+async def detect_wildcard(resolver, domain, probes=WILDCARD_PROBES):
+    """Addresses that made-up names under the domain resolve to (empty without a wildcard)
+
+    Several names are tried since wildcards are often served round-robin.
+    """
+    results = await asyncio.gather(*(resolver.query(f"{random_label()}.{domain}") for _ in range(probes)),
+                                   return_exceptions=True)
+    wildcard = set()
+    for result in results:
+        if isinstance(result, dict):
+            wildcard.update(dns_client.addresses(result))
+    return wildcard
+
+async def iter_subdomains(domain, words, resolver, concurrency=DEFAULT_CONCURRENCY, wildcard=None):
+    """Yield every <word>.<domain> that resolves, as it is found
+
+    Names that only resolve to the zone's wildcard addresses are left out,
+    otherwise every word in the list would come back as a hit.
+    """
+    loop = asyncio.get_running_loop()
+    domain = domain.rstrip(".").lower()
+    if wildcard is None:
+        wildcard = await detect_wildcard(resolver, domain)
+    results = asyncio.Queue()
+
+    async def run(word):
+        found = None
+        name = f"{word}.{domain}"
+        try:
+            result = await resolver.query(name)
+            addresses = dns_client.addresses(result)
+            if addresses and not set(addresses) <= wildcard:
+                found = {"name": name, "addresses": addresses, "cnames": dns_client.cname_chain(result)}
+        except DnsError:
+            pass
+        finally:
+            await results.put(found)
+
+    # Same lazy task window as the UDP sweep, so a 100k word list doesn't
+    # create 100k tasks up front
+    tasks = set()
+    pending = 0
+    for word in words:
+        task = loop.create_task(run(word))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        pending += 1
+        if pending >= concurrency * 2:
+            found = await results.get()
+            pending -= 1
+            if found is not None:
+                yield found
+
+    while pending:
+        found = await results.get()
+        pending -= 1
+        if found is not None:
+            yield found
+
+def subdomain_record(domain, found):
+    """Turn an enumeration hit into a flat output record"""
+    return {"type": "subdomain", "target": domain, "name": found["name"],
+            "ip_address": found["addresses"][0], "addresses": ",".join(found["addresses"]),
+            "cnames": ",".join(found["cnames"])}
+
+def stream_subdomains(domain, words=None, nameserver=None, concurrency=DEFAULT_CONCURRENCY):
+    """Enumerate subdomains in the background, yielding output records as they are found"""
+    words = DEFAULT_WORDS if words is None else words
+
+    async def records():
+        with tracing.stage("subdomains", target=domain):
+            async with AsyncResolver(nameserver, concurrency=concurrency) as resolver:
+                wildcard = await detect_wildcard(resolver, domain)
+                if wildcard:
+                    yield {"type": "dns_wildcard", "target": domain, "addresses": ",".join(sorted(wildcard))}
+                async for found in iter_subdomains(domain, words, resolver, concurrency, wildcard):
+                    yield subdomain_record(domain, found)
+
+    return dns_client.iter_async(records)
+
+def enumerate_subdomains(domain, words=None, nameserver=None, concurrency=DEFAULT_CONCURRENCY):
+    """Enumerate subdomains and return every hit (for scripts and tests)"""
+    words = DEFAULT_WORDS if words is None else words
+
+    async def collect():
+        async with AsyncResolver(nameserver, concurrency=concurrency) as resolver:
+            return [found async for found in iter_subdomains(domain, words, resolver, concurrency)]
+
+    return asyncio.run(collect())
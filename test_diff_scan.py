@@ -0,0 +1,54 @@
+import tempfile
+
+import diff_scan
+from diff_scan import compute_delta
+
+def result(open_ports, spec="1-65535", banners=None, mode="full"):
+    return {"ip_address": "192.0.2.1", "port_spec": spec, "mode": mode, "scanned_at": 1.0,
+            "open_ports": open_ports, "banners": banners or {}}
+
+def test_first_run_is_all_new():
+    delta = compute_delta(None, result([22, 80]))
+    assert delta["previous_scan"] is None
+    assert delta["opened"] == [22, 80] and delta["closed"] == [] and delta["banner_changes"] == {}
+
+def test_opened_closed_and_changed_banners():
+    previous = result([22, 80, 443], banners={"22": "SSH-2.0-OpenSSH_8.9", "80": "HTTP/1.1 200 OK"})
+    current = result([22, 80, 8080], banners={"22": "SSH-2.0-OpenSSH_9.6", "80": "HTTP/1.1 200 OK"})
+    delta = compute_delta(previous, current)
+    assert delta["opened"] == [8080] and delta["closed"] == [443]
+    assert delta["banner_changes"] == {"22": {"old": "SSH-2.0-OpenSSH_8.9", "new": "SSH-2.0-OpenSSH_9.6"}}
+    assert delta["open_ports"] == [22, 80, 8080] and delta["previous_scan"] == 1.0
+
+def test_ports_outside_either_range_are_not_changes():
+    # Last run covered 1-1024; this one 1-100 and 8000-9000 are left out
+    delta = compute_delta(result([22, 443], spec="1-1024"), result([22], spec="1-100"))
+    assert delta["opened"] == [] and delta["closed"] == []
+    delta = compute_delta(result([22], spec="1-100"), result([22, 443, 8080], spec="1-1024"))
+    assert delta["opened"] == [] and delta["closed"] == []
+    assert delta["open_ports"] == [22, 443, 8080]
+
+def test_results_without_a_range_are_compared_as_before():
+    previous = result([22, 443])
+    del previous["port_spec"]
+    assert compute_delta(previous, result([22]))["closed"] == [443]
+
+def test_a_new_range_forces_a_full_sweep():
+    swept = []
+
+    def fake_scan(ip_address, ports, concurrency=100):
+        swept.append(len(ports))
+        return [port for port in ports if port == 22]
+
+    original_scan, original_banners = diff_scan.scan_port_list, diff_scan.grab_banners
+    diff_scan.scan_port_list, diff_scan.grab_banners = fake_scan, lambda ip, ports: {}
+    try:
+        with tempfile.TemporaryDirectory() as history:
+            assert diff_scan.diff_scan("192.0.2.1", 1, 1024, history)["mode"] == "full"
+            assert diff_scan.diff_scan("192.0.2.1", 1, 1024, history)["mode"] == "incremental"
+            swept.clear()
+            delta = diff_scan.diff_scan("192.0.2.1", 1, 2048, history)
+    finally:
+        diff_scan.scan_port_list, diff_scan.grab_banners = original_scan, original_banners
+    assert delta["mode"] == "full" and delta["port_spec"] == "1-2048"
+    assert swept == [2048]
@@ -0,0 +1,214 @@
+import asyncio
+import socket
+import struct
+import threading
+
+import dns_client
+from dns_client import A, CNAME, MX, NS, PTR, SOA, SRV, TXT, AsyncResolver, encode_name
+from dns_harvest import harvest_dns
+from reverse_dns import ReverseSweep, expand_range
+from subdomains import enumerate_subdomains
+
+def encode_rdata(rtype, rdata):
+    if rtype == A:
+        return socket.inet_aton(rdata)
+    if rtype == MX:
+        return struct.pack(">H", rdata[0]) + encode_name(rdata[1])
+    if rtype == SRV:
+        return struct.pack(">HHH", *rdata[:3]) + encode_name(rdata[3])
+    if rtype == TXT:
+        return bytes([len(rdata)]) + rdata.encode()
+    return encode_name(rdata)
+
+class StubDnsServer:
+    """A tiny authoritative server on loopback answering from a dict of records"""
+
+    def __init__(self, records, wildcards=None, truncated=False):
+        # records: {(name, type): [rdata, ...]}, wildcards: {domain: address}
+        # truncated: set the TC bit, telling the client to ask again over TCP
+        self.records = records
+        self.wildcards = wildcards or {}
+        self.truncated = truncated
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = "127.0.0.1:%d" % self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sock.close()
+
+    def lookup(self, name, qtype):
+        """The answer records for a question, following CNAMEs"""
+        answers = []
+        for _ in range(8):
+            if (name, qtype) in self.records:
+                return answers + [(name, qtype, rdata) for rdata in self.records[(name, qtype)]], True
+            if (name, CNAME) in self.records:
+                target = self.records[(name, CNAME)][0]
+                answers.append((name, CNAME, target))
+                name = target
+                continue
+            for domain, address in self.wildcards.items():
+                if name.endswith("." + domain) and qtype == A:
+                    return answers + [(name, A, address)], True
+            break
+        return answers, bool(answers) or any(key[0] == name for key in self.records)
+
+    def serve(self):
+        while True:
+            try:
+                query, client = self.sock.recvfrom(512)
+            except OSError:
+                return
+            name, offset = dns_client.decode_name(query, 12)
+            qtype = struct.unpack(">H", query[offset:offset + 2])[0]
+            self.queries.append((name, qtype))
+            answers, exists = self.lookup(name, qtype)
+            flags = 0x8580 if exists else 0x8583
+            if self.truncated:
+                flags |= 0x0200
+            response = query[:2] + struct.pack(">HHHHH", flags, 1, len(answers), 0, 0) + query[12:offset + 4]
+            for owner, rtype, rdata in answers:
+                data = encode_rdata(rtype, rdata)
+                response += encode_name(owner) + struct.pack(">HHIH", rtype, 1, 300, len(data)) + data
+            self.sock.sendto(response, client)
+
+def run(coroutine_function):
+    import asyncio
+    return asyncio.run(coroutine_function())
+
+def test_resolver_follows_cname_chains():
+    records = {("www.example.test", CNAME): ["edge.example.test"],
+               ("edge.example.test", A): ["192.0.2.10", "192.0.2.11"]}
+    with StubDnsServer(records) as server:
+        async def lookup():
+            async with AsyncResolver(server.address, timeout=0.5) as resolver:
+                return await resolver.query("www.example.test")
+        result = run(lookup)
+    assert dns_client.cname_chain(result) == ["edge.example.test"]
+    assert dns_client.addresses(result) == ["192.0.2.10", "192.0.2.11"]
+
+def test_answers_are_cached_and_shared():
+    records = {("api.example.test", A): ["192.0.2.20"]}
+    with StubDnsServer(records) as server:
+        async def lookup():
+            import asyncio
+            async with AsyncResolver(server.address, timeout=0.5) as resolver:
+                # Identical lookups in flight share one query, later ones hit the cache
+                first = await asyncio.gather(*(resolver.query("api.example.test") for _ in range(5)))
+                again = await resolver.resolve("API.example.test.")
+                missing = await resolver.query("nope.example.test")
+                return first, again, missing
+        first, again, missing = run(lookup)
+    assert all(dns_client.addresses(result) == ["192.0.2.20"] for result in first)
+    assert again == ["192.0.2.20"]
+    assert missing["rcode"] == dns_client.NXDOMAIN
+    assert server.queries == [("api.example.test", A), ("nope.example.test", A)]
+
+def test_tcp_fallback_to_a_server_without_tcp():
+    # Nothing listens on the stub's port over TCP, so the fallback is refused
+    with StubDnsServer({("big.example.test", A): ["192.0.2.30"]}, truncated=True) as server:
+        async def lookup():
+            async with AsyncResolver(server.address, timeout=0.5) as resolver:
+                try:
+                    await resolver.query("big.example.test")
+                    assert False, "refused TCP fallback went unnoticed"
+                except dns_client.DnsError:
+                    pass
+                return await resolver.resolve("big.example.test")
+        assert run(lookup) == []
+
+def test_short_records_are_dns_errors():
+    mx = struct.pack(">H", 10) + encode_name("mail.example.test")
+    assert dns_client.parse_rdata(mx, MX, 0, len(mx)) == {"preference": 10, "exchange": "mail.example.test"}
+    soa = encode_name("ns.example.test") + encode_name("admin.example.test") + b"\0" * 8
+    for rdata, rtype in ((b"\x00", MX), (b"\x00" * 5, SRV), (soa, SOA), (b"\x7f\x00", A)):
+        try:
+            dns_client.parse_rdata(rdata, rtype, 0, len(rdata) if rtype != A else 4)
+            assert False, f"accepted {rdata!r}"
+        except dns_client.DnsError:
+            pass
+
+def test_enumeration_finds_live_names():
+    records = {("www.example.test", A): ["192.0.2.1"],
+               ("mail.example.test", A): ["192.0.2.2"],
+               ("vpn.example.test", A): ["192.0.2.3"]}
+    words = ["www", "mail", "vpn"] + ["missing%d" % i for i in range(2000)]
+    with StubDnsServer(records) as server:
+        found = enumerate_subdomains("example.test", words, server.address, concurrency=200)
+    assert sorted(hit["name"] for hit in found) == ["mail.example.test", "vpn.example.test", "www.example.test"]
+
+def test_wildcard_dns_is_filtered():
+    records = {("www.example.test", A): ["192.0.2.1"]}
+    with StubDnsServer(records, wildcards={"example.test": "192.0.2.99"}) as server:
+        found = enumerate_subdomains("example.test", ["www", "shop", "blog", "anything"], server.address)
+    # Everything resolves, but only www points somewhere other than the wildcard
+    assert [hit["name"] for hit in found] == ["www.example.test"]
+
+def test_cidr_ranges_expand_to_hosts():
+    assert list(expand_range("192.0.2.0/30")) == ["192.0.2.1", "192.0.2.2"]
+    assert list(expand_range("192.0.2.7/32")) == ["192.0.2.7"]
+    assert list(expand_range("example.test")) == ["example.test"]
+
+def test_bulk_reverse_dns_sweep():
+    records = {("1.2.0.192.in-addr.arpa", PTR): ["one.example.test"],
+               ("2.2.0.192.in-addr.arpa", PTR): ["two.example.test"]}
+    targets = ["192.0.2.1", "192.0.2.2", "192.0.2.3", "example.test", "192.0.2.1"]
+    with StubDnsServer(records) as server:
+        sweep = ReverseSweep(server.address, lookahead=3)
+        names = [(target, sweep.lookup(target)) for target in sweep.feed(targets)]
+        sweep.thread.join(timeout=5)
+    assert names == [("192.0.2.1", "one.example.test"), ("192.0.2.2", "two.example.test"),
+                     ("192.0.2.3", None), ("example.test", None), ("192.0.2.1", "one.example.test")]
+    # Each address was only asked about once, and nothing is left behind
+    assert sorted(name for name, _ in server.queries) == ["1.2.0.192.in-addr.arpa", "2.2.0.192.in-addr.arpa",
+                                                          "3.2.0.192.in-addr.arpa"]
+    assert not sweep.names and not sweep.expected
+
+def test_late_reverse_dns_answer_is_dropped():
+    class SlowResolver:
+        async def query(self, name, rtype):
+            return {"answers": [{"type": "PTR", "data": "late.example.test"}]}
+
+    with StubDnsServer({}) as server:
+        sweep = ReverseSweep(server.address)
+        # The lookup gives up before the answer arrives
+        sweep.expected["192.0.2.9"] = 1
+        assert sweep.lookup("192.0.2.9", timeout=0.05) is None
+        asyncio.run(sweep.resolve(SlowResolver(), "192.0.2.9"))
+        sweep.close()
+        sweep.thread.join(timeout=5)
+    assert not sweep.names and not sweep.expected
+
+def test_dns_harvest_expands_targets():
+    records = {("example.test", NS): ["ns1.example.test", "ns.hosting.test"],
+               ("example.test", MX): [(10, "mail.example.test"), (20, "mx.mailhost.test")],
+               ("example.test", TXT): ["v=spf1 mx -all"],
+               ("_sip._tcp.example.test", SRV): [(0, 5, 5060, "sip.example.test")],
+               ("ns1.example.test", A): ["192.0.2.53"],
+               ("ns.hosting.test", A): ["198.51.100.53"],
+               ("mail.example.test", CNAME): ["mx-1.example.test"],
+               ("mx-1.example.test", A): ["192.0.2.25"],
+               ("mx.mailhost.test", A): ["198.51.100.25"],
+               ("sip.example.test", A): ["192.0.2.60"]}
+    with StubDnsServer(records) as server:
+        found = harvest_dns("example.test", server.address)
+
+    values = {(r["record_type"], r["value"]) for r in found if r["type"] == "dns_record"}
+    assert {("MX", "10 mail.example.test"), ("TXT", "v=spf1 mx -all"),
+            ("SRV", "0 5 5060 sip.example.test"), ("NS", "ns.hosting.test")} <= values
+
+    hosts = {r["name"]: r for r in found if r["type"] == "dns_host"}
+    assert sorted(hosts) == ["mail.example.test", "mx.mailhost.test", "ns.hosting.test",
+                             "ns1.example.test", "sip.example.test"]
+    # The CNAME chain is followed to the address behind it
+    assert hosts["mail.example.test"]["cnames"] == "mx-1.example.test"
+    assert hosts["mail.example.test"]["ip_address"] == "192.0.2.25"
+    # Infrastructure run by someone else is reported but not scanned
+    assert [name for name, host in sorted(hosts.items()) if not host["in_scope"]] == ["mx.mailhost.test",
+                                                                                       "ns.hosting.test"]
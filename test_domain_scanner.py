@@ -0,0 +1,40 @@
+import contextlib
+import io
+
+from domain_scanner import parse_args
+
+def rejected(argv):
+    """The error parse_args prints for argv, or None when it is accepted"""
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(stderr):
+            parse_args(argv)
+    except SystemExit as e:
+        assert e.code == 2
+        return stderr.getvalue().strip().splitlines()[-1]
+    return None
+
+def test_cli_options_reach_the_scan_options():
+    args = parse_args(["example.com", "-p", "22,80", "--timeout", "0.5", "-c", "7", "--parallel-hosts", "3",
+                       "--max-host-time", "30", "--udp-ports", "53", "--no-os", "-f", "ndjson"])
+    assert args.targets == ["example.com"] and args.parallel_hosts == 3 and args.format == "ndjson"
+    options = args.options
+    assert options["ports"] == [80, 22] and options["timeout"] == 0.5 and options["concurrency"] == 7
+    assert options["host_budget"] == 30 and options["udp_ports"] == [53] and not options["os_detection"]
+
+def test_defaults():
+    args = parse_args([])
+    assert args.targets == [] and args.parallel_hosts == 1
+    assert args.options["port_spec"] == "1-1024" and len(args.options["ports"]) == 1024
+    assert args.options["udp_ports"] is None and args.options["host_budget"] is None
+
+def test_bad_numbers_are_usage_errors():
+    for argv in (["--timeout", "-1"], ["--timeout", "0"], ["--timeout", "soon"], ["-c", "0"],
+                 ["--concurrency", "-5"], ["--parallel-hosts", "0"], ["--max-host-time", "0"]):
+        error = rejected(argv + ["example.com"])
+        assert error and "error: argument" in error, argv
+
+def test_bad_port_specs_are_usage_errors():
+    assert "out of range" in rejected(["-p", "0-10", "example.com"])
+    assert "Invalid port" in rejected(["-p", "http", "example.com"])
+    assert "--profile needs --trace" in rejected(["--profile", "example.com"])
@@ -0,0 +1,102 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+
+from inventory import Inventory, fingerprint, load, parse_service_info
+from scan_engine import grab_banner
+
+def test_fingerprints_name_the_software():
+    assert fingerprint("SSH-2.0-OpenSSH_9.6p1 Ubuntu-3ubuntu13") == "openssh 9.6p1"
+    assert fingerprint("220 ProFTPD 1.3.5 Server (Debian)") == "proftpd 1.3.5"
+    assert fingerprint("Server: nginx/1.24.0") == "nginx 1.24.0"
+    assert fingerprint("+OK Dovecot ready.") == "+ok dovecot ready."
+
+def test_identical_banners_are_stored_once():
+    inventory = Inventory()
+    for i in range(1000):
+        # A fresh string per host, as they come out of the scan results
+        inventory.add(f"10.0.{i // 256}.{i % 256}", 22, "".join(["SSH-2.0-", "OpenSSH_9.6p1"]))
+        inventory.add(f"10.0.{i // 256}.{i % 256}", 80, "nginx/" + "1.24.0")
+    banners = {id(ports[22]) for ports in inventory.hosts.values()}
+    assert len(banners) == 1
+    assert len(inventory.by_banner) == 2 and len(inventory.fingerprints) == 2
+    assert inventory.services() == [("nginx 1.24.0", 1000), ("openssh 9.6p1", 1000)]
+
+def test_inventory_questions():
+    inventory = Inventory()
+    inventory.add("192.0.2.1", 22, "SSH-2.0-OpenSSH_9.6p1")
+    inventory.add("192.0.2.1", 443)
+    inventory.add("192.0.2.2", 80, "HTTP/1.1 200 OK Server: nginx/1.24.0")
+    inventory.add("192.0.2.3", 80, "Server: nginx/1.18.0")
+    assert inventory.hosts_with_port(80) == ["192.0.2.2", "192.0.2.3"]
+    assert inventory.hosts_running("NGINX") == ["192.0.2.2", "192.0.2.3"]
+    assert inventory.hosts_running("nginx 1.18.0") == ["192.0.2.3"]
+    assert inventory.ports() == [(80, 2), (22, 1), (443, 1)]
+
+    # An upgrade replaces the old banner everywhere
+    inventory.add("192.0.2.3", 80, "Server: nginx/1.24.0")
+    assert inventory.hosts_running("nginx 1.18.0") == []
+    assert inventory.hosts_with_banner("Server: nginx/1.18.0") == []
+    assert inventory.summary()["distinct_banners"] == 3
+
+def test_web_servers_are_fingerprinted_by_their_server_header():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    port = listener.getsockname()[1]
+
+    def serve():
+        client, _ = listener.accept()
+        client.recv(1024)
+        client.sendall(b"HTTP/1.1 200 OK\r\nDate: Mon, 01 Jan 2024 00:00:00 GMT\r\n"
+                       b"Server: nginx/1.24.0\r\nContent-Length: 0\r\n\r\n")
+        client.close()
+
+    server = threading.Thread(target=serve)
+    server.start()
+    try:
+        banner = grab_banner("127.0.0.1", port, timeout=2, http=True)
+    finally:
+        server.join()
+        listener.close()
+    assert banner == "HTTP/1.1 200 OK Server: nginx/1.24.0"
+
+    inventory = Inventory()
+    inventory.add("192.0.2.1", port, banner)
+    inventory.add("192.0.2.2", 80, "HTTP/1.1 404 Not Found")
+    assert inventory.hosts_running("nginx") == ["192.0.2.1"]
+    assert inventory.hosts_running("nginx 1.24.0") == ["192.0.2.1"]
+    # Without a Server header the status line is all there is
+    assert fingerprint("HTTP/1.1 404 Not Found") == "http/1.1 404 not found"
+    assert fingerprint("HTTP/1.1 200 OK Server: Apache") == "apache"
+
+def test_service_info_summaries_are_split():
+    text = "SSH(22): SSH-2.0-OpenSSH_8.9p1 Ubuntu-3; HTTP(80): No banner; FTP(21): 220 vsFTPd 3.0.5"
+    assert parse_service_info(text) == [(22, "SSH-2.0-OpenSSH_8.9p1 Ubuntu-3"), (80, None),
+                                        (21, "220 vsFTPd 3.0.5")]
+    assert parse_service_info("No service banners captured") == []
+
+def test_load_scan_output_and_history():
+    records = [{"type": "open_port", "target": "a.test", "ip_address": "192.0.2.1", "port": 22},
+               {"type": "banner", "target": "a.test", "ip_address": "192.0.2.1", "port": 22,
+                "banner": "SSH-2.0-OpenSSH_9.6p1"},
+               {"type": "os_details", "target": "b.test", "ip_address": "192.0.2.2",
+                "services": "FTP(21): 220 ProFTPD 1.3.5 Server"},
+               {"type": "summary", "target": "a.test"}]
+    snapshot = {"ip_address": "192.0.2.3", "open_ports": [22, 8080], "banners": {"22": "SSH-2.0-OpenSSH_9.6p1"}}
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "scan.ndjson"), "w") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        with open(os.path.join(directory, "report.json"), "w") as f:
+            json.dump({"started_at": 0, "findings": records[:1]}, f)
+        history = os.path.join(directory, "history")
+        os.mkdir(history)
+        with open(os.path.join(history, "192.0.2.3.json"), "w") as f:
+            json.dump(snapshot, f)
+        inventory = load([os.path.join(directory, "scan.ndjson"), os.path.join(directory, "report.json"), history])
+    assert sorted(inventory.hosts) == ["192.0.2.1", "192.0.2.2", "192.0.2.3"]
+    assert inventory.hosts_running("openssh") == ["192.0.2.1", "192.0.2.3"]
+    assert inventory.hosts_running("proftpd") == ["192.0.2.2"]
+    assert inventory.hosts_with_port(8080) == ["192.0.2.3"]
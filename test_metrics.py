@@ -0,0 +1,56 @@
+import metrics
+from metrics import Counter, Gauge, Histogram
+
+def make(metric_class, *args, **kwargs):
+    """A metric that is taken out of the global registry again"""
+    metric = metric_class(*args, **kwargs)
+    metrics.REGISTRY.remove(metric)
+    return metric
+
+def test_counter_and_gauge_text_format():
+    counter = make(Counter, "test_probes_total", "Probes by outcome", ["result"])
+    counter.inc(result="open")
+    counter.inc(2, result="closed")
+    assert counter.render() == ['# HELP test_probes_total Probes by outcome',
+                                '# TYPE test_probes_total counter',
+                                'test_probes_total{result="closed"} 2',
+                                'test_probes_total{result="open"} 1']
+
+    gauge = make(Gauge, "test_active", "Active scans")
+    # Unlabelled series are there before anything is recorded
+    assert gauge.render()[2] == "test_active 0"
+    gauge.inc(3)
+    gauge.dec()
+    assert gauge.render()[2] == "test_active 2"
+    gauge.set(7)
+    assert gauge.render()[2] == "test_active 7"
+
+def test_label_values_are_escaped():
+    counter = make(Counter, "test_errors_total", "Errors", ["error"])
+    counter.inc(error='bad "quote"\\\nnext')
+    assert counter.render()[2] == 'test_errors_total{error="bad \\"quote\\"\\\\\\nnext"} 1'
+
+def test_wrong_labels_are_rejected():
+    counter = make(Counter, "test_labelled_total", "Labelled", ["result"])
+    for labels in ({}, {"state": "open"}, {"result": "open", "state": "open"}):
+        try:
+            counter.inc(**labels)
+            assert False, f"accepted {labels}"
+        except ValueError:
+            pass
+
+def test_histogram_buckets_are_cumulative():
+    histogram = make(Histogram, "test_seconds", "Stage time", ["stage"], buckets=(1, 0.1))
+    for value in (0.05, 0.5, 0.7, 5):
+        histogram.observe(value, stage="sweep")
+    assert histogram.render()[2:] == ['test_seconds_bucket{stage="sweep",le="0.1"} 1',
+                                      'test_seconds_bucket{stage="sweep",le="1.0"} 3',
+                                      'test_seconds_bucket{stage="sweep",le="+Inf"} 4',
+                                      'test_seconds_count{stage="sweep"} 4',
+                                      'test_seconds_sum{stage="sweep"} 6.25']
+
+def test_registry_renders_every_metric():
+    text = metrics.render()
+    assert text.endswith("\n")
+    for metric in metrics.REGISTRY:
+        assert f"# TYPE {metric.name} {metric.kind}\n" in text
@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+import xml.etree.ElementTree as ElementTree
+
+from output_formats import (CsvWriter, JsonReportWriter, NdjsonWriter, TextWriter, XmlReportWriter, open_writer,
+                            xml_safe)
+
+RECORDS = [
+    {"type": "ip_address", "target": "example.com", "ip_address": "192.0.2.1", "time": 1.0},
+    {"type": "open_port", "target": "example.com", "ip_address": "192.0.2.1", "port": 22, "time": 2.0},
+    {"type": "banner", "target": "example.com", "ip_address": "192.0.2.1", "port": 22, "time": 3.0,
+     "banner": 'SSH-2.0-OpenSSH_9.6p1 "quoted" <tag> & more'},
+    {"type": "banner", "target": "example.com", "ip_address": "192.0.2.1", "port": 3306, "time": 3.5,
+     "banner": "\x00\x01abc\x1b[0m\tend"},
+    {"type": "error", "target": "example.com", "stage": "port_scan", "time": 4.0,
+     "message": "Port scan stopped early: out of sockets"},
+]
+
+def write_all(writer_class, records=RECORDS):
+    stream = io.StringIO()
+    writer = writer_class(stream)
+    for record in records:
+        writer.write(record)
+    if writer_class in (JsonReportWriter, XmlReportWriter):
+        # Reports are only complete once closed; keep the StringIO readable
+        writer.owns_stream = False
+        writer.close()
+    return stream.getvalue()
+
+def test_ndjson_round_trip():
+    lines = write_all(NdjsonWriter).splitlines()
+    assert [json.loads(line) for line in lines] == RECORDS
+
+def test_json_report_round_trip():
+    report = json.loads(write_all(JsonReportWriter))
+    assert report["findings"] == RECORDS and report["finding_count"] == len(RECORDS)
+    assert report["finished_at"] >= report["started_at"]
+    assert json.loads(write_all(JsonReportWriter, []))["findings"] == []
+
+def test_csv_round_trip():
+    rows = list(csv.DictReader(io.StringIO(write_all(CsvWriter))))
+    assert [row["type"] for row in rows] == [record["type"] for record in RECORDS]
+    assert rows[1]["port"] == "22" and rows[1]["ip_address"] == "192.0.2.1" and rows[1]["detail"] == ""
+    assert rows[2]["detail"] == f"banner={RECORDS[2]['banner']}"
+    assert rows[4]["detail"] == "stage=port_scan; message=Port scan stopped early: out of sockets"
+
+def test_xml_round_trip():
+    scan = ElementTree.fromstring(write_all(XmlReportWriter))
+    findings = [element for element in scan if element.tag != "summary"]
+    assert [element.tag for element in findings] == [record["type"] for record in RECORDS]
+    for element, record in zip(findings, RECORDS):
+        assert element.attrib == {key: xml_safe(str(value)) for key, value in record.items() if key != "type"}
+    # Characters XML can't hold at all are escaped, tabs are kept
+    assert findings[3].get("banner") == "\\x00\\x01abc\\x1b[0m\tend"
+    assert scan.find("summary").get("finding_count") == str(len(RECORDS))
+
+def test_text_labels_errors_by_stage():
+    errors = [{"type": "error", "target": "t", "stage": stage, "message": "failed"}
+              for stage in ("dns", "reverse_dns", "os_detection", "port_scan", "udp_sweep")]
+    assert write_all(TextWriter, errors).splitlines() == [
+        "DNS lookup: failed", "Reverse DNS lookup: failed", "OS detection: failed", "Port scan: failed",
+        "Udp sweep: failed"]
+
+def test_text_output_sorts_open_ports():
+    records = [{"type": "open_port", "target": "t", "ip_address": "192.0.2.1", "port": port} for port in (443, 22)]
+    records.append({"type": "port_scan_complete", "target": "t", "ip_address": "192.0.2.1",
+                    "port_range": "1-1024", "open_port_count": 2, "closed_port_count": 1022,
+                    "filtered_port_count": 0, "host_filtered": False, "not_scanned_count": 0})
+    assert write_all(TextWriter, records).splitlines() == ["Open ports: 22, 443", "Not shown: 1022 closed, 0 filtered"]
+
+def test_unknown_format_is_rejected():
+    try:
+        open_writer("yaml")
+        assert False, "unknown format accepted"
+    except ValueError:
+        pass
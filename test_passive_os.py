@@ -0,0 +1,94 @@
+import socket
+import struct
+import time
+
+import passive_os
+from passive_os import initial_ttl, match, parse_syn_ack, parse_tcp_options
+
+def syn_ack_packet(ttl, window, options, df=True, ip_id=0, source="192.0.2.7", flags=0x12):
+    """A raw IPv4 + TCP SYN-ACK as the capture socket would see it"""
+    options += b"\0" * (-len(options) % 4)
+    tcp = struct.pack(">HHIIBBHHH", 443, 40000, 1, 1, (5 + len(options) // 4) << 4, flags, window, 0, 0) + options
+    return struct.pack(">BBHHHBBH4s4s", 0x45, 0, 20 + len(tcp), ip_id, 0x4000 if df else 0, ttl,
+                       socket.IPPROTO_TCP, 0, socket.inet_aton(source), socket.inet_aton("192.0.2.1")) + tcp
+
+MSS_1460 = b"\x02\x04\x05\xb4"
+
+def test_option_layout_is_read_in_order():
+    layout, mss, scale = parse_tcp_options(MSS_1460 + b"\x01\x03\x03\x08\x04\x02\x08\x0a" + b"\0" * 8 + b"\0\0")
+    assert layout == ("mss", "nop", "ws", "sok", "ts", "eol+1") and mss == 1460 and scale == 8
+    assert initial_ttl(57) == 64 and initial_ttl(116) == 128 and initial_ttl(250) == 255
+
+def test_syn_acks_match_signatures():
+    linux = syn_ack_packet(52, 65160, MSS_1460 + b"\x04\x02\x08\x0a" + b"\0" * 8 + b"\x01\x03\x03\x07")
+    syn_ack = parse_syn_ack(linux, socket.inet_aton("192.0.2.7"))
+    assert match(syn_ack) == ("Linux 4.x-6.x", "exact")
+    assert passive_os.fingerprint(syn_ack)["distance"] == 12
+
+    windows = syn_ack_packet(118, 8192, MSS_1460 + b"\x01\x03\x03\x08\x04\x02\x08\x0a" + b"\0" * 8,
+                             ip_id=4242)
+    assert match(parse_syn_ack(windows)) == ("Windows 7-11", "exact")
+
+    # The right layout with an unusual window (and no IP ID) still names the family
+    odd = syn_ack_packet(118, 1234, MSS_1460 + b"\x01\x03\x03\x08\x01\x01\x04\x02")
+    assert match(parse_syn_ack(odd)) == ("Windows 10/11", "fuzzy")
+
+def test_other_packets_are_ignored():
+    assert parse_syn_ack(syn_ack_packet(64, 1024, MSS_1460, flags=0x04)) is None  # a reset
+    assert parse_syn_ack(syn_ack_packet(64, 1024, MSS_1460), socket.inet_aton("192.0.2.99")) is None
+    assert parse_syn_ack(b"\x60" + b"\0" * 59) is None  # IPv6
+
+def test_loopback_fingerprint():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(4)
+    port = server.getsockname()[1]
+    try:
+        with passive_os.observe("127.0.0.1") as observer:
+            socket.create_connection(("127.0.0.1", port)).close()
+            time.sleep(0.1)
+            found = observer.fingerprint([port])
+    finally:
+        server.close()
+    if found is None:
+        return  # neither a raw socket nor TCP_INFO on this platform
+    if found["source"] == "syn_ack":
+        assert found["os"].startswith("Linux") and found["distance"] == 0
+    else:
+        assert found["match"] == "partial" and "Linux" in found["os"]
+
+def test_stopping_the_capture_wakes_it_at_once():
+    try:
+        capture = passive_os.SynAckCapture("127.0.0.1").start()
+    except OSError:
+        return  # no raw socket rights here
+    time.sleep(0.05)
+    started = time.monotonic()
+    capture.stop()
+    # The listener blocks without a timeout, so only the wake-up can end it
+    # before stop() gives up on the join
+    assert not capture.thread.is_alive()
+    assert time.monotonic() - started < passive_os.STOP_TIMEOUT / 2
+
+def test_fallback_connect_stays_within_the_stage_deadline():
+    from deadlines import Deadline
+
+    timeouts = []
+    original = passive_os.tcp_info_syn_ack
+    passive_os.tcp_info_syn_ack = lambda ip_address, port, timeout: timeouts.append(timeout)
+    try:
+        observer = passive_os.PassiveObserver("192.0.2.1")
+        observer.close()
+        observer.capture = None
+        stage = Deadline(1.0).stage("passive_os")
+        assert observer.fingerprint([22], 1, stage) is None
+        assert timeouts and timeouts[0] <= stage.expires - stage.deadline.started
+
+        deadline = Deadline(0.01)
+        time.sleep(0.02)
+        assert observer.fingerprint([22], 1, deadline.stage("passive_os")) is None
+    finally:
+        passive_os.tcp_info_syn_ack = original
+    # Out of time: no connect at all, and the stage is reported as cut short
+    assert len(timeouts) == 1
+    assert "passive_os" in deadline.timed_out
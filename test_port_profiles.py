@@ -0,0 +1,29 @@
+from port_profiles import FULL_RANGE, RANKED_PORTS, order_by_likelihood, profile_ports, top_ports
+
+def test_top_ports_are_most_likely_first():
+    assert top_ports(5) == [80, 23, 443, 21, 22]
+    assert top_ports(100) == RANKED_PORTS[:100]
+    assert len(set(top_ports(1000))) == 1000
+    for bad in (0, -1, len(RANKED_PORTS) + 1):
+        try:
+            top_ports(bad)
+            assert False, f"accepted {bad}"
+        except ValueError:
+            pass
+
+def test_order_by_likelihood():
+    assert order_by_likelihood([22, 80, 443]) == [80, 443, 22]
+    # Ports outside the table keep their order after the ranked ones
+    assert order_by_likelihood([60001, 60000, 22, 60002]) == [22, 60001, 60000, 60002]
+    assert order_by_likelihood([]) == []
+
+def test_profiles():
+    assert profile_ports("top100") == top_ports(100)
+    full = profile_ports("full")
+    assert full[:1000] == top_ports(1000)
+    assert sorted(full) == list(range(FULL_RANGE[0], FULL_RANGE[1] + 1))
+    try:
+        profile_ports("everything")
+        assert False, "accepted an unknown profile"
+    except ValueError:
+        pass
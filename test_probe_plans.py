@@ -0,0 +1,102 @@
+import os
+import socket
+import tempfile
+import threading
+
+import probe_plans
+from probe_plans import compile_template, get_plan, rule_matches, run_plan, template_names
+
+def listener(banner=None):
+    """A loopback TCP server that greets every client with `banner`"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+
+    def serve():
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+            try:
+                if banner:
+                    client.sendall(banner)
+                # Read what the client sent, or closing would reset the connection
+                client.settimeout(1)
+                client.recv(64)
+            except OSError:
+                pass
+            client.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server, server.getsockname()[1]
+
+def test_shipped_templates_compile():
+    names = template_names()
+    assert {"os_ports", "os_ports_fast", "services", "services_fast", "quick", "web"} <= set(names)
+    for name in names:
+        plan = get_plan(name)
+        # Compiled once and shared by every caller
+        assert get_plan(name) is plan
+    assert get_plan("quick").ports[:3] == (80, 23, 443)
+
+def test_plans_are_immutable():
+    plan = get_plan("os_ports")
+    try:
+        plan.timeout = 5
+        assert False, "a plan could be changed"
+    except AttributeError:
+        pass
+    assert isinstance(plan.probes, tuple) and isinstance(plan.rules[0].all_ports, frozenset)
+
+def test_rules_match_the_port_heuristics():
+    plan = get_plan("os_ports")
+
+    def hints(*ports):
+        open_ports = dict.fromkeys(ports, "x")
+        return [rule.hint for rule in plan.rules if rule_matches(rule, open_ports)]
+
+    assert hints(22, 80) == ["Linux/Unix (SSH detected)", "Web Server (Limited services)"]
+    assert hints(22, 80, 443, 3389) == ["Windows (RDP detected)", "Web Server (Multiple services)"]
+    assert hints(23, 53) == ["Network Device (Telnet detected)", "Network Device (DNS server)"]
+
+def test_plans_run_against_a_host():
+    server, port = listener(b"SSH-2.0-OpenSSH_9.6\r\nmore\r\n")
+    try:
+        ports_plan = compile_template({"kind": "os_ports", "timeout": 0.5,
+                                       "probes": [{"port": port, "service": "SSH"}],
+                                       "rules": [{"hint": "Linux/Unix (SSH detected)", "all": [port]}]})
+        assert run_plan(ports_plan, "127.0.0.1") == f"Linux/Unix (SSH detected) - Open ports: {port}(SSH)"
+
+        banner_plan = compile_template({"kind": "banners", "timeout": 1, "max_chars": 10,
+                                        "probes": [{"port": port, "service": "SSH", "send": "\n"}]})
+        assert run_plan(banner_plan, "127.0.0.1") == f"SSH({port}): SSH-2.0-Op..."
+
+        sweep_plan = compile_template({"kind": "port_sweep", "ports": str(port), "timing": "aggressive"})
+        open_ports, summary = run_plan(sweep_plan, "127.0.0.1")
+        assert open_ports == [port] and sweep_plan.timeout == 0.5
+    finally:
+        server.close()
+
+def test_invalid_templates_are_rejected():
+    for template in [{"kind": "nope"}, {"kind": "banners"},
+                     {"kind": "os_ports", "probes": [{"port": 70000}]},
+                     {"kind": "os_ports", "probes": [{"port": 22}], "rules": [{"hint": "x", "some": [22]}]}]:
+        try:
+            compile_template(template)
+            assert False, f"accepted {template}"
+        except ValueError:
+            pass
+
+def test_yaml_templates():
+    try:
+        import yaml  # noqa: F401
+    except ImportError:
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "mail.yaml")
+        with open(path, "w") as f:
+            f.write("kind: port_sweep\nports: 25,465,587\ntiming: polite\n")
+        plan = get_plan(path)
+    assert plan.ports == (25, 465, 587) and plan.concurrency == 20
+    probe_plans._plans.pop(path)
@@ -0,0 +1,127 @@
+import json
+import os
+import tempfile
+
+from result_store import ResultStore
+
+def make_store():
+    """A store in a fresh temporary database, with one job of 250 open ports"""
+    store = ResultStore(os.path.join(tempfile.mkdtemp(), "results.db"))
+    job_id = store.create_job('sweep', '10.0.0.1,10.0.0.2', '1-1000')
+    writer = store.writer(job_id)
+    for ip in ('10.0.0.1', '10.0.0.2'):
+        writer.write({'type': 'ip_address', 'target': ip, 'ip_address': ip})
+        for port in range(1, 126):
+            writer.write({'type': 'open_port', 'target': ip, 'ip_address': ip, 'port': port})
+        writer.write({'type': 'port_scan_complete', 'target': ip, 'ip_address': ip, 'port_range': '1-1000',
+                      'open_port_count': 125, 'closed_port_count': 875, 'filtered_port_count': 0,
+                      'host_filtered': False, 'not_scanned_count': 0})
+    writer.write({'type': 'banner', 'target': '10.0.0.1', 'ip_address': '10.0.0.1', 'port': 22,
+                  'banner': 'SSH-2.0-OpenSSH_8.9p1'})
+    writer.close()
+    store.finish_job(job_id)
+    return store, job_id
+
+def test_cursor_pages_cover_every_row_once():
+    store, job_id = make_store()
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        page = store.page('ports', cursor, limit=100, job_id=job_id)
+        seen += [(item['ip_address'], item['port']) for item in page]
+        cursor = page.next_cursor
+        pages += 1
+        if cursor is None:
+            break
+    assert pages == 3
+    assert len(seen) == 250 and len(set(seen)) == 250
+
+def test_exactly_full_last_page_has_no_next_cursor():
+    store, job_id = make_store()
+    page = store.page('hosts', limit=2, job_id=job_id)
+    assert len(list(page)) == 2 and page.next_cursor is None
+
+def test_fields_and_filters():
+    store, job_id = make_store()
+    page = store.page('ports', fields=['port', 'banner'], job_id=job_id,
+                      filters={'ip_address': '10.0.0.1', 'port': '22,100-101'})
+    assert list(page) == [{'port': 22, 'banner': 'SSH-2.0-OpenSSH_8.9p1'},
+                          {'port': 100, 'banner': None}, {'port': 101, 'banner': None}]
+    hosts = list(store.page('hosts', fields=['ip_address', 'open_port_count'], job_id=job_id))
+    assert hosts == [{'ip_address': '10.0.0.1', 'open_port_count': 125},
+                     {'ip_address': '10.0.0.2', 'open_port_count': 125}]
+
+def test_bad_requests_fail_before_any_row_is_read():
+    store, job_id = make_store()
+    for bad in (dict(fields=['password']), dict(filters={'banner': 'x'}), dict(filters={'port': 'ssh'}),
+                dict(cursor='not a cursor')):
+        try:
+            store.page('ports', job_id=job_id, **bad)
+            assert False, f"accepted {bad}"
+        except ValueError:
+            pass
+
+def api_client(store):
+    """A test client of the API, serving from the given store"""
+    import result_store
+    from flask import Flask
+    from api import api
+
+    result_store._store, result_store._store_pid = store, os.getpid()
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    return app.test_client()
+
+def test_api_streams_pages():
+    store, job_id = make_store()
+    client = api_client(store)
+
+    body = json.loads(client.get(f"/api/jobs/{job_id}/ports?limit=200&fields=port&state=open").data)
+    assert len(body['items']) == 200 and body['items'][0] == {'port': 1}
+    rest = json.loads(client.get(f"/api/jobs/{job_id}/ports?limit=200&cursor={body['next_cursor']}").data)
+    assert len(rest['items']) == 50 and rest['next_cursor'] is None
+    assert json.loads(client.get(f"/api/jobs/{job_id}").data)['status'] == 'done'
+    assert client.get("/api/jobs/999").status_code == 404
+    assert client.get(f"/api/jobs/{job_id}/ports?limit=0").status_code == 400
+    assert client.get(f"/api/jobs/{job_id}/hosts?colour=red").status_code == 400
+
+def test_api_rejects_job_bodies_that_are_not_objects():
+    client = api_client(make_store()[0])
+    for body in (["example.com"], "example.com", 42):
+        assert client.post("/api/jobs", json=body).status_code == 400
+    assert client.post("/api/jobs", data="not json", content_type="application/json").status_code == 400
+
+def test_job_that_cant_start_gives_back_its_slot():
+    import sqlite3
+    import api
+    import scheduler
+
+    class BrokenStore(ResultStore):
+        def create_job(self, *args):
+            raise sqlite3.OperationalError("database is locked")
+
+    class BrokenThread:
+        def __init__(self, *args, **kwargs):
+            pass
+        def start(self):
+            raise RuntimeError("can't start new thread")
+
+    store = BrokenStore(os.path.join(tempfile.mkdtemp(), "results.db"))
+    client = api_client(store)
+    body = {"targets": ["192.0.2.1"], "ports": "80"}
+    assert client.post("/api/jobs", json=body).status_code == 503
+    assert not scheduler.get_scheduler().clients
+
+    store, _ = make_store()
+    client = api_client(store)
+    original = api.threading.Thread
+    api.threading.Thread = BrokenThread
+    try:
+        response = client.post("/api/jobs", json=body)
+    finally:
+        api.threading.Thread = original
+    assert response.status_code == 503
+    assert not scheduler.get_scheduler().clients
+    jobs = json.loads(client.get("/api/jobs?kind=sweep&status=failed").data)["items"]
+    assert [job["error"] for job in jobs] == ["can't start new thread"]
@@ -0,0 +1,201 @@
+import errno
+import socket
+import threading
+import time
+
+import scan_engine
+from deadlines import Deadline, SCAN_BUDGET
+from scan_engine import (OPEN, CLOSED, FILTERED, PortStateSummary, banner_line, check_port, parse_port_spec,
+                         port_result, read_banner, scan_port_states)
+from socket_budget import ResourceExhausted
+
+def unused_tcp_port():
+    """Find a TCP port on loopback that nothing is listening on"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def test_port_specs():
+    # Order is kept and repeats are dropped
+    assert parse_port_spec("22, 80,20-23") == [22, 80, 20, 21, 23]
+    assert parse_port_spec("top5") == [80, 23, 443, 21, 22]
+    assert parse_port_spec("top5,22,8080")[5:] == [8080]
+    assert len(parse_port_spec("full")) == 65535
+    for bad in ("0", "70000", "10-5", "1-x", "ssh", "top0", "top2000", "", " , "):
+        try:
+            parse_port_spec(bad)
+            assert False, f"accepted {bad!r}"
+        except ValueError:
+            pass
+
+def test_errno_classification():
+    assert port_result(80, 0)["state"] == OPEN
+    assert port_result(80, errno.ECONNREFUSED)["state"] == CLOSED
+    assert port_result(80, errno.ETIMEDOUT) == {"port": 80, "state": FILTERED, "reason": "timeout",
+                                                "errno": errno.ETIMEDOUT}
+    assert port_result(80, errno.EHOSTUNREACH)["reason"] == "unreachable"
+    # Running out of sockets says nothing about the port
+    assert port_result(80, errno.EMFILE)["state"] is None
+
+def test_open_and_closed_ports_on_loopback():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    open_port = listener.getsockname()[1]
+    closed_port = unused_tcp_port()
+    try:
+        assert check_port("127.0.0.1", open_port)["state"] == OPEN
+        assert check_port("127.0.0.1", closed_port)["state"] == CLOSED
+
+        open_ports, summary = scan_port_states("127.0.0.1", [open_port, closed_port], concurrency=2)
+        assert open_ports == [open_port]
+        assert summary.states == {OPEN: 1, CLOSED: 1, FILTERED: 0}
+        assert not summary.host_filtered
+    finally:
+        listener.close()
+
+def test_firewalled_host_is_recognised():
+    summary = PortStateSummary()
+    for port, code in [(22, errno.ETIMEDOUT), (80, errno.ETIMEDOUT), (443, errno.EHOSTUNREACH)]:
+        summary.add(port_result(port, code))
+    assert summary.host_filtered
+    assert summary.to_dict()["filtered_reasons"] == {"timeout": 2, "unreachable": 1}
+
+def test_resource_errors_are_not_port_states():
+    original = scan_engine.connect_port
+    scan_engine.connect_port = lambda ip, port, timeout=1: errno.EMFILE
+    try:
+        check_port("127.0.0.1", 80)
+        assert False, "EMFILE was reported as a port state"
+    except ResourceExhausted as e:
+        assert e.errno == errno.EMFILE
+    finally:
+        scan_engine.connect_port = original
+
+def test_banner_is_read_up_to_the_first_line():
+    client, server = socket.socketpair()
+    try:
+        # The greeting arrives in pieces; reading stops once the line is complete
+        server.sendall(b"\r\nSSH-2.0-")
+        threading.Timer(0.05, server.sendall, [b"OpenSSH_9.6\r\nnext line"]).start()
+        banner = read_banner(client, 1024, time.monotonic() + 2)
+        assert banner_line(banner) == "SSH-2.0-OpenSSH_9.6"
+        assert banner_line(banner, max_chars=7) == "SSH-2.0..."
+    finally:
+        client.close()
+        server.close()
+
+def test_banner_reads_are_capped_and_bounded():
+    client, server = socket.socketpair()
+    try:
+        server.sendall(b"x" * 5000)
+        assert len(read_banner(client, 100, time.monotonic() + 2)) == 100
+
+        # A service that stops mid-line gives what it sent by the deadline
+        client.recv(8192)
+        server.sendall(b"220 partial")
+        started = time.monotonic()
+        assert banner_line(read_banner(client, 1024, started + 0.2)) == "220 partial"
+        assert time.monotonic() - started < 1
+
+        # One that sends nothing is a timeout
+        try:
+            read_banner(client, 1024, time.monotonic() + 0.1)
+            assert False, "silent service didn't time out"
+        except socket.timeout:
+            pass
+    finally:
+        client.close()
+        server.close()
+
+def test_sweep_stops_at_its_deadline():
+    def slow_connect(ip, port, timeout=1):
+        # A host that never answers: every probe takes its full timeout
+        time.sleep(timeout)
+        return errno.ETIMEDOUT
+
+    original = scan_engine.connect_port
+    scan_engine.connect_port = slow_connect
+    try:
+        deadline = Deadline(0.5)
+        started = time.monotonic()
+        open_ports, summary = scan_port_states("127.0.0.1", range(1, 1001), timeout=2, concurrency=10,
+                                               deadline=deadline.stage("port_sweep"))
+        elapsed = time.monotonic() - started
+    finally:
+        scan_engine.connect_port = original
+
+    # Bounded by the budget, not by 1000 ports x 2 seconds
+    assert elapsed < 1.5
+    assert open_ports == [] and summary.states[FILTERED] < 1000
+    assert summary.not_scanned == 1000 - summary.states[FILTERED] > 0
+    assert deadline.partial and deadline.to_dict()["timed_out_stages"] == {"port_sweep": summary.not_scanned}
+
+def test_deadline_defaults_to_the_scan_budget():
+    deadline = Deadline()
+    assert deadline.seconds == SCAN_BUDGET
+    assert SCAN_BUDGET - 1 < deadline.remaining() <= SCAN_BUDGET
+    assert not deadline.expired and not deadline.partial
+
+def test_banner_stage_stops_at_its_deadline():
+    import domain_scanner
+
+    class Collect:
+        records = []
+        def stage(self, message):
+            pass
+        def write(self, record):
+            self.records.append(record)
+
+    def stalled_banner(ip, port, timeout=2):
+        # A service that accepts and then never says anything
+        time.sleep(1)
+        return "too late"
+
+    original = domain_scanner.grab_banner
+    domain_scanner.grab_banner = stalled_banner
+    try:
+        deadline = Deadline(0.5)
+        started = time.monotonic()
+        domain_scanner.grab_open_banners("host", "127.0.0.1", [22, 80], Collect(), deadline.stage("banner"))
+        elapsed = time.monotonic() - started
+    finally:
+        domain_scanner.grab_banner = original
+
+    # The banner stage gets its share of the host budget, not the full grab timeout
+    assert elapsed < 0.5
+    assert Collect.records == []
+    assert deadline.to_dict()["timed_out_stages"] == {"banner": 2}
+
+def test_stages_share_the_budget():
+    from concurrent.futures import ThreadPoolExecutor
+
+    deadline = Deadline(1.0)
+    with ThreadPoolExecutor(2) as executor:
+        # A stage only gets its share of what is left
+        dns = deadline.stage("dns")
+        assert dns.remaining() <= 0.1
+        assert dns.call(executor, "timed out", time.sleep, 0.5) == "timed out"
+        assert deadline.stage("os_detection").call(executor, "timed out", lambda: "Linux") == "Linux"
+    assert deadline.timed_out == {"dns": None}
+
+def test_pool_size_is_fixed_once_the_pool_runs():
+    original = (scan_engine.SHARED_PROBE_THREADS, scan_engine._shared_executor, scan_engine._shared_executor_pid)
+    scan_engine._shared_executor = scan_engine._shared_executor_pid = None
+    try:
+        scan_engine.configure_shared_executor(3)
+        executor = scan_engine.get_shared_executor()
+        assert executor._max_workers == 3
+        # Every stage of every scan gets the same pool
+        assert scan_engine.get_shared_executor() is executor
+        try:
+            scan_engine.configure_shared_executor(5)
+            assert False, "resized a running pool"
+        except RuntimeError:
+            pass
+        assert scan_engine.SHARED_PROBE_THREADS == 3
+        scan_engine.shutdown_shared_executor()
+    finally:
+        scan_engine.SHARED_PROBE_THREADS, scan_engine._shared_executor, scan_engine._shared_executor_pid = original
@@ -0,0 +1,168 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import ScanScheduler, AdmissionError, InFlightScans, BULK, BULK_YIELD_SHARE
+
+def make_scheduler(**limits):
+    """A scheduler with a single probe slot, so dispatch order is run order"""
+    settings = dict(max_active=2, max_queued=1, per_client=2, admission_timeout=0.2)
+    settings.update(limits)
+    return ScanScheduler(executor=ThreadPoolExecutor(max_workers=1), slots=1, **settings)
+
+def test_client_quota():
+    scheduler = make_scheduler(per_client=1)
+    job = scheduler.admit("10.0.0.1")
+    try:
+        scheduler.admit("10.0.0.1")
+        assert False, "second scan for the same client was admitted"
+    except AdmissionError as e:
+        assert e.reason == "client_quota"
+    # Other clients are unaffected
+    scheduler.admit("10.0.0.2").close()
+    job.close()
+    scheduler.admit("10.0.0.1").close()
+
+def test_queue_full_and_timeout():
+    scheduler = make_scheduler(max_active=1, max_queued=1)
+    job = scheduler.admit("a")
+    errors = []
+
+    def wait_in_line():
+        try:
+            scheduler.admit("b")
+        except AdmissionError as e:
+            errors.append(e.reason)
+
+    waiter = threading.Thread(target=wait_in_line)
+    waiter.start()
+    time.sleep(0.05)
+    try:
+        scheduler.admit("c")
+        assert False, "scan admitted past a full queue"
+    except AdmissionError as e:
+        assert e.reason == "queue_full"
+    waiter.join()
+    assert errors == ["timeout"]
+    job.close()
+
+def test_waiting_scan_is_admitted_when_a_slot_frees():
+    scheduler = make_scheduler(max_active=1, admission_timeout=2)
+    job = scheduler.admit("a")
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(scheduler.admit("b")))
+    waiter.start()
+    time.sleep(0.05)
+    assert not admitted
+    job.close()
+    waiter.join()
+    assert admitted and admitted[0].client == "b"
+    admitted[0].close()
+
+def test_round_robin_across_jobs():
+    scheduler = make_scheduler()
+    order = []
+    gate = threading.Event()
+    big = scheduler.admit("a")
+    small = scheduler.admit("b", weight=2)
+
+    # Hold the only slot while both jobs queue their work
+    blocker = big.submit(gate.wait)
+    time.sleep(0.05)
+    futures = [big.submit(order.append, "big") for _ in range(6)]
+    futures += [small.submit(order.append, "small") for _ in range(4)]
+    gate.set()
+    for future in [blocker] + futures:
+        future.result(timeout=2)
+
+    # The later, smaller job doesn't wait behind the whole of the big one
+    assert order[:6] == ["big", "small", "small", "big", "small", "small"]
+    big.close()
+    small.close()
+
+def test_closing_a_job_cancels_its_queued_probes():
+    scheduler = make_scheduler()
+    gate = threading.Event()
+    job = scheduler.admit("a")
+    blocker = job.submit(gate.wait)
+    time.sleep(0.05)
+    queued = [job.submit(time.sleep, 0) for _ in range(3)]
+    job.close()
+    gate.set()
+    blocker.result(timeout=2)
+    assert all(future.cancelled() for future in queued)
+
+def test_interactive_probes_go_before_bulk_ones():
+    scheduler = make_scheduler()
+    order = []
+    gate = threading.Event()
+    bulk = scheduler.admit("cron", priority=BULK)
+    blocker = bulk.submit(gate.wait)
+    time.sleep(0.05)
+    futures = [bulk.submit(order.append, "bulk") for _ in range(4)]
+
+    # Started after the bulk sweep queued its work, and still runs first
+    interactive = scheduler.admit("browser")
+    futures += [interactive.submit(order.append, "interactive") for _ in range(2)]
+    gate.set()
+    for future in [blocker] + futures:
+        future.result(timeout=2)
+    assert order == ["interactive"] * 2 + ["bulk"] * 4
+    bulk.close()
+    interactive.close()
+
+def test_bulk_window_shrinks_while_interactive_scans_run():
+    scheduler = make_scheduler()
+    bulk = scheduler.admit("cron", priority=BULK)
+    assert bulk.window_limit(1000) == 1000
+    interactive = scheduler.admit("browser")
+    assert bulk.window_limit(1000) == int(1000 * BULK_YIELD_SHARE)
+    assert bulk.window_limit(5) == 1 and interactive.window_limit(1000) == 1000
+    interactive.close()
+    # Restored once the interactive scan is done
+    assert bulk.window_limit(1000) == 1000
+    bulk.close()
+
+def test_bulk_scans_leave_a_slot_for_interactive_ones():
+    scheduler = make_scheduler(max_active=2, max_queued=2)
+    first = scheduler.admit("cron", priority=BULK)
+    try:
+        scheduler.admit("cron", priority=BULK)
+        assert False, "bulk scans took every slot"
+    except AdmissionError as e:
+        assert e.reason == "timeout"
+    started = time.monotonic()
+    scheduler.admit("browser").close()
+    assert time.monotonic() - started < 0.1
+    first.close()
+
+def test_unknown_priority_is_rejected():
+    try:
+        make_scheduler().admit("a", priority="urgent")
+        assert False, "unknown priority accepted"
+    except ValueError:
+        pass
+
+def test_identical_scans_share_one_run():
+    in_flight = InFlightScans()
+    runs = []
+    gate = threading.Event()
+
+    def slow_scan(target):
+        runs.append(target)
+        gate.wait()
+        return [22, 80]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(in_flight.run, "example.com", slow_scan, "example.com")
+                   for _ in range(3)]
+        other = executor.submit(in_flight.run, "example.org", slow_scan, "example.org")
+        time.sleep(0.1)
+        gate.set()
+        results = [future.result(timeout=2) for future in futures]
+
+    assert sorted(runs) == ["example.com", "example.org"]
+    assert all(result == [22, 80] for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False, True, True]
+    assert other.result() == ([22, 80], False)
+    assert not in_flight.running
@@ -0,0 +1,39 @@
+import metrics
+from socket_budget import SocketBudget
+
+def make_budget(capacity):
+    budget = SocketBudget()
+    budget.capacity = capacity
+    return budget
+
+def test_reservations_share_the_capacity():
+    budget = make_budget(100)
+    with budget.reserve(60) as first:
+        assert first == 60
+        with budget.reserve(60) as second:
+            # Only what the first sweep left over
+            assert second == 40
+            assert budget.in_use == 100
+            with budget.reserve(10) as third:
+                # An exhausted budget still lets a sweep make progress
+                assert third == 1
+                assert budget.in_use == 101
+        assert budget.in_use == 60
+    assert budget.in_use == 0
+
+def test_slots_are_given_back_when_the_sweep_fails():
+    budget = make_budget(10)
+    reserved = metrics.SOCKETS_RESERVED.values[()]
+    try:
+        with budget.reserve(10):
+            assert metrics.SOCKETS_RESERVED.values[()] == reserved + 10
+            raise OSError("sweep failed")
+    except OSError:
+        pass
+    assert budget.in_use == 0
+    assert metrics.SOCKETS_RESERVED.values[()] == reserved
+    with budget.reserve(10) as granted:
+        assert granted == 10
+
+def test_capacity_leaves_reserved_descriptors_free():
+    assert SocketBudget(reserved_fds=0).capacity >= SocketBudget(reserved_fds=100).capacity >= 1
@@ -0,0 +1,8 @@
+from benchmark import forbidden_modules, startup_modules
+
+def test_cli_starts_without_optional_stages():
+    # TLS, HTTP, XML, asyncio and thread pools are only loaded by the stages that use them
+    assert forbidden_modules(startup_modules("domain_scanner")) == []
+
+def test_scan_engine_is_dependency_light():
+    assert forbidden_modules(startup_modules("scan_engine")) == []
@@ -0,0 +1,83 @@
+import threading
+
+import tracing
+
+def test_spans_nest_under_the_enclosing_span():
+    with tracing.trace_scan("scan") as trace:
+        with tracing.stage("port_scan", ports=3):
+            with tracing.stage("connect"):
+                pass
+        with tracing.stage("banners"):
+            pass
+
+    spans = {span["name"]: span for span in trace.to_json()["spans"]}
+    assert list(spans) == ["scan", "port_scan", "connect", "banners"]
+    assert spans["scan"]["parent_span_id"] is None
+    assert spans["port_scan"]["parent_span_id"] == spans["scan"]["span_id"]
+    assert spans["connect"]["parent_span_id"] == spans["port_scan"]["span_id"]
+    assert spans["banners"]["parent_span_id"] == spans["scan"]["span_id"]
+    assert spans["port_scan"]["attributes"] == {"ports": 3}
+    assert spans["scan"]["duration"] >= spans["port_scan"]["duration"]
+
+def test_stage_without_a_trace_records_no_span():
+    with tracing.stage("port_scan") as span:
+        assert span is None
+
+def test_failed_span_keeps_its_error():
+    with tracing.trace_scan("scan") as trace:
+        try:
+            with tracing.stage("dns"):
+                raise OSError("no such host")
+        except OSError:
+            pass
+    dns = [span for span in trace.to_json()["spans"] if span["name"] == "dns"][0]
+    assert dns["error"] == "OSError: no such host"
+
+def test_otlp_export():
+    with tracing.trace_scan("scan") as trace:
+        with tracing.stage("port_scan", ports=3, full=False, host="10.0.0.1"):
+            pass
+
+    otlp = trace.export("otlp")
+    resource = otlp["resourceSpans"][0]
+    assert resource["resource"]["attributes"] == [{"key": "service.name",
+                                                   "value": {"stringValue": tracing.SERVICE_NAME}}]
+    spans = {span["name"]: span for span in resource["scopeSpans"][0]["spans"]}
+    assert "parentSpanId" not in spans["scan"]
+    assert spans["port_scan"]["parentSpanId"] == spans["scan"]["spanId"]
+    assert spans["port_scan"]["traceId"] == trace.trace_id and len(trace.trace_id) == 32
+    assert int(spans["port_scan"]["endTimeUnixNano"]) >= int(spans["port_scan"]["startTimeUnixNano"])
+    attributes = {a["key"]: a["value"] for a in spans["port_scan"]["attributes"]}
+    assert attributes["ports"] == {"intValue": "3"}
+    assert attributes["full"] == {"boolValue": False}
+    assert attributes["host"] == {"stringValue": "10.0.0.1"}
+    assert trace.export("json") == trace.to_json()
+
+def test_disabled_tracing():
+    with tracing.trace_scan("scan", enabled=False) as trace:
+        assert trace is None
+
+def test_profile_samples_the_pool_threads_working_for_the_scan():
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    def probe_work():
+        time.sleep(0.1)
+
+    def other_work():
+        time.sleep(0.1)
+
+    with ThreadPoolExecutor(2) as executor:
+        with tracing.trace_scan("scan", profile=True) as trace:
+            ours = executor.submit(tracing.follow(probe_work))
+            # Not handed over through follow(): someone else's work on the same pool
+            theirs = executor.submit(other_work)
+            ours.result()
+            theirs.result()
+
+    stacks = trace.to_json()["profile"]
+    assert any("test_tracing.py:probe_work" in stack for stack in stacks)
+    assert not any("other_work" in stack for stack in stacks)
+    assert trace.profiler.threads == {threading.get_ident(): 1}
+    # Without a profile the work is handed over as it is
+    assert tracing.follow(probe_work) is probe_work
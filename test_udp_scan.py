@@ -0,0 +1,100 @@
+import socket
+import threading
+
+import udp_scan as udp_scan_module
+from udp_scan import udp_scan, OPEN, CLOSED, FILTERED, OPEN_FILTERED, UDP_PAYLOADS
+
+def start_udp_stub(reply=True):
+    """Start a local UDP service that echoes a fake answer (or stays silent)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    received = []
+
+    def serve():
+        while True:
+            try:
+                data, addr = sock.recvfrom(2048)
+            except OSError:
+                return
+            received.append(data)
+            if reply:
+                # Answer with the query's transaction id, like a real DNS server would
+                sock.sendto(data[:2] + b"\x81\x80" + data[4:], addr)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sock, received
+
+def unused_udp_port():
+    """Find a UDP port on loopback that nothing is listening on"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def test_answering_service_is_open():
+    stub, received = start_udp_stub()
+    port = stub.getsockname()[1]
+    try:
+        result = udp_scan("127.0.0.1", [port], retries=1, initial_timeout=0.5)[0]
+        assert result["state"] == OPEN
+        assert result["response_bytes"] > 0
+        assert received
+    finally:
+        stub.close()
+
+def test_icmp_port_unreachable_is_closed():
+    port = unused_udp_port()
+    result = udp_scan("127.0.0.1", [port], retries=1, initial_timeout=0.5)[0]
+    assert result["state"] == CLOSED
+
+def test_silent_service_is_open_filtered():
+    stub, received = start_udp_stub(reply=False)
+    port = stub.getsockname()[1]
+    try:
+        result = udp_scan("127.0.0.1", [port], retries=1, initial_timeout=0.2)[0]
+        assert result["state"] == OPEN_FILTERED
+        # The probe is retransmitted before giving up
+        assert len(received) == 2
+    finally:
+        stub.close()
+
+def test_many_ports_at_once():
+    stubs = [start_udp_stub()[0] for _ in range(5)]
+    open_ports = [stub.getsockname()[1] for stub in stubs]
+    closed_ports = [unused_udp_port() for _ in range(20)]
+    try:
+        results = udp_scan("127.0.0.1", open_ports + closed_ports, concurrency=10,
+                           retries=1, initial_timeout=0.5)
+        states = {result["port"]: result["state"] for result in results}
+        assert all(states[port] == OPEN for port in open_ports)
+        assert all(states[port] == CLOSED for port in closed_ports if port not in open_ports)
+    finally:
+        for stub in stubs:
+            stub.close()
+
+def test_ports_are_reported_when_sockets_run_out():
+    import errno
+
+    class NoSockets:
+        """The socket module, except that this process is out of descriptors"""
+        def __getattr__(self, name):
+            return getattr(socket, name)
+
+        def socket(self, *args):
+            raise OSError(errno.EMFILE, "Too many open files")
+
+    udp_scan_module.socket = NoSockets()
+    try:
+        results = udp_scan("127.0.0.1", [53, 123, 161], retries=0, initial_timeout=0.2)
+    finally:
+        udp_scan_module.socket = socket
+    assert [(result["port"], result["state"], result["reason"]) for result in results] == [
+        (53, FILTERED, "Too many open files"), (123, FILTERED, "Too many open files"),
+        (161, FILTERED, "Too many open files")]
+
+def test_payloads_are_protocol_specific():
+    # DNS query header with one question, NTP client mode, SNMP sequence
+    assert UDP_PAYLOADS[53][4:6] == b"\x00\x01"
+    assert UDP_PAYLOADS[123][0] == 0x1b and len(UDP_PAYLOADS[123]) == 48
+    assert UDP_PAYLOADS[161][0] == 0x30 and UDP_PAYLOADS[161][1] == len(UDP_PAYLOADS[161]) - 2
@@ -0,0 +1,250 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# The trace of the scan running in the current request/thread, or None.
+# Stages call stage() unconditionally; when nothing is being traced it only
+# feeds the stage latency histogram.
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+# Fraction of web requests traced even when the client didn't ask for it, and
+# where those traces go (an OTLP/HTTP collector such as the OpenTelemetry collector)
+SAMPLE_RATE = float(os.environ.get("RECON_TRACE_SAMPLE_RATE", "0") or 0)
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "recon-scanner")
+
+def new_id(nbytes):
+    """Random hex id of the given size (16 bytes for traces, 8 for spans)"""
+    return os.urandom(nbytes).hex()
+
+class Trace:
+    """Spans recorded for one scan, optionally with a sampling profile"""
+
+    def __init__(self, name, profile=False, profile_interval=0.005):
+        self.trace_id = new_id(16)
+        self.name = name
+        self.spans = []
+        self.lock = threading.Lock()
+        self.profiler = SamplingProfiler(threading.get_ident(), profile_interval) if profile else None
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Record a span around the body of a with-block"""
+        span = {
+            "span_id": new_id(8),
+            "parent_span_id": current_span.get(),
+            "name": name,
+            "attributes": attributes,
+            "start": time.time(),
+            "thread": threading.current_thread().name
+        }
+        token = current_span.set(span["span_id"])
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span["duration"] = time.perf_counter() - start
+            current_span.reset(token)
+            with self.lock:
+                self.spans.append(span)
+
+    def to_json(self):
+        """The trace as plain JSON-friendly data"""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+        data = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "spans": [dict(s, start=round(s["start"], 6), duration=round(s["duration"], 6)) for s in spans]
+        }
+        if self.profiler:
+            data["profile"] = self.profiler.folded()
+        return data
+
+    def to_otlp(self):
+        """The trace in the OpenTelemetry OTLP/JSON format"""
+        with self.lock:
+            spans = list(self.spans)
+
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        otlp_spans = []
+        for s in spans:
+            start_ns = int(s["start"] * 1e9)
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": s["span_id"],
+                "name": s["name"],
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(start_ns),
+                "endTimeUnixNano": str(start_ns + int(s["duration"] * 1e9)),
+                "attributes": [attribute(k, v) for k, v in s["attributes"].items()]
+                              + [attribute("thread.name", s["thread"])],
+                "status": {"code": 2, "message": s["error"]} if "error" in s else {}
+            }
+            if s["parent_span_id"]:
+                otlp_span["parentSpanId"] = s["parent_span_id"]
+            otlp_spans.append(otlp_span)
+
+        return {"resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "recon.tracing"}, "spans": otlp_spans}]
+        }]}
+
+    def export(self, output_format="json"):
+        """The trace in the given format ('json' or 'otlp')"""
+        return self.to_otlp() if output_format == "otlp" else self.to_json()
+
+class SamplingProfiler:
+    """Periodically samples the stacks of the threads working on one scan and counts them
+
+    That is the thread that started the scan, plus every pool thread while it
+    runs work the scan handed it (see follow()); the scan thread itself spends
+    most of its time waiting on them.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.interval = interval
+        self.samples = {}
+        # Thread id -> how many of the scan's calls it is running
+        self.threads = {thread_id: 1}
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def add_thread(self, thread_id):
+        with self.lock:
+            self.threads[thread_id] = self.threads.get(thread_id, 0) + 1
+
+    def remove_thread(self, thread_id):
+        with self.lock:
+            self.threads[thread_id] -= 1
+            if not self.threads[thread_id]:
+                del self.threads[thread_id]
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while self.running:
+            frames = sys._current_frames()
+            with self.lock:
+                thread_ids = list(self.threads)
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    key = ";".join(reversed(stack))
+                    self.samples[key] = self.samples.get(key, 0) + 1
+            time.sleep(self.interval)
+
+    def folded(self):
+        """Samples in the 'folded stacks' format understood by flame graph tools"""
+        return [f"{stack} {count}" for stack, count in
+                sorted(self.samples.items(), key=lambda item: -item[1])]
+
+@contextmanager
+def trace_scan(name, enabled=True, profile=False):
+    """Trace everything the scan does inside the with-block"""
+    if not enabled:
+        yield None
+        return
+
+    trace = Trace(name, profile=profile)
+    token = current_trace.set(trace)
+    if trace.profiler:
+        trace.profiler.start()
+    try:
+        with trace.span(name):
+            yield trace
+    finally:
+        if trace.profiler:
+            trace.profiler.stop()
+        current_trace.reset(token)
+
+@contextmanager
+def stage(name, **attributes):
+    """Time a scan stage into the metrics, and as a span when a trace is active"""
+    trace = current_trace.get()
+    with metrics.STAGE_SECONDS.time(stage=name):
+        if trace is None:
+            yield None
+        else:
+            with trace.span(name, **attributes) as span:
+                yield span
+
+def follow(fn):
+    """fn, made to be profiled with the current scan on whichever thread runs it
+
+    Wrap work handed to a pool with it; unless the scan is being profiled it
+    returns fn itself.
+    """
+    trace = current_trace.get()
+    if trace is None or trace.profiler is None:
+        return fn
+    profiler = trace.profiler
+
+    @functools.wraps(fn)
+    def profiled(*args, **kwargs):
+        thread_id = threading.get_ident()
+        profiler.add_thread(thread_id)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.remove_thread(thread_id)
+    return profiled
+
+def should_sample():
+    """Whether a request nobody asked to trace should be traced anyway"""
+    if SAMPLE_RATE <= 0:
+        return False
+    import random
+    return random.random() < SAMPLE_RATE
+
+def export_to_collector(trace):
+    """Send a finished trace to the OTLP/HTTP collector in the background"""
+    if not OTLP_ENDPOINT:
+        return
+
+    import urllib.request
+
+    def send():
+        body = json.dumps(trace.to_otlp()).encode("utf-8")
+        req = urllib.request.Request(OTLP_ENDPOINT.rstrip("/") + "/v1/traces", data=body,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(req, timeout=5).close()
+        except OSError:
+            # Telemetry must never break scanning
+            pass
+
+    threading.Thread(target=send, name="otlp-export", daemon=True).start()
@@ -0,0 +1,251 @@
+import asyncio
+import errno
+import socket
+import struct
+import sys
+import time
+
+# UDP has no handshake, so a port only answers when it gets a datagram it
+# understands.  These are minimal, protocol-correct requests for common services.
+
+def dns_query(name=b"", qtype=2, transaction_id=0x5244):
+    """Build a DNS query (defaults to a root NS query every resolver answers)"""
+    header = struct.pack(">HHHHHH", transaction_id, 0x0100, 1, 0, 0, 0)
+    labels = b"".join(bytes([len(label)]) + label for label in name.split(b".") if label)
+    return header + labels + b"\x00" + struct.pack(">HH", qtype, 1)
+
+def snmp_get_request(community=b"public"):
+    """Build an SNMPv1 get-request for sysDescr.0"""
+    def tlv(tag, value):
+        return bytes([tag, len(value)]) + value
+
+    oid = b"\x2b\x06\x01\x02\x01\x01\x01\x00"  # 1.3.6.1.2.1.1.1.0
+    varbind = tlv(0x30, tlv(0x06, oid) + b"\x05\x00")
+    pdu = tlv(0xa0, tlv(0x02, b"\x52\x43\x4e\x31") + tlv(0x02, b"\x00") + tlv(0x02, b"\x00")
+              + tlv(0x30, varbind))
+    return tlv(0x30, tlv(0x02, b"\x00") + tlv(0x04, community) + pdu)
+
+UDP_PAYLOADS = {
+    53: dns_query(),
+    67: b"\x01\x01\x06\x00" + b"\x00" * 232 + b"\x63\x82\x53\x63\x35\x01\x01\xff",  # DHCP discover
+    69: b"\x00\x01recon.txt\x00octet\x00",  # TFTP read request
+    111: struct.pack(">IIIIIIIIII", 0x5243, 0, 2, 100000, 2, 0, 0, 0, 0, 0),  # portmap NULL call
+    123: b"\x1b" + b"\x00" * 47,  # NTP v3 client request
+    137: (b"\x80\xf0\x00\x10\x00\x01\x00\x00\x00\x00\x00\x00\x20CK" + b"A" * 30
+          + b"\x00\x00\x21\x00\x01"),  # NetBIOS node status
+    161: snmp_get_request(),
+    520: b"\x01\x02\x00\x00" + b"\x00" * 16 + b"\x00\x00\x00\x10",  # RIPv2 full table request
+    1434: b"\x02",  # MSSQL browser
+    1900: (b"M-SEARCH * HTTP/1.1\r\nHOST: 239.255.255.250:1900\r\n"
+           b"MAN: \"ssdp:discover\"\r\nMX: 1\r\nST: ssdp:all\r\n\r\n"),
+    5353: dns_query(b"_services._dns-sd._udp.local", qtype=12),
+    11211: b"\x00\x01\x00\x00\x00\x01\x00\x00stats\r\n"  # memcached UDP stats
+}
+
+# Ports probed when no UDP port list is given
+UDP_COMMON_PORTS = [53, 161, 123, 137, 67, 69, 111, 500, 514, 520, 1434, 1900, 4500, 5353, 11211]
+
+# Possible UDP port states (same meaning as nmap)
+OPEN = "open"                    # the service answered
+CLOSED = "closed"                # ICMP port unreachable
+FILTERED = "filtered"            # some other ICMP unreachable (firewall)
+OPEN_FILTERED = "open|filtered"  # no answer at all, can't tell which
+
+# Linux value, not exported by the socket module on every Python version
+IP_RECVERR = getattr(socket, "IP_RECVERR", 11)
+SO_EE_ORIGIN_ICMP = 2
+
+class RttEstimator:
+    """Smoothed round trip time, used to pick retransmission timeouts (RFC 6298)"""
+
+    def __init__(self, initial_timeout=1.0, min_timeout=0.1, max_timeout=5.0):
+        self.srtt = None
+        self.rttvar = None
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+
+    def update(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def timeout(self, attempt=0):
+        if self.srtt is None:
+            base = self.initial_timeout
+        else:
+            base = self.srtt + 4 * self.rttvar
+        # Exponential backoff on every retransmission
+        return min(self.max_timeout, max(self.min_timeout, base) * (2 ** attempt))
+
+class CongestionWindow:
+    """Additive-increase / multiplicative-decrease limit on probes in flight"""
+
+    def __init__(self, maximum, minimum=4):
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.size = float(maximum)
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.size))
+            self.in_flight += 1
+
+    async def release(self, lost):
+        async with self.condition:
+            self.in_flight -= 1
+            if lost:
+                # An answer only came after a retransmission - the path is dropping
+                self.size = max(self.minimum, self.size / 2)
+            else:
+                self.size = min(self.maximum, self.size + 1)
+            self.condition.notify_all()
+
+class UdpProbeProtocol(asyncio.DatagramProtocol):
+    """Receives the answer (or the ICMP error) for one probed port"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.outcome = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        if not self.outcome.done():
+            self.outcome.set_result((OPEN, data))
+
+    def error_received(self, exc):
+        if not self.outcome.done():
+            self.outcome.set_result((classify_icmp_error(self.sock, exc), None))
+
+    def connection_lost(self, exc):
+        if not self.outcome.done():
+            self.outcome.set_result((OPEN_FILTERED, None))
+
+def classify_icmp_error(sock, exc):
+    """Turn an ICMP error reported on a UDP socket into a port state"""
+    # With IP_RECVERR the kernel keeps the original ICMP type/code in the error
+    # queue, which tells port unreachable apart from admin-prohibited filtering
+    try:
+        _, ancdata, _, _ = sock.recvmsg(512, 512, socket.MSG_ERRQUEUE)
+        for level, kind, data in ancdata:
+            if level == socket.IPPROTO_IP and kind == IP_RECVERR and len(data) >= 8:
+                ee_errno, origin, icmp_type, icmp_code = struct.unpack("=IBBB", data[:7])
+                if origin == SO_EE_ORIGIN_ICMP and icmp_type == 3:
+                    return CLOSED if icmp_code == 3 else FILTERED
+    except (OSError, AttributeError):
+        pass
+
+    # No error queue (not Linux) - fall back to the errno
+    if getattr(exc, "errno", None) == errno.ECONNREFUSED:
+        return CLOSED
+    return FILTERED
+
+def unprobed(port, error):
+    """The result of a port that couldn't be probed, so it still shows up in the scan"""
+    return {"port": port, "state": FILTERED, "reason": error.strerror or str(error), "attempts": 0}
+
+async def probe_udp_port(loop, ip, port, rtt, retries):
+    """Probe one UDP port, retransmitting until it answers or retries run out"""
+    sock = None
+    try:
+        # Creating the socket fails too when this machine is out of descriptors
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        if sys.platform.startswith("linux"):
+            sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+        # A connected socket is what makes the kernel report ICMP errors to us
+        sock.connect((ip, port))
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: UdpProbeProtocol(sock), sock=sock)
+    except OSError as e:
+        if sock is not None:
+            sock.close()
+        return unprobed(port, e)
+
+    payload = UDP_PAYLOADS.get(port, b"")
+    try:
+        for attempt in range(retries + 1):
+            sent = time.monotonic()
+            try:
+                # Straight to the socket: the transport silently drops empty datagrams
+                sock.send(payload)
+            except OSError as e:
+                # A pending ICMP error can surface on send instead of receive
+                protocol.error_received(e)
+            try:
+                state, data = await asyncio.wait_for(asyncio.shield(protocol.outcome),
+                                                     rtt.timeout(attempt))
+            except asyncio.TimeoutError:
+                continue
+
+            rtt.update(time.monotonic() - sent)
+            result = {"port": port, "state": state, "attempts": attempt + 1}
+            if data is not None:
+                result["response_bytes"] = len(data)
+            return result
+
+        return {"port": port, "state": OPEN_FILTERED, "attempts": retries + 1}
+    finally:
+        transport.close()
+
+async def iter_udp_scan(ip, ports, concurrency=100, retries=2, initial_timeout=1.0):
+    """Yield the state of every UDP port on the given IP address as it is known"""
+    loop = asyncio.get_running_loop()
+    rtt = RttEstimator(initial_timeout)
+    window = CongestionWindow(concurrency)
+    results = asyncio.Queue()
+
+    async def run(port):
+        await window.acquire()
+        result = None
+        try:
+            result = await probe_udp_port(loop, ip, port, rtt, retries)
+        except OSError as e:
+            # Every requested port gets a result, even one whose probe failed midway
+            result = unprobed(port, e)
+        finally:
+            await window.release(lost=bool(result) and result["attempts"] > 1
+                                 and result["state"] != OPEN_FILTERED)
+            await results.put(result)
+
+    # Tasks are started lazily so a huge port list doesn't create every task up front.
+    # The event loop only keeps weak references to tasks, so hold on to them here.
+    tasks = set()
+    pending = 0
+    for port in ports:
+        task = loop.create_task(run(port))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        pending += 1
+        if pending >= concurrency * 2:
+            result = await results.get()
+            pending -= 1
+            if result is not None:
+                yield result
+
+    while pending:
+        result = await results.get()
+        pending -= 1
+        if result is not None:
+            yield result
+
+def udp_scan(ip, ports=None, concurrency=100, retries=2, initial_timeout=1.0):
+    """Scan UDP ports on the given IP address and return every port's state"""
+    async def collect():
+        return [result async for result in iter_udp_scan(
+            ip, ports or UDP_COMMON_PORTS, concurrency, retries, initial_timeout)]
+
+    return sorted(asyncio.run(collect()), key=lambda result: result["port"])
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python udp_scan.py <ip address> [port,port,...]")
+        sys.exit(1)
+
+    target_ports = [int(p) for p in sys.argv[2].split(",")] if len(sys.argv) > 2 else None
+    for item in udp_scan(sys.argv[1], target_ports):
+        print(f"{item['port']}/udp  {item['state']}")
@@ -0,0 +1,91 @@
+from flask import Blueprint, Response, current_app, request, jsonify
+
+import deadlines
+import metrics
+import result_store
+import scan_engine
+import scheduler
+import tracing
+
+# What both web apps do around a scan: validating the request's budget and
+# priority, tracing, coalescing identical scans, admission control, storing
+# the result and the /metrics endpoint.  Each app only parses its own input
+# and runs its own scan stages (perform_scan).
+
+blueprint = Blueprint('web_scans', __name__)
+
+@blueprint.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def handle_scan(data, key, run_scan, *args):
+    """Answer a /scan request by running run_scan(*args, budget, job=...)
+
+    `key` names the target; together with the budget and priority it decides
+    which concurrent requests share one scan.
+    """
+    # Tracing is opt-in per request: {"trace": "json" | "otlp", "profile": true}
+    trace_format = data.get('trace') or request.args.get('trace')
+    profile = bool(data.get('profile') or request.args.get('profile'))
+    sampled = tracing.should_sample()
+
+    # Wall-clock budget for the whole scan: {"budget": seconds}, capped by the server
+    try:
+        budget = deadlines.scan_budget(data.get('budget'))
+    except (TypeError, ValueError) as e:
+        metrics.SCAN_REQUESTS.inc(status='invalid')
+        return jsonify({'error': f"Invalid budget: {e}"}), 400
+
+    # Someone waiting on the page is interactive; scheduled sweeps send {"priority": "bulk"}
+    priority = data.get('priority', scheduler.INTERACTIVE)
+    if priority not in scheduler.PRIORITIES:
+        metrics.SCAN_REQUESTS.inc(status='invalid')
+        return jsonify({'error': f"Unknown priority: {priority} (choose from {', '.join(scheduler.PRIORITIES)})"}), 400
+
+    with tracing.trace_scan('scan', enabled=bool(trace_format or profile or sampled),
+                            profile=profile) as trace:
+        # Every request scans with the same profile, so the target and budget are the whole key
+        result, status = coalesced_scan(key + (budget, priority), run_scan, *args, budget,
+                                        priority=priority)
+
+    if trace:
+        tracing.export_to_collector(trace)
+        if trace_format or profile:
+            result['trace'] = trace.export('otlp' if trace_format == 'otlp' else 'json')
+    return jsonify(result), status
+
+def coalesced_scan(key, run_scan, *args, priority=scheduler.INTERACTIVE):
+    """Join an identical scan that is already running, or start one"""
+    (result, status), shared = scheduler.coalesce(key, admit_and_scan, run_scan, *args, priority=priority)
+    if shared and status in (429, 503):
+        # The scan we joined was turned away for its own client; try on our own
+        return admit_and_scan(run_scan, *args, priority=priority)
+    # Copied so adding a trace doesn't change the response of the other requests
+    return dict(result), status
+
+def admit_and_scan(run_scan, *args, priority=scheduler.INTERACTIVE):
+    """Run a scan once the scheduler admits it, or explain why it was turned away"""
+    try:
+        with tracing.stage('admission'):
+            job = scheduler.admit(request.remote_addr or 'unknown', priority=priority)
+    except scheduler.AdmissionError as e:
+        metrics.SCAN_REQUESTS.inc(status='rejected')
+        # 429 when this client has too many scans, 503 when the scanner is full
+        return {'error': str(e)}, 429 if e.reason == 'client_quota' else 503
+
+    with job:
+        try:
+            return run_scan(*args, job=job)
+        except scan_engine.ResourceExhausted as e:
+            # Our own sockets ran out: say so instead of reporting ports as closed
+            metrics.SCAN_REQUESTS.inc(status='resource_exhausted')
+            return {'error': f"Scanner is out of sockets, try again later ({e})"}, 503
+
+def store_scan(target, result):
+    """Save a scan result to the result store and return its job id (None if that failed)"""
+    try:
+        return result_store.get_store().save_scan(target, result)
+    except result_store.StoreError as e:
+        # The scan itself succeeded; the caller still gets the whole result
+        current_app.logger.warning("Could not store the scan of %s: %s", target, e)
+        return None